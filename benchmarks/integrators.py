@@ -0,0 +1,183 @@
+"""Accuracy-vs-speed report of the fixed-step integrators of StateInitRandomSamplerSimulator.
+
+Every system preset is simulated from its preset initial state under the same
+sequence of random actions (piecewise constant over `sampling_time`), once with
+the default CasADi integrator and once per fixed-step method. Two errors with
+respect to the default integrator are reported: the one-step error, i.e. the
+largest deviation after a single step started from the reference trajectory,
+and the deviation of the whole trajectory at the final time. Most presets are
+open-loop unstable or chaotic under random actions, so the latter grows with
+the horizon even for accurate schemes.
+
+Usage (from the repository root):
+
+    python -m benchmarks.integrators --output notes/fixed_step_integrators.md
+
+With `--output`, the table replaces the lines between the markers
+`<!-- integrators-table-start -->` and `<!-- integrators-table-end -->` of the
+file, keeping the rest of it. A file without the markers is not overwritten.
+"""
+
+import argparse
+import time
+from pathlib import Path
+
+import numpy as np
+
+from src.simulator import StateInitRandomSamplerSimulator
+from .presets import list_system_presets, make_system, load_state_init, load_common
+
+
+def simulate(system, state_init, actions, sampling_time, fixed_step_method):
+    simulator = StateInitRandomSamplerSimulator(
+        system=system,
+        state_init=lambda: np.copy(state_init),
+        time_final=sampling_time * (len(actions) + 1),
+        max_step=sampling_time,
+        fixed_step_method=fixed_step_method,
+    )
+    reset_start = time.perf_counter()
+    simulator.reset()
+    reset_time = time.perf_counter() - reset_start
+
+    states = np.zeros((len(actions), system.dim_state))
+    step_time = 0.0
+    for step_id, action in enumerate(actions):
+        simulator.receive_action(action.reshape(1, -1))
+        step_start = time.perf_counter()
+        simulator.do_sim_step()
+        step_time += time.perf_counter() - step_start
+        states[step_id] = np.reshape(simulator.state, -1)
+    return simulator, states, step_time / len(actions), reset_time
+
+
+def one_step_errors(simulator, state_init, reference_states, actions):
+    states_before = np.vstack([state_init, reference_states[:-1]])
+    states_after = np.vstack(
+        [
+            simulator.integrator(x0=state, p=action)["xf"].full().reshape(-1)
+            for state, action in zip(states_before, actions)
+        ]
+    )
+    return np.abs(states_after - reference_states).max(axis=1)
+
+
+def compare_integrators(name: str, n_steps: int = None, seed: int = 0) -> list[dict]:
+    system = make_system(name)
+    state_init = load_state_init(name)
+    common = load_common(name)
+    sampling_time = common["sampling_time"]
+    if n_steps is None:
+        n_steps = int(round(common["time_final"] / sampling_time))
+    action_bounds = np.array(system.action_bounds)
+    actions = np.random.default_rng(seed).uniform(
+        low=action_bounds[:, 0],
+        high=action_bounds[:, 1],
+        size=(n_steps, len(action_bounds)),
+    )
+
+    _, reference_states, reference_step_time, reference_reset_time = simulate(
+        system, state_init, actions, sampling_time, fixed_step_method=None
+    )
+    rows = [
+        {
+            "system": name,
+            "method": "casadi (default)",
+            "step_us": reference_step_time * 1e6,
+            "reset_us": reference_reset_time * 1e6,
+            "speedup": 1.0,
+            "one_step_error": 0.0,
+            "final_error": 0.0,
+        }
+    ]
+    for method in StateInitRandomSamplerSimulator.fixed_step_methods:
+        try:
+            simulator, states, step_time, reset_time = simulate(
+                system, state_init, actions, sampling_time, fixed_step_method=method
+            )
+        except ValueError:
+            # The method is rejected for this system, e.g. semi_implicit_euler
+            continue
+        rows.append(
+            {
+                "system": name,
+                "method": method,
+                "step_us": step_time * 1e6,
+                "reset_us": reset_time * 1e6,
+                "speedup": reference_step_time / step_time,
+                "one_step_error": one_step_errors(
+                    simulator, state_init, reference_states, actions
+                ).max(),
+                "final_error": np.abs(states[-1] - reference_states[-1]).max(),
+            }
+        )
+    return rows
+
+
+def to_markdown(rows: list[dict]) -> str:
+    lines = [
+        "| system | method | step [us] | reset [us] | step speedup | one-step error | final state error |",
+        "|---|---|---|---|---|---|---|",
+    ]
+    for row in rows:
+        lines.append(
+            f"| {row['system']} | {row['method']} | {row['step_us']:.1f} "
+            f"| {row['reset_us']:.1f} | {row['speedup']:.2f} "
+            f"| {row['one_step_error']:.2e} | {row['final_error']:.2e} |"
+        )
+    return "\n".join(lines)
+
+
+TABLE_START = "<!-- integrators-table-start -->"
+TABLE_END = "<!-- integrators-table-end -->"
+
+
+def write_table(path: str, table: str) -> None:
+    """Replace the table between the markers of `path`, or create the file with it."""
+    path = Path(path)
+    section = f"{TABLE_START}\n{table}\n{TABLE_END}"
+    if not path.exists():
+        path.write_text(section + "\n")
+        return
+    text = path.read_text()
+    start, end = text.find(TABLE_START), text.find(TABLE_END)
+    if start < 0 or end < start:
+        raise ValueError(
+            f"{path} has no {TABLE_START} ... {TABLE_END} section to replace"
+        )
+    path.write_text(text[:start] + section + text[end + len(TABLE_END) :])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--systems",
+        nargs="*",
+        default=None,
+        help="System presets to compare (all presets by default).",
+    )
+    parser.add_argument(
+        "--n-steps",
+        type=int,
+        default=None,
+        help="Number of simulation steps (time_final / sampling_time by default).",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--output",
+        default=None,
+        help="Markdown file whose marked table section is replaced.",
+    )
+    args = parser.parse_args()
+
+    rows = []
+    for name in args.systems or list_system_presets():
+        rows += compare_integrators(name, n_steps=args.n_steps, seed=args.seed)
+    report = to_markdown(rows)
+    print(report)
+    if args.output is not None:
+        write_table(args.output, report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+"""Closed-loop evaluation of the nominal policies over many initial states.
+
+A system preset and a policy are run in closed loop from every initial state of
+a set, like `python run.py policy=<policy> system=<system>` would do for one of
+them, but without starting a new process per initial state. The rollouts are
+spread over a pool of worker processes, each of which builds the system and the
+simulator once (the integrator is shared through the cache of
+`StateInitRandomSamplerSimulator`) and a fresh policy per rollout.
+
+The initial states are either loaded from a `.npy` file or drawn around the
+preset initial state of the system (`presets/initial_conditions`) within
+`± spread` with `UniformStateInitGenerator` pools.
+
+For every rollout, the cost is the undiscounted value the regelum scenario
+would report, i.e. the sum of the running objective times `sampling_time`. The
+running objective is taken from `presets/running_objective`; systems without
+such a preset are scored with the squared norm of the observation. A rollout is
+a success if the final observation is within `goal_tolerance` of the origin in
+the max-norm, where the components listed in `angle_components` are first
+wrapped to [-pi, pi).
+
+Usage (from the repository root):
+
+    python -m benchmarks.policies \\
+        --system pendulum \\
+        --policy energy_based \\
+        --n-states 256 \\
+        --spread 1.0 0.5 \\
+        --angle-components 0 \\
+        --workers 8 \\
+        --output policy_report.json
+
+`--policy` is the name of a preset in `presets/policy` or, for policies
+without one (e.g. for the lunar lander), a policy nested in another preset such
+as `agent_calf/lunar_lander:safe_policy`, or the import path of the policy
+class, such as `src.policy.LunarLanderStabilizingPolicy`.
+"""
+
+import argparse
+import inspect
+import json
+import multiprocessing as mp
+import time
+from typing import Optional, Sequence
+
+import numpy as np
+
+from src.simulator import StateInitRandomSamplerSimulator, UniformStateInitGenerator
+from .presets import (
+    has_preset,
+    import_target,
+    instantiate,
+    load_common,
+    load_preset,
+    load_state_init,
+    make_system,
+)
+
+# Objects built once per worker process by `_init_worker`
+_worker = {}
+
+
+def make_policy(policy: str, system, common: dict):
+    """Instantiate a policy given by `policy`.
+
+    `policy` is either the name of a preset in `presets/policy`, a policy nested
+    in another preset written as `<group>/<name>:<key>` (e.g.
+    `agent_calf/lunar_lander:safe_policy`), or the import path of a policy class.
+    """
+    if ":" in policy:
+        preset, key = policy.split(":")
+        group, name = preset.split("/")
+        return instantiate(
+            load_preset(group, name, resolve=False)[key],
+            objects={"system": system},
+            groups={"common": common},
+        )
+    if has_preset("policy", policy):
+        return instantiate(
+            load_preset("policy", policy, resolve=False),
+            objects={"system": system},
+            groups={"common": common},
+        )
+    policy_class = import_target(policy)
+    if "system" in inspect.signature(policy_class).parameters:
+        return policy_class(system=system)
+    return policy_class()
+
+
+def make_running_objective(system_name: str, system, common: dict):
+    if has_preset("running_objective", system_name):
+        return instantiate(
+            load_preset("running_objective", system_name, resolve=False),
+            objects={"system": system},
+            groups={"common": common},
+        )
+    return lambda observation, action: float(np.sum(np.square(observation)))
+
+
+def initial_states(
+    system_name: str,
+    n_states: int,
+    spread: Sequence[float] = (0.0,),
+    sampling: str = "sobol",
+    seed: int = 0,
+    states_path: Optional[str] = None,
+) -> np.ndarray:
+    """Return the initial states of the evaluation, an array of shape `(N, dim_state)`."""
+    if states_path is not None:
+        return np.load(states_path).reshape(-1, make_system(system_name).dim_state)
+    center = load_state_init(system_name).reshape(-1)
+    spread = np.broadcast_to(np.asarray(spread, dtype=float), center.shape)
+    generator = UniformStateInitGenerator(
+        np.stack((center - spread, center + spread), axis=1),
+        pool_size=n_states,
+        sampling=sampling,
+        seed=seed,
+    )
+    return generator.pool
+
+
+def _init_worker(
+    system_name: str,
+    policy: str,
+    time_final: Optional[float],
+    fixed_step_method: Optional[str],
+    goal_tolerance: float,
+    angle_components: Sequence[int],
+) -> None:
+    system = make_system(system_name)
+    common = load_common(system_name)
+    _worker.update(
+        system=system,
+        common=common,
+        policy=policy,
+        running_objective=make_running_objective(system_name, system, common),
+        goal_tolerance=goal_tolerance,
+        angle_components=list(angle_components),
+        state_init=load_state_init(system_name),
+    )
+    _worker["simulator"] = StateInitRandomSamplerSimulator(
+        system=system,
+        state_init=lambda: np.copy(_worker["state_init"]),
+        time_final=common["time_final"] if time_final is None else time_final,
+        max_step=common["sampling_time"],
+        fixed_step_method=fixed_step_method,
+    )
+
+
+def evaluate_state(state_init: np.ndarray) -> dict:
+    """Run one closed loop from `state_init` in the objects of the current worker."""
+    system, simulator = _worker["system"], _worker["simulator"]
+    running_objective = _worker["running_objective"]
+    sampling_time = _worker["common"]["sampling_time"]
+    _worker["state_init"] = np.reshape(state_init, (1, -1))
+    simulator.reset()
+    policy = make_policy(_worker["policy"], system, _worker["common"])
+
+    observation = np.reshape(simulator.observation, (1, -1))
+    cost = 0.0
+    policy_times, simulation_times = [], []
+    while True:
+        policy_start = time.perf_counter()
+        action = system.apply_action_bounds(policy.get_action(observation))
+        simulation_start = time.perf_counter()
+        policy_times.append(simulation_start - policy_start)
+        cost += float(np.reshape(running_objective(observation, action), -1)[0])
+        simulator.receive_action(action)
+        episode_ended = simulator.do_sim_step() is not None
+        simulation_times.append(time.perf_counter() - simulation_start)
+        if episode_ended:
+            break
+        observation = np.reshape(simulator.observation, (1, -1))
+
+    goal_error = np.array(observation, dtype=float).reshape(-1)
+    angles = goal_error[_worker["angle_components"]]
+    goal_error[_worker["angle_components"]] = (angles + np.pi) % (2 * np.pi) - np.pi
+    return {
+        "state_init": np.reshape(state_init, -1).tolist(),
+        "cost": cost * sampling_time,
+        "success": bool(np.abs(goal_error).max() <= _worker["goal_tolerance"]),
+        "final_observation": observation.reshape(-1).tolist(),
+        "n_steps": len(policy_times),
+        "policy_times": policy_times,
+        "simulation_times": simulation_times,
+    }
+
+
+def _time_statistics(times: np.ndarray) -> dict:
+    return {
+        "mean": float(times.mean() * 1e6),
+        "p50": float(np.percentile(times, 50) * 1e6),
+        "p95": float(np.percentile(times, 95) * 1e6),
+        "p99": float(np.percentile(times, 99) * 1e6),
+    }
+
+
+def evaluate_policy(
+    system_name: str,
+    policy: str,
+    states: np.ndarray,
+    workers: int = 1,
+    time_final: Optional[float] = None,
+    fixed_step_method: Optional[str] = None,
+    goal_tolerance: float = 0.1,
+    angle_components: Sequence[int] = (),
+) -> dict:
+    """Run the closed loops from all `states` and summarize them in a report.
+
+    Args:
+        system_name: The name of the system preset.
+        policy: The name of the policy preset or the import path of the policy class.
+        states: The initial states, an array of shape `(N, dim_state)`.
+        workers: The number of worker processes. With 1, the rollouts run in
+            the current process.
+        time_final: The duration of a rollout. Defaults to the one of the
+            system's `common` preset.
+        fixed_step_method: See `StateInitRandomSamplerSimulator`.
+        goal_tolerance: The success tolerance on the final observation.
+        angle_components: The observation components wrapped to [-pi, pi)
+            before the success test.
+
+    Returns:
+        The report: aggregated cost, success rate and per-step compute times of
+        the policy and the simulator (in microseconds), and the outcome of
+        every rollout under `"rollouts"`.
+    """
+    init_args = (
+        system_name,
+        policy,
+        time_final,
+        fixed_step_method,
+        goal_tolerance,
+        angle_components,
+    )
+    start = time.perf_counter()
+    if workers > 1:
+        context = mp.get_context("fork")
+        with context.Pool(workers, initializer=_init_worker, initargs=init_args) as pool:
+            rollouts = pool.map(
+                evaluate_state,
+                list(states),
+                chunksize=max(1, len(states) // (4 * workers)),
+            )
+    else:
+        _init_worker(*init_args)
+        rollouts = [evaluate_state(state) for state in states]
+    wall_time = time.perf_counter() - start
+
+    costs = np.array([rollout["cost"] for rollout in rollouts])
+    policy_times = np.concatenate([rollout.pop("policy_times") for rollout in rollouts])
+    simulation_times = np.concatenate(
+        [rollout.pop("simulation_times") for rollout in rollouts]
+    )
+    return {
+        "system": system_name,
+        "policy": policy,
+        "n_states": len(rollouts),
+        "workers": workers,
+        "wall_time_s": wall_time,
+        "cost": {
+            "mean": float(costs.mean()),
+            "std": float(costs.std()),
+            "min": float(costs.min()),
+            "max": float(costs.max()),
+        },
+        "success_rate": float(np.mean([rollout["success"] for rollout in rollouts])),
+        "policy_step_time_us": _time_statistics(policy_times),
+        "simulation_step_time_us": _time_statistics(simulation_times),
+        "rollouts": rollouts,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--system", required=True, help="Name of the system preset.")
+    parser.add_argument(
+        "--policy",
+        required=True,
+        help="Name of the policy preset, <group>/<preset>:<key> of a nested "
+        "policy or import path of the policy class.",
+    )
+    parser.add_argument("--n-states", type=int, default=100)
+    parser.add_argument(
+        "--spread",
+        type=float,
+        nargs="+",
+        default=[0.0],
+        help="Half-width of the box of initial states around the preset one, "
+        "either one value or one per state component.",
+    )
+    parser.add_argument(
+        "--sampling", default="sobol", choices=UniformStateInitGenerator.samplings
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--states", help="A .npy file with initial states, replaces --n-states."
+    )
+    parser.add_argument("--workers", type=int, default=mp.cpu_count())
+    parser.add_argument("--time-final", type=float)
+    parser.add_argument(
+        "--fixed-step-method", choices=StateInitRandomSamplerSimulator.fixed_step_methods
+    )
+    parser.add_argument("--goal-tolerance", type=float, default=0.1)
+    parser.add_argument("--angle-components", type=int, nargs="*", default=[])
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    args = parser.parse_args()
+
+    states = initial_states(
+        args.system, args.n_states, args.spread, args.sampling, args.seed, args.states
+    )
+    report = evaluate_policy(
+        args.system,
+        args.policy,
+        states,
+        workers=args.workers,
+        time_final=args.time_final,
+        fixed_step_method=args.fixed_step_method,
+        goal_tolerance=args.goal_tolerance,
+        angle_components=args.angle_components,
+    )
+    summary = {key: value for key, value in report.items() if key != "rollouts"}
+    print(json.dumps(summary, indent=2))
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
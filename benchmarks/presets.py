@@ -0,0 +1,102 @@
+"""Helpers for building playground objects directly from the `presets` folder.
+
+The benchmarks instantiate systems and read simulation settings without going
+through `rg.main`, so that many configurations can be run in one process.
+Only a part of the preset syntax is supported: `_target_` (also nested),
+`= <python expression>` values, `${.<key>}` references to `<key>%%` values of the
+same preset, and `~ <name>` and `$ <group>.<key>` references to objects and
+values passed to `instantiate`.
+"""
+
+import importlib
+import re
+from pathlib import Path
+
+import numpy as np
+import omegaconf
+
+PRESETS_DIR = Path(__file__).parent.parent / "presets"
+
+
+def resolve_value(value):
+    """Evaluate a preset value written as `= <python expression>`."""
+    if isinstance(value, str) and value.startswith("="):
+        return eval(value[1:].strip(), {"np": np, "numpy": np})
+    return value
+
+
+def load_preset(group: str, name: str, resolve: bool = True) -> dict:
+    config = omegaconf.OmegaConf.to_container(
+        omegaconf.OmegaConf.load(PRESETS_DIR / group / f"{name}.yaml")
+    )
+    if not resolve:
+        return config
+    return {key: resolve_value(value) for key, value in config.items()}
+
+
+def has_preset(group: str, name: str) -> bool:
+    return (PRESETS_DIR / group / f"{name}.yaml").exists()
+
+
+def instantiate(config, objects: dict = None, groups: dict = None):
+    """Recursively instantiate a preset loaded with `load_preset(..., resolve=False)`.
+
+    Args:
+        config: The preset or a value inside it.
+        objects: Objects substituted for `~ <name>` values, e.g. `{"system": system}`.
+        groups: Presets substituted for `$ <group>.<key>` values, e.g.
+            `{"common": load_common("pendulum")}`.
+
+    Keys ending with `%%` are only substituted for `${.<key>}` in the values of
+    the same preset and are not passed to the target.
+    """
+    objects = objects or {}
+    groups = groups or {}
+    if isinstance(config, dict):
+        kwargs = {
+            key: instantiate(_interpolate(value, config), objects, groups)
+            for key, value in config.items()
+            if key != "_target_" and not key.endswith("%%")
+        }
+        if "_target_" in config:
+            return import_target(config["_target_"])(**kwargs)
+        return kwargs
+    if isinstance(config, list):
+        return [instantiate(value, objects, groups) for value in config]
+    if isinstance(config, str) and config.startswith("~"):
+        return objects[config[1:].strip()]
+    if isinstance(config, str) and config.startswith("$"):
+        group, key = config[1:].strip().split(".", 1)
+        return groups[group][key]
+    return resolve_value(config)
+
+
+def _interpolate(value, config: dict):
+    if not isinstance(value, str):
+        return value
+    return re.sub(r"\$\{\.([^}]+)\}", lambda match: str(config[match[1]]), value)
+
+
+def import_target(target: str):
+    module_name, class_name = target.rsplit(".", 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def list_system_presets() -> list[str]:
+    return sorted(path.stem for path in (PRESETS_DIR / "system").glob("*.yaml"))
+
+
+def make_system(name: str):
+    """Instantiate the system of a preset without attaching its animations."""
+    config = load_preset("system", name)
+    system_class = import_target(config.pop("_target_"))
+    return system_class(**config, _tracked=False)
+
+
+def load_state_init(name: str) -> np.ndarray:
+    state_init = load_preset("initial_conditions", name)["state_init"]
+    return np.array(state_init, dtype=float).reshape(1, -1)
+
+
+def load_common(name: str) -> dict:
+    return load_preset("common", name)
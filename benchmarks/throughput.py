@@ -0,0 +1,304 @@
+"""Simulation throughput benchmark over all system presets.
+
+Every system preset is run with a matching policy (see `SYSTEM_POLICIES`), the
+`casadi` simulator preset and the callbacks listed in `presets/main.yaml` in a
+regelum `Scenario` for a fixed number of steps, like `python run.py
+system=<system> policy=<policy>` would do, but without the Hydra startup. For
+every system, the report contains:
+
+- the number of steps per second,
+- the time per step spent in the ODE solver (`Simulator.do_sim_step`), in the
+  policy (`Policy.get_action`), in the callbacks, and elsewhere,
+- the peak resident memory of the process.
+
+Each system runs in a freshly spawned process, so that neither the timings nor
+the peak memory depend on the systems benchmarked before it.
+
+Usage (from the repository root):
+
+    python -m benchmarks.throughput --output baseline.json
+    python -m benchmarks.throughput --compare baseline.json
+
+With `--compare`, the results are compared with a saved report, and the
+command exits with status 1 if the throughput of any system dropped, or its
+peak memory grew, by more than `--tolerance` (10% by default).
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import platform
+import resource
+import sys
+import time
+import types
+from importlib.metadata import version
+from typing import Optional
+
+import numpy as np
+from regelum.__internal.base import RegelumBase
+from regelum.policy import Policy
+
+from .policies import make_policy, make_running_objective
+from .presets import (
+    import_target,
+    instantiate,
+    list_system_presets,
+    load_common,
+    load_preset,
+    load_state_init,
+    make_system,
+)
+
+# Policies used for the system presets. `random` samples uniformly from the
+# action bounds and is used for systems without a nominal policy
+SYSTEM_POLICIES = {
+    "3wrobot_dyn": "3wrobot_dyn_min_grad_clf",
+    "3wrobot_kin": "3wrobot_kin_min_grad_clf",
+    "3wrobot_kin_rg": "3wrobot_kin_min_grad_clf",
+    "3wrobot_kin_with_spot": "3wrobot_kin_min_grad_clf",
+    "cartpole_pg": "agent_calf/cartpole_pg:safe_policy",
+    "lunar_lander": "agent_calf/lunar_lander:safe_policy",
+    "pendulum": "energy_based",
+    "pendulum_loose_bounds": "pd",
+    "pendulum_with_friction": "energy_based_friction_compensation",
+    "pendulum_with_gym_observation": "random",
+    "pendulum_with_motor": "backstepping",
+}
+
+
+class RandomPolicy(Policy):
+    def __init__(self, action_bounds: np.ndarray, seed: int = 0):
+        super().__init__()
+        self.action_bounds = np.array(action_bounds)
+        self.rng = np.random.default_rng(seed)
+
+    def get_action(self, observation: np.ndarray) -> np.ndarray:
+        return self.rng.uniform(
+            self.action_bounds[:, 0], self.action_bounds[:, 1]
+        ).reshape(1, -1)
+
+
+class _TimedCallback:
+    """Proxy of a callback that accumulates the time spent in its calls."""
+
+    def __init__(self, callback, timings: dict):
+        self.callback = callback
+        self.timings = timings
+
+    def __call__(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.callback(*args, **kwargs)
+        finally:
+            self.timings["callbacks"] += time.perf_counter() - start
+
+    def __getattr__(self, name):
+        return getattr(self.callback, name)
+
+
+def _timed(function, timings: dict, key: str):
+    def timed_function(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings[key] += time.perf_counter() - start
+
+    return timed_function
+
+
+def _setup_callbacks(timings: dict, with_callbacks: bool) -> None:
+    """Register the callbacks of `presets/main.yaml` as `rg.main` would."""
+    RegelumBase._metadata = {
+        "argv": types.SimpleNamespace(parallel=True, interactive=False),
+        "logger": logging.getLogger("benchmarks.throughput"),
+        "main": types.SimpleNamespace(callbacks=[]),
+    }
+    if with_callbacks:
+        RegelumBase._metadata["main"].callbacks = [
+            _TimedCallback(import_target(target)(), timings)
+            for target in load_preset("", "main", resolve=False)["callbacks"]
+        ]
+
+
+def run_system(
+    system_name: str,
+    n_steps: int,
+    policy: Optional[str] = None,
+    with_callbacks: bool = True,
+) -> dict:
+    """Run one system preset for `n_steps` steps and return its measurements."""
+    timings = {"solver": 0.0, "policy": 0.0, "callbacks": 0.0}
+    _setup_callbacks(timings, with_callbacks)
+
+    policy = SYSTEM_POLICIES.get(system_name, "random") if policy is None else policy
+    system = make_system(system_name)
+    common = load_common(system_name)
+    if policy == "random":
+        policy_object = RandomPolicy(system.action_bounds)
+    else:
+        policy_object = make_policy(policy, system, common)
+    simulator = instantiate(
+        load_preset("simulator", "casadi", resolve=False),
+        objects={"system": system},
+        groups={
+            # Long enough for the episode not to end during the benchmark
+            "common": common | {"time_final": (n_steps + 1) * common["sampling_time"]},
+            "initial_conditions": {"state_init": load_state_init(system_name)},
+        },
+    )
+    scenario = instantiate(
+        load_preset("scenario", "scenario", resolve=False)
+        | {"running_objective": "~ running_objective"},
+        objects={
+            "policy": policy_object,
+            "simulator": simulator,
+            "running_objective": make_running_objective(system_name, system, common),
+        },
+        groups={"common": common},
+    )
+    simulator.do_sim_step = _timed(simulator.do_sim_step, timings, "solver")
+    policy_object.get_action = _timed(policy_object.get_action, timings, "policy")
+
+    start = time.perf_counter()
+    for _ in range(n_steps):
+        scenario.step()
+    total = time.perf_counter() - start
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_memory_mb = max_rss / (2**20 if sys.platform == "darwin" else 2**10)
+    return {
+        "policy": policy,
+        "n_steps": n_steps,
+        "steps_per_second": n_steps / total,
+        "step_time_us": {
+            "total": total / n_steps * 1e6,
+            "solver": timings["solver"] / n_steps * 1e6,
+            "policy": timings["policy"] / n_steps * 1e6,
+            "callbacks": timings["callbacks"] / n_steps * 1e6,
+            "other": (total - sum(timings.values())) / n_steps * 1e6,
+        },
+        "peak_memory_mb": peak_memory_mb,
+    }
+
+
+def run_benchmarks(
+    systems: list[str], n_steps: int, with_callbacks: bool = True
+) -> dict:
+    context = mp.get_context("spawn")
+    results = {}
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for system_name in systems:
+            # A broken preset should not prevent benchmarking the other systems
+            try:
+                results[system_name] = pool.apply(
+                    run_system, (system_name, n_steps, None, with_callbacks)
+                )
+            except Exception as error:
+                results[system_name] = {"error": f"{type(error).__name__}: {error}"}
+                print(f"{system_name}: {results[system_name]['error']}", file=sys.stderr)
+            else:
+                print(
+                    f"{system_name}: "
+                    f"{results[system_name]['steps_per_second']:.0f} steps/s",
+                    file=sys.stderr,
+                )
+    return {
+        "metadata": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "regelum-control": version("regelum-control"),
+            "casadi": version("casadi"),
+            "numpy": version("numpy"),
+            "n_steps": n_steps,
+            "callbacks": with_callbacks,
+        },
+        "results": results,
+    }
+
+
+def compare(report: dict, baseline: dict, tolerance: float = 0.1) -> list[str]:
+    """Return descriptions of the regressions of `report` with respect to `baseline`."""
+    regressions = []
+    for system_name, result in report["results"].items():
+        reference = baseline["results"].get(system_name, {"error": None})
+        if "error" in reference:
+            continue
+        if "error" in result:
+            regressions.append(f"{system_name}: {result['error']}")
+            continue
+        ratio = result["steps_per_second"] / reference["steps_per_second"]
+        if ratio < 1 - tolerance:
+            regressions.append(
+                f"{system_name}: {result['steps_per_second']:.0f} steps/s vs "
+                f"{reference['steps_per_second']:.0f} in the baseline ({ratio - 1:+.0%})"
+            )
+        memory_ratio = result["peak_memory_mb"] / reference["peak_memory_mb"]
+        if memory_ratio > 1 + tolerance:
+            regressions.append(
+                f"{system_name}: peak memory {result['peak_memory_mb']:.0f} MB vs "
+                f"{reference['peak_memory_mb']:.0f} MB in the baseline "
+                f"({memory_ratio - 1:+.0%})"
+            )
+    return regressions
+
+
+def to_table(report: dict) -> str:
+    lines = [
+        "| system | policy | steps/s | solver [us] | policy [us] | callbacks [us] "
+        "| other [us] | peak memory [MB] |",
+        "|---|---|---|---|---|---|---|---|",
+    ]
+    for system_name, result in report["results"].items():
+        if "error" in result:
+            lines.append(f"| {system_name} | {result['error']} |||||||")
+            continue
+        step_time = result["step_time_us"]
+        lines.append(
+            f"| {system_name} | {result['policy']} | {result['steps_per_second']:.0f} "
+            f"| {step_time['solver']:.1f} | {step_time['policy']:.1f} "
+            f"| {step_time['callbacks']:.1f} | {step_time['other']:.1f} "
+            f"| {result['peak_memory_mb']:.0f} |"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--systems",
+        nargs="+",
+        default=list_system_presets(),
+        help="System presets to benchmark (all by default).",
+    )
+    parser.add_argument("--n-steps", type=int, default=1000)
+    parser.add_argument(
+        "--no-callbacks",
+        action="store_true",
+        help="Do not register the callbacks of presets/main.yaml.",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    parser.add_argument("--compare", help="A JSON report to compare the results with.")
+    parser.add_argument("--tolerance", type=float, default=0.1)
+    args = parser.parse_args()
+
+    report = run_benchmarks(args.systems, args.n_steps, not args.no_callbacks)
+    print(to_table(report))
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as file:
+            regressions = compare(report, json.load(file), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
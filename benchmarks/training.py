@@ -0,0 +1,247 @@
+"""Training benchmark of SAC and TD3 in float32 and bfloat16 precision.
+
+SAC and TD3 are trained on pendulum presets with the `casadi_random_state_init`
+simulator preset, like `python run.py scenario=<algorithm>
+system=<system> simulator=casadi_random_state_init` would do, but without the
+Hydra startup and the callbacks, once per precision (`scenario.precision`) and
+seed. For every run, the report contains:
+
+- the number of gradient updates per second, measured over the updates only,
+- the number of environment steps per second of the whole run,
+- the final return, the mean episodic return of the last `--final-episodes`
+  episodes.
+
+The SAC runs use the hyperparameters of the SAC example of the README. Each run
+takes place in a freshly spawned process on the CPU, as the bfloat16 mode is
+meant for training nodes without GPUs. bfloat16 is faster than float32 only on
+CPUs with native bfloat16 matrix instructions (e.g. AVX512-BF16 or AMX), see
+`cpu_capability` in the metadata of the report.
+
+Usage (from the repository root):
+
+    python -m benchmarks.training --total-timesteps 30000 --seeds 1 2 3 \\
+        --output training.json
+"""
+
+import argparse
+import json
+import logging
+import multiprocessing as mp
+import platform
+import sys
+import time
+import types
+from importlib.metadata import version
+
+import numpy as np
+import torch
+from regelum.__internal.base import RegelumBase
+
+from .policies import make_running_objective
+from .presets import instantiate, load_common, load_preset, make_system
+
+PRECISIONS = ("float32", "bfloat16")
+
+# Overrides of the scenario presets, those of the examples of the README
+SCENARIO_OVERRIDES = {
+    "sac": {"autotune": False, "policy_lr": 0.00079, "q_lr": 0.00025, "alpha": 0.0085},
+    "td3": {},
+}
+
+
+def run_training(
+    algorithm: str,
+    system_name: str,
+    precision: str,
+    seed: int,
+    total_timesteps: int,
+    learning_starts: int,
+    final_episodes: int,
+) -> dict:
+    """Train `algorithm` on `system_name` and return the measurements of the run."""
+    RegelumBase._metadata = {
+        "argv": types.SimpleNamespace(parallel=True, interactive=False),
+        "logger": logging.getLogger("benchmarks.training"),
+        "main": types.SimpleNamespace(callbacks=[]),
+    }
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+    system = make_system(system_name)
+    common = load_common(system_name)
+    simulator_preset = load_preset("simulator", "casadi_random_state_init", False)
+    simulator_preset.pop("defaults")
+    simulator_preset["state_init"] = load_preset(
+        "simulator/state_init", "pendulum", resolve=False
+    )
+    simulator = instantiate(
+        simulator_preset, objects={"system": system}, groups={"common": common}
+    )
+    scenario = instantiate(
+        load_preset("scenario", algorithm, resolve=False)
+        | SCENARIO_OVERRIDES[algorithm]
+        | {
+            "device": "cpu",
+            "total_timesteps": total_timesteps,
+            "learning_starts": learning_starts,
+            "precision": precision,
+        },
+        objects={
+            "simulator": simulator,
+            "running_objective": make_running_objective(system_name, system, common),
+        },
+    )
+
+    returns = []
+    scenario.save_episodic_return = lambda episodic_return, global_step: (
+        returns.append(float(np.reshape(episodic_return, -1)[0]))
+    )
+    train_step = scenario.train_step
+    update_time = 0.0
+
+    def timed_train_step(*args, **kwargs):
+        nonlocal update_time
+        start = time.perf_counter()
+        try:
+            return train_step(*args, **kwargs)
+        finally:
+            update_time += time.perf_counter() - start
+
+    scenario.train_step = timed_train_step
+
+    start = time.perf_counter()
+    scenario.run()
+    total = time.perf_counter() - start
+    return {
+        "updates_per_second": scenario.num_updates / update_time,
+        "steps_per_second": total_timesteps / total,
+        "num_updates": scenario.num_updates,
+        "final_return": float(np.mean(returns[-final_episodes:])),
+        "episodic_returns": returns,
+    }
+
+
+def run_benchmarks(
+    algorithms: list[str],
+    system_name: str,
+    seeds: list[int],
+    total_timesteps: int,
+    learning_starts: int,
+    final_episodes: int,
+) -> dict:
+    context = mp.get_context("spawn")
+    results = {}
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for algorithm in algorithms:
+            for precision in PRECISIONS:
+                runs = []
+                for seed in seeds:
+                    runs.append(
+                        pool.apply(
+                            run_training,
+                            (
+                                algorithm,
+                                system_name,
+                                precision,
+                                seed,
+                                total_timesteps,
+                                learning_starts,
+                                final_episodes,
+                            ),
+                        )
+                    )
+                    print(
+                        f"{algorithm} {precision} seed {seed}: "
+                        f"{runs[-1]['updates_per_second']:.0f} updates/s, "
+                        f"final return {runs[-1]['final_return']:.1f}",
+                        file=sys.stderr,
+                    )
+                final_returns = [run["final_return"] for run in runs]
+                results[f"{algorithm}/{precision}"] = {
+                    "algorithm": algorithm,
+                    "precision": precision,
+                    "updates_per_second": float(
+                        np.mean([run["updates_per_second"] for run in runs])
+                    ),
+                    "steps_per_second": float(
+                        np.mean([run["steps_per_second"] for run in runs])
+                    ),
+                    "final_return": {
+                        "mean": float(np.mean(final_returns)),
+                        "std": float(np.std(final_returns)),
+                    },
+                    "runs": dict(zip(map(str, seeds), runs)),
+                }
+    return {
+        "metadata": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "torch": version("torch"),
+            "cpu_capability": torch.backends.cpu.get_cpu_capability(),
+            "num_threads": torch.get_num_threads(),
+            "system": system_name,
+            "seeds": seeds,
+            "total_timesteps": total_timesteps,
+            "learning_starts": learning_starts,
+        },
+        "results": results,
+    }
+
+
+def to_table(report: dict) -> str:
+    lines = [
+        "| algorithm | precision | updates/s | speedup | steps/s | final return |",
+        "|---|---|---|---|---|---|",
+    ]
+    results = report["results"]
+    for result in results.values():
+        reference = results[f"{result['algorithm']}/float32"]
+        speedup = result["updates_per_second"] / reference["updates_per_second"]
+        lines.append(
+            f"| {result['algorithm']} | {result['precision']} "
+            f"| {result['updates_per_second']:.0f} | {speedup:.2f}x "
+            f"| {result['steps_per_second']:.0f} "
+            f"| {result['final_return']['mean']:.1f} "
+            f"± {result['final_return']['std']:.1f} |"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument(
+        "--algorithms",
+        nargs="+",
+        default=list(SCENARIO_OVERRIDES),
+        choices=SCENARIO_OVERRIDES,
+    )
+    parser.add_argument("--system", default="pendulum_with_gym_observation")
+    parser.add_argument("--seeds", type=int, nargs="+", default=[1])
+    parser.add_argument("--total-timesteps", type=int, default=30000)
+    parser.add_argument("--learning-starts", type=int, default=5000)
+    parser.add_argument(
+        "--final-episodes",
+        type=int,
+        default=5,
+        help="Number of last episodes averaged in the final return.",
+    )
+    parser.add_argument("--output", help="Write the JSON report to this file.")
+    args = parser.parse_args()
+
+    report = run_benchmarks(
+        args.algorithms,
+        args.system,
+        args.seeds,
+        args.total_timesteps,
+        args.learning_starts,
+        args.final_episodes,
+    )
+    print(to_table(report))
+    if args.output is not None:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -60,7 +60,18 @@ def angle_normalize(angle):
 
 
 class GymPendulumRunningObjective:
-    def __call__(self, observation, action):
+    def __call__(self, observation, action, is_save_batch_format: bool = False):
+        if is_save_batch_format:
+            # One cost per row of the batch
+            if observation.shape[1] == 3:
+                angle = np.arctan2(observation[:, 1], observation[:, 0])
+            elif observation.shape[1] == 2:
+                angle = observation[:, 0]
+            else:
+                raise ValueError("Invalid observation shape")
+            angle_vel = observation[:, -1]
+            torque = action[:, 0]
+            return angle_normalize(angle) ** 2 + 0.1 * angle_vel**2 + 0.001 * torque**2
         if observation.shape[1] == 3:
             cos_angle = observation[0, 0]
             sin_angle = observation[0, 1]
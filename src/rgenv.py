@@ -1,7 +1,12 @@
 from typing import Optional
-from regelum.simulator import Simulator
+from regelum.simulator import Simulator, CasADi
+from regelum.utils import rg
 import gymnasium as gym
 import numpy as np
+import casadi
+import ctypes
+import multiprocessing as mp
+import traceback
 from typing import Callable
 
 
@@ -30,19 +35,537 @@ class RgEnv(gym.Env):
             self.observation_space = observation_space
 
     def step(self, u):
-        self.simulator.receive_action(
-            self.simulator.system.apply_action_bounds(u.reshape(1, -1))
-        )
-        costs = self.running_objective(self._get_obs().reshape(1, -1), u.reshape(1, -1))
+        u = u.reshape(1, -1)
+        self.simulator.receive_action(self.simulator.system.apply_action_bounds(u))
+        costs = self.running_objective(self.observation.reshape(1, -1), u)
         sim_step = self.simulator.do_sim_step()
         self.state = np.copy(self.simulator.state).reshape(-1)
-        return self._get_obs(), -costs, False, sim_step is not None, {}
+        self.observation = self._get_obs()
+        return self.observation, -costs, False, sim_step is not None, {}
 
     def reset(self, *, seed: Optional[int] = None, options: Optional[dict] = None):
         super().reset(seed=seed)
         self.simulator.reset()
         self.state = np.copy(self.simulator.state).reshape(-1)
-        return self._get_obs(), {}
+        self.observation = self._get_obs()
+        return self.observation, {}
+
+    def allocate_step_buffers(self) -> dict[str, np.ndarray]:
+        """Allocate buffers for `step_into` and `reset_into`.
+
+        Returns:
+            A dictionary with a row vector `"observation"`, a row vector `"state"`
+            and one-element arrays `"reward"` and `"time"`.
+        """
+        return {
+            "observation": np.zeros((1, self.simulator.system.dim_observation)),
+            "state": np.zeros((1, self.simulator.system.dim_state)),
+            "reward": np.zeros(1),
+            "time": np.zeros(1),
+        }
+
+    def step_into(
+        self,
+        u: np.ndarray,
+        observation: np.ndarray,
+        state: np.ndarray,
+        reward: np.ndarray,
+        time: np.ndarray,
+    ) -> bool:
+        """Do the same as `step`, but write the results into preallocated buffers.
+
+        This is a fast path for loops that drive a single RgEnv directly. Instead
+        of returning fresh arrays and an info dict, the observation, state, reward
+        and simulation time after the step are written into the given buffers
+        (see `allocate_step_buffers`). Afterwards, `self.observation` and
+        `self.state` are views of the `observation` and `state` buffers, so a
+        caller that needs the data from before the step should alternate between
+        two sets of buffers.
+
+        Unlike with `gym.vector.SyncVectorEnv`, there is no autoreset: once this
+        method returns True, the caller is expected to call `reset_into`.
+
+        Args:
+            u: The action.
+            observation: The buffer for the observation.
+            state: The buffer for the state.
+            reward: The one-element buffer for the reward.
+            time: The one-element buffer for the simulation time.
+
+        Returns:
+            Whether the episode is truncated.
+        """
+        u = u.reshape(1, -1)
+        self.simulator.receive_action(self.simulator.system.apply_action_bounds(u))
+        reward[0] = -np.asarray(
+            self.running_objective(self.observation.reshape(1, -1), u)
+        ).item()
+        sim_step = self.simulator.do_sim_step()
+        self._write_into(observation, state, time)
+        return sim_step is not None
+
+    def reset_into(
+        self, observation: np.ndarray, state: np.ndarray, time: np.ndarray
+    ) -> None:
+        """Do the same as `reset`, but write the results into preallocated buffers.
+
+        Args:
+            observation: The buffer for the initial observation.
+            state: The buffer for the initial state.
+            time: The one-element buffer for the simulation time.
+        """
+        super().reset()
+        self.simulator.reset()
+        self._write_into(observation, state, time)
+
+    def _write_into(
+        self, observation: np.ndarray, state: np.ndarray, time: np.ndarray
+    ) -> None:
+        np.copyto(state, np.reshape(self.simulator.state, state.shape))
+        self.state = state.reshape(-1)
+        np.copyto(observation, np.reshape(self._get_obs(), observation.shape))
+        self.observation = observation.reshape(-1)
+        time[0] = self.simulator.time
 
     def _get_obs(self):
         return self.simulator.system._get_observation(None, self.state, None)
+
+
+class BatchedRgEnv(gym.vector.VectorEnv):
+    """Vectorized environment that simulates `num_envs` copies of one system at once.
+
+    The states of all copies are stored in a single `(num_envs, dim_state)` array
+    and advanced together by one call of the simulator's CasADi integrator mapped
+    over the batch, so that a step costs one integrator call instead of one
+    `RgEnv.step` per copy.
+
+    Every copy is reset on its own once its episode ends (autoreset). As with
+    `RgEnv`, an episode ends on the step after the one reaching
+    `simulator.time_final`, which does not advance the state: the simulator
+    refuses to step past the final time and `RgEnv` reports the truncation then,
+    so episodes have the same length and returns for any `num_envs`. One
+    difference remains: on that step, the simulator of `RgEnv` resets itself, so
+    its final observation is the one of a newly sampled initial state, whereas
+    here it is the one of the state at the final time. As in `gym.vector.SyncVectorEnv`, the last observation of a
+    finished episode is returned in `infos["final_observation"]` and its
+    statistics in `infos["final_info"]` under the `"episode"` key, like
+    `gym.wrappers.RecordEpisodeStatistics` does.
+    """
+
+    def __init__(
+        self,
+        simulator: CasADi,
+        running_objective: Callable[[np.ndarray, np.ndarray], float],
+        num_envs: int,
+        action_space: Optional[gym.spaces.Box] = None,
+        observation_space: Optional[gym.spaces.Box] = None,
+    ) -> None:
+        """Initialize the BatchedRgEnv.
+
+        Args:
+            simulator: The simulator whose system, integrator settings and initial
+                state sampler are shared by all copies. The simulator itself is
+                not stepped.
+            running_objective: The running objective used to compute rewards.
+            num_envs: The number of simulated copies.
+            action_space: The action space of a single copy. Defaults to the
+                system's action bounds.
+            observation_space: The observation space of a single copy.
+        """
+        self.simulator = simulator
+        self.system = simulator.system
+        self.running_objective = running_objective
+        action_bounds = np.array(self.system._action_bounds)
+        if action_space is None:
+            action_space = gym.spaces.Box(
+                low=action_bounds[:, 0], high=action_bounds[:, 1]
+            )
+        if observation_space is None:
+            observation_space = gym.spaces.Box(
+                low=-np.inf, high=np.inf, shape=(self.system._dim_observation,)
+            )
+        super().__init__(num_envs, observation_space, action_space)
+
+        # The number of integration steps of an episode. The solver of the
+        # simulator adds `max_step` to its time and steps while it is below
+        # `time_final`, so the rounding of the sum is reproduced
+        self.episode_length, time = 0, 0.0
+        while time < simulator.time_final:
+            time += simulator.max_step
+            self.episode_length += 1
+        state_symbolic = rg.array_symb(self.system.dim_state, literal="x")
+        action_symbolic = rg.array_symb(self.system.dim_inputs, literal="u")
+        integrator = simulator.create_CasADi_integrator(simulator.max_step)
+        self.batched_step = casadi.Function(
+            "batched_step",
+            [state_symbolic, action_symbolic],
+            [integrator(x0=state_symbolic, p=action_symbolic)["xf"]],
+        ).map(num_envs)
+        self.batched_observation = casadi.Function(
+            "batched_observation",
+            [state_symbolic],
+            [
+                self.system.get_observation(
+                    None, state_symbolic, None, _native_dim=True
+                )
+            ],
+        ).map(num_envs)
+
+        self.state = np.zeros((num_envs, self.system.dim_state))
+        self.observations = np.zeros((num_envs, self.system.dim_observation))
+        self.step_ids = np.zeros(num_envs, dtype=int)
+        self.episode_returns = np.zeros(num_envs)
+        # Whether the running objective evaluates a batch in one call, decided
+        # on the first step
+        self.is_batched_running_objective = None
+
+    @property
+    def time(self) -> np.ndarray:
+        return self.step_ids * self.simulator.max_step
+
+    def reset_wait(
+        self, seed: Optional[int] = None, options: Optional[dict] = None
+    ) -> tuple[np.ndarray, dict]:
+        self._reset_envs(np.arange(self.num_envs))
+        return self.observations.copy(), {}
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self._actions = self.system.apply_action_bounds(
+            np.asarray(actions).reshape(self.num_envs, -1)
+        )
+
+    def step_wait(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, dict]:
+        # Like in `RgEnv.step`, the reward is the negated cost of the observation
+        # before the step and the action applied during the step
+        rewards = -self._compute_costs(self.observations, self._actions)
+        # Copies at the final time stay where they are, like the simulator of
+        # `RgEnv` on its last, truncated step
+        truncations = self.step_ids >= self.episode_length
+        next_state = self.batched_step(self.state.T, self._actions.T).full().T
+        if truncations.any():
+            next_state[truncations] = self.state[truncations]
+        self.state = next_state
+        self.observations = self._get_obs(self.state)
+        self.step_ids += 1
+        self.episode_returns += rewards
+
+        terminations = np.zeros(self.num_envs, dtype=bool)
+        infos = {}
+        if truncations.any():
+            final_observation = np.full(self.num_envs, None, dtype=object)
+            final_info = np.full(self.num_envs, None, dtype=object)
+            for idx in np.flatnonzero(truncations):
+                final_observation[idx] = self.observations[idx].copy()
+                final_info[idx] = {
+                    "episode": {
+                        "r": self.episode_returns[idx],
+                        "l": self.step_ids[idx],
+                    }
+                }
+            infos = {
+                "final_observation": final_observation,
+                "_final_observation": truncations.copy(),
+                "final_info": final_info,
+                "_final_info": truncations.copy(),
+            }
+            self._reset_envs(np.flatnonzero(truncations))
+
+        return self.observations.copy(), rewards, terminations, truncations, infos
+
+    def _reset_envs(self, indices: np.ndarray) -> None:
+        for idx in indices:
+            self.state[idx] = np.reshape(self._sample_state_init(), -1)
+        self.step_ids[indices] = 0
+        self.episode_returns[indices] = 0.0
+        self.observations = self._get_obs(self.state)
+
+    def _sample_state_init(self) -> np.ndarray:
+        if hasattr(self.simulator, "state_init_callable"):
+            return self.simulator.state_init_callable()
+        return self.simulator.state_init
+
+    def _get_obs(self, state: np.ndarray) -> np.ndarray:
+        if hasattr(self.system, "get_observation_batch"):
+            return self.system.get_observation_batch(state)
+        return self.batched_observation(state.T).full().T
+
+    def _compute_costs(self, observations: np.ndarray, actions: np.ndarray):
+        # Running objectives supporting regelum's batch format are evaluated on
+        # all the copies in one call. The first step checks it against the
+        # row-by-row evaluation, which is kept for the other objectives
+        if self.is_batched_running_objective is False:
+            return self._compute_costs_by_row(observations, actions)
+        try:
+            costs = np.asarray(
+                self.running_objective(
+                    observations, actions, is_save_batch_format=True
+                ),
+                dtype=float,
+            )
+        except TypeError:
+            costs = None
+        if self.is_batched_running_objective is None:
+            row_costs = self._compute_costs_by_row(observations, actions)
+            self.is_batched_running_objective = (
+                costs is not None
+                and costs.size == self.num_envs
+                and np.allclose(costs.reshape(-1), row_costs)
+            )
+            return row_costs
+        return costs.reshape(-1)
+
+    def _compute_costs_by_row(self, observations: np.ndarray, actions: np.ndarray):
+        return np.array(
+            [
+                float(
+                    self.running_objective(
+                        observation.reshape(1, -1), action.reshape(1, -1)
+                    )
+                )
+                for observation, action in zip(observations, actions)
+            ]
+        )
+
+
+def _shared_array(
+    shape: tuple[int, ...], ctype=ctypes.c_double, dtype=np.float64
+) -> np.ndarray:
+    """Allocate a zero-initialized array in memory shared with forked processes."""
+    buffer = mp.get_context("fork").RawArray(ctype, int(np.prod(shape)))
+    return np.frombuffer(buffer, dtype=dtype).reshape(shape)
+
+
+def _rollout_worker(
+    pipe,
+    simulator: CasADi,
+    running_objective: Callable[[np.ndarray, np.ndarray], float],
+    buffers: dict[str, np.ndarray],
+    rows: slice,
+    seed: int,
+    worker_index: int,
+    num_workers: int,
+) -> None:
+    """Simulate the copies `rows` of a SharedMemoryRgEnv in a BatchedRgEnv.
+
+    Actions are read from and results are written to the `rows` of the shared
+    `buffers`. The pipe only carries the commands `"reset"`, `"step"` and
+    `"close"` and an acknowledgement (None or a formatted exception) per command.
+
+    If the initial state sampler of the simulator can be sharded (like a
+    `UniformStateInitGenerator` with a pool), the worker only uses its own shard.
+    """
+    try:
+        np.random.seed(seed)
+        if hasattr(getattr(simulator, "state_init_callable", None), "shard"):
+            simulator.state_init_callable = simulator.state_init_callable.shard(
+                worker_index, num_workers
+            )
+        env = BatchedRgEnv(simulator, running_objective, rows.stop - rows.start)
+        views = {name: buffer[rows] for name, buffer in buffers.items()}
+    except Exception:
+        pipe.send(traceback.format_exc())
+        return
+    pipe.send(None)
+
+    while True:
+        command = pipe.recv()
+        if command == "close":
+            pipe.send(None)
+            return
+        try:
+            if command == "reset":
+                observations, _ = env.reset()
+            elif command == "step":
+                observations, rewards, _, truncations, infos = env.step(
+                    views["actions"]
+                )
+                views["rewards"][:] = rewards
+                views["truncations"][:] = truncations
+                for idx in np.flatnonzero(truncations):
+                    views["final_observations"][idx] = infos["final_observation"][idx]
+                    views["final_returns"][idx] = infos["final_info"][idx]["episode"][
+                        "r"
+                    ]
+                    views["final_lengths"][idx] = infos["final_info"][idx]["episode"][
+                        "l"
+                    ]
+            else:
+                raise ValueError(f"Unknown command {command}")
+            views["observations"][:] = observations
+            views["state"][:] = env.state
+            views["step_ids"][:] = env.step_ids
+        except Exception:
+            pipe.send(traceback.format_exc())
+        else:
+            pipe.send(None)
+
+
+class SharedMemoryRgEnv(gym.vector.VectorEnv):
+    """Vectorized environment that simulates `num_envs` copies of one system in worker processes.
+
+    The copies are split as evenly as possible among `num_workers` processes,
+    each of which simulates its share in a BatchedRgEnv. Observations, actions,
+    rewards and episode statistics of all copies live in preallocated arrays in
+    shared memory, so that a step only sends a short command to every worker
+    instead of pickling the data.
+
+    The workers are forked from the current process and inherit the simulator
+    and the running objective, which therefore do not need to be picklable. Each
+    worker reseeds NumPy with a seed drawn from the global NumPy random
+    generator of the current process, so runs are reproducible given a seed.
+
+    Autoreset and the `infos` of finished episodes are the same as in BatchedRgEnv.
+    """
+
+    def __init__(
+        self,
+        simulator: CasADi,
+        running_objective: Callable[[np.ndarray, np.ndarray], float],
+        num_envs: int,
+        num_workers: int,
+        action_space: Optional[gym.spaces.Box] = None,
+        observation_space: Optional[gym.spaces.Box] = None,
+    ) -> None:
+        """Initialize the SharedMemoryRgEnv and start the worker processes.
+
+        Args:
+            simulator: The simulator whose system, integrator settings and initial
+                state sampler are shared by all copies. The simulator itself is
+                not stepped.
+            running_objective: The running objective used to compute rewards.
+            num_envs: The number of simulated copies.
+            num_workers: The number of worker processes. Must not exceed
+                `num_envs`.
+            action_space: The action space of a single copy. Defaults to the
+                system's action bounds.
+            observation_space: The observation space of a single copy.
+        """
+        if not 1 <= num_workers <= num_envs:
+            raise ValueError(
+                f"num_workers must be between 1 and num_envs={num_envs}, "
+                f"got {num_workers}"
+            )
+        self.simulator = simulator
+        self.system = simulator.system
+        action_bounds = np.array(self.system._action_bounds)
+        if action_space is None:
+            action_space = gym.spaces.Box(
+                low=action_bounds[:, 0], high=action_bounds[:, 1]
+            )
+        if observation_space is None:
+            observation_space = gym.spaces.Box(
+                low=-np.inf, high=np.inf, shape=(self.system._dim_observation,)
+            )
+        super().__init__(num_envs, observation_space, action_space)
+
+        dim_observation = self.system.dim_observation
+        self.buffers = {
+            "observations": _shared_array((num_envs, dim_observation)),
+            "actions": _shared_array((num_envs, self.system.dim_inputs)),
+            "rewards": _shared_array((num_envs,)),
+            "truncations": _shared_array((num_envs,), ctypes.c_bool, np.bool_),
+            "state": _shared_array((num_envs, self.system.dim_state)),
+            "step_ids": _shared_array((num_envs,), ctypes.c_int64, np.int64),
+            "final_observations": _shared_array((num_envs, dim_observation)),
+            "final_returns": _shared_array((num_envs,)),
+            "final_lengths": _shared_array((num_envs,), ctypes.c_int64, np.int64),
+        }
+
+        context = mp.get_context("fork")
+        bounds = np.linspace(0, num_envs, num_workers + 1).astype(int)
+        seeds = np.random.randint(2**31 - 1, size=num_workers)
+        self.pipes = []
+        self.processes = []
+        for worker_index, (start, stop, seed) in enumerate(
+            zip(bounds[:-1], bounds[1:], seeds)
+        ):
+            parent_pipe, child_pipe = context.Pipe()
+            process = context.Process(
+                target=_rollout_worker,
+                args=(
+                    child_pipe,
+                    simulator,
+                    running_objective,
+                    self.buffers,
+                    slice(start, stop),
+                    int(seed),
+                    worker_index,
+                    num_workers,
+                ),
+                daemon=True,
+            )
+            process.start()
+            child_pipe.close()
+            self.pipes.append(parent_pipe)
+            self.processes.append(process)
+        self._wait()
+
+    @property
+    def state(self) -> np.ndarray:
+        return self.buffers["state"]
+
+    @property
+    def time(self) -> np.ndarray:
+        return self.buffers["step_ids"] * self.simulator.max_step
+
+    def reset_async(
+        self, seed: Optional[int] = None, options: Optional[dict] = None
+    ) -> None:
+        self._send("reset")
+
+    def reset_wait(
+        self, seed: Optional[int] = None, options: Optional[dict] = None
+    ) -> tuple[np.ndarray, dict]:
+        self._wait()
+        return self.buffers["observations"].copy(), {}
+
+    def step_async(self, actions: np.ndarray) -> None:
+        self.buffers["actions"][:] = np.asarray(actions).reshape(self.num_envs, -1)
+        self._send("step")
+
+    def step_wait(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, dict]:
+        self._wait()
+        truncations = self.buffers["truncations"].copy()
+        terminations = np.zeros(self.num_envs, dtype=bool)
+        infos = {}
+        if truncations.any():
+            final_observation = np.full(self.num_envs, None, dtype=object)
+            final_info = np.full(self.num_envs, None, dtype=object)
+            for idx in np.flatnonzero(truncations):
+                final_observation[idx] = self.buffers["final_observations"][idx].copy()
+                final_info[idx] = {
+                    "episode": {
+                        "r": self.buffers["final_returns"][idx],
+                        "l": self.buffers["final_lengths"][idx],
+                    }
+                }
+            infos = {
+                "final_observation": final_observation,
+                "_final_observation": truncations.copy(),
+                "final_info": final_info,
+                "_final_info": truncations.copy(),
+            }
+        return (
+            self.buffers["observations"].copy(),
+            self.buffers["rewards"].copy(),
+            terminations,
+            truncations,
+            infos,
+        )
+
+    def close_extras(self, **kwargs) -> None:
+        for pipe, process in zip(self.pipes, self.processes):
+            if process.is_alive():
+                pipe.send("close")
+                pipe.recv()
+            process.join()
+            pipe.close()
+
+    def _send(self, command: str) -> None:
+        for pipe in self.pipes:
+            pipe.send(command)
+
+    def _wait(self) -> None:
+        errors = [error for error in (pipe.recv() for pipe in self.pipes) if error]
+        if errors:
+            raise RuntimeError("Rollout worker failed:\n" + errors[0])
@@ -1 +1 @@
-from . import base
+from . import base, trajectory_store
@@ -0,0 +1,222 @@
+"""Actor processes of the decoupled mode of the SAC and TD3 scenarios.
+
+In the decoupled mode, environment stepping and gradient updates overlap: each
+of the `ActorPool` processes steps its own copy of the environment of the
+scenario with a copy of the actor network, and sends the transitions to the
+learner (the main process) in chunks through a queue. The learner adds them to
+its replay buffer, fires the callbacks, trains, and periodically publishes the
+actor weights to shared memory, from where the actor processes pick them up.
+
+Two limits bound the staleness between actors and learner:
+
+- the learner publishes the weights after every `sync_interval` updates, so
+  the actors act with weights at most that many updates old;
+- the actors never run more than `max_actor_lead` environment steps ahead of
+  the steps the learner has consumed, so the data does not outpace training.
+"""
+
+import copy
+import ctypes
+import multiprocessing as mp
+import queue
+import traceback
+
+import numpy as np
+import torch
+from torch.nn.utils import parameters_to_vector, vector_to_parameters
+
+# Number of environment steps an actor process sends at once
+CHUNK_SIZE = 16
+
+
+def _actor_worker(
+    scenario,
+    actor: torch.nn.Module,
+    pool: "ActorPool",
+    actor_index: int,
+    seed: int,
+) -> None:
+    """Step the environment of the (forked) `scenario` and send the transitions.
+
+    Until the learner publishes the first weights, the actions are uniformly
+    random, like before `learning_starts` in the synchronous loop. The first
+    actor also sends the data of its first environment passed to callbacks.
+    """
+    try:
+        torch.set_num_threads(1)
+        np.random.seed(seed)
+        torch.manual_seed(seed)
+        simulator = scenario.simulator
+        if hasattr(getattr(simulator, "state_init_callable", None), "shard"):
+            simulator.state_init_callable = simulator.state_init_callable.shard(
+                actor_index, pool.num_actors
+            )
+        scenario.actor = actor
+        scenario.actor_updated = True
+        scenario.device = "cpu"
+        envs = scenario.envs
+        num_envs, action_bounds = scenario.num_envs, scenario.action_bounds
+        version = 0
+        returns = np.zeros(num_envs)
+        chunk = []
+        obs, _ = envs.reset()
+        while not pool.stop.is_set():
+            if pool.produced.value - pool.consumed.value >= pool.max_actor_lead:
+                # Hand over what is collected so far and wait for the learner
+                pool.send(chunk)
+                chunk = []
+                pool.stop.wait(1e-3)
+                continue
+            with pool.produced.get_lock():
+                pool.produced.value += 1
+
+            if pool.version.value != version:
+                with pool.lock, torch.no_grad():
+                    # A copy, as vector_to_parameters makes the parameters
+                    # views of the vector, which the learner overwrites
+                    vector_to_parameters(pool.weights.clone(), actor.parameters())
+                    version = pool.version.value
+                scenario.actor_updated = True
+            if version == 0:
+                actions = np.random.uniform(
+                    low=action_bounds[:, 0],
+                    high=action_bounds[:, 1],
+                    size=(num_envs, len(action_bounds)),
+                )
+            else:
+                actions = scenario.policy_actions(obs)
+
+            if actor_index == 0:
+                state, time = scenario.get_logged_state_and_time()
+            next_obs, rewards, terminations, truncations, infos = envs.step(actions)
+            real_next_obs = next_obs.copy()
+            for idx in np.flatnonzero(truncations):
+                real_next_obs[idx] = infos["final_observation"][idx]
+            returns += rewards
+            ended = np.logical_or(terminations, truncations)
+            step = {
+                "observations": obs,
+                "next_observations": real_next_obs,
+                "actions": actions,
+                "rewards": rewards,
+                "terminations": terminations,
+                "episodic_returns": returns[ended].copy(),
+            }
+            returns[ended] = 0
+            if actor_index == 0:
+                step["logged"] = (
+                    np.array(state),
+                    obs[:1],
+                    actions[:1],
+                    float(rewards[0]),
+                    time,
+                    bool(ended[0]),
+                )
+            chunk.append(step)
+            if len(chunk) >= CHUNK_SIZE:
+                pool.send(chunk)
+                chunk = []
+            obs = next_obs
+    except Exception:
+        pool.queue.put(traceback.format_exc())
+
+
+class ActorPool:
+    """Processes stepping copies of the environment of a scenario."""
+
+    def __init__(self, scenario, num_actors: int, max_actor_lead: int):
+        """Start `num_actors` processes forked from the current one.
+
+        Args:
+            scenario: The SAC or TD3 scenario, whose `envs`, `actor`,
+                `policy_actions` and `get_logged_state_and_time` are used by
+                the copies in the actor processes.
+            num_actors: The number of actor processes.
+            max_actor_lead: The maximal number of environment steps the actors
+                may collect beyond the steps consumed by the learner.
+        """
+        if num_actors < 1 or max_actor_lead < 1:
+            raise ValueError("num_actors and max_actor_lead must be positive")
+        self.num_actors = num_actors
+        self.max_actor_lead = max_actor_lead
+        context = mp.get_context("fork")
+        # The actor processes act on the CPU, as CUDA cannot be used after a fork
+        actor = copy.deepcopy(scenario.actor).cpu()
+        self.weights = parameters_to_vector(actor.parameters()).detach().share_memory_()
+        self.version = context.Value(ctypes.c_int64, 0, lock=False)
+        self.lock = context.Lock()
+        self.produced = context.Value(ctypes.c_int64, 0)
+        self.consumed = context.Value(ctypes.c_int64, 0)
+        self.stop = context.Event()
+        self.queue = context.Queue()
+
+        seeds = np.random.randint(2**31 - 1, size=num_actors)
+        self.processes = [
+            context.Process(
+                target=_actor_worker,
+                args=(scenario, actor, self, actor_index, int(seed)),
+                daemon=True,
+            )
+            for actor_index, seed in enumerate(seeds)
+        ]
+        for process in self.processes:
+            process.start()
+
+    def send(self, chunk: list[dict]) -> None:
+        """Send the steps of an actor process to the learner (called by the actors)."""
+        if not chunk:
+            return
+        self.queue.put(
+            {
+                name: np.concatenate([step[name] for step in chunk])
+                for name in (
+                    "observations",
+                    "next_observations",
+                    "actions",
+                    "rewards",
+                    "terminations",
+                )
+            }
+            | {
+                "num_steps": len(chunk),
+                "episodic_returns": [step["episodic_returns"] for step in chunk],
+                "logged": [step.get("logged") for step in chunk],
+            }
+        )
+
+    def receive(self) -> dict:
+        """Return the next chunk of steps sent by an actor process."""
+        while True:
+            try:
+                chunk = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                if not any(process.is_alive() for process in self.processes):
+                    raise RuntimeError("All actor processes exited")
+                continue
+            if isinstance(chunk, str):
+                raise RuntimeError(f"An actor process failed:\n{chunk}")
+            return chunk
+
+    def consume(self, num_steps: int) -> None:
+        """Record that the learner consumed `num_steps` environment steps."""
+        with self.consumed.get_lock():
+            self.consumed.value += num_steps
+
+    def publish(self, actor: torch.nn.Module) -> None:
+        """Make the weights of `actor` the ones of the actor processes."""
+        with self.lock:
+            self.weights.copy_(parameters_to_vector(actor.parameters()).detach())
+            self.version.value += 1
+
+    def close(self) -> None:
+        self.stop.set()
+        # Drain the queue, so that the feeder threads of the actor processes can
+        # exit, until all of them terminated
+        while any(process.is_alive() for process in self.processes):
+            try:
+                self.queue.get(timeout=0.05)
+            except queue.Empty:
+                pass
+        for process in self.processes:
+            process.join()
+        self.queue.close()
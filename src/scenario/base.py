@@ -9,15 +9,31 @@ The file is structured as follows:
    - Placeholder methods for action computation and scenario-specific logic.
 """
 
+import math
+import queue
+import threading
+import time
+from pathlib import Path
+
 import numpy as np
 import gymnasium as gym
 from regelum.simulator import Simulator
 from regelum.objective import RunningObjective
 from regelum.scenario import Scenario
 from regelum.callback import Callback
-from src.rgenv import RgEnv
+from regelum.data_buffers import DataBuffer
+from src.rgenv import RgEnv, BatchedRgEnv, SharedMemoryRgEnv
+from .actor_learner import ActorPool
+from .checkpoint import Checkpointer, Deferred, rng_state, set_rng_state
+from .evaluation import EvaluationWorker
+from .inference import NumpyActor
+from .prioritized_replay import PrioritizedReplayBufferSamples
+from .profiling import Profiler
+from .recording import TrajectoryRecorder
 import mlflow
-from typing import Any
+from mlflow.entities import Metric
+from mlflow.tracking import MlflowClient
+from typing import Any, Optional
 import torch
 
 
@@ -32,12 +48,31 @@ class CleanRLScenario(Scenario):
     episodic return logging.
     """
 
+    precisions = ("float32", "bfloat16")
+
     def __init__(
         self,
         simulator: Simulator,
         running_objective: RunningObjective,
         total_timesteps: int,
         device: str,
+        num_envs: int = 1,
+        num_workers: int = 0,
+        num_actors: int = 0,
+        utd_ratio: float = 1.0,
+        updates_every: int = 1,
+        actor_sync_interval: int = 1,
+        max_actor_lead: int = 1000,
+        checkpoint_dir: Optional[str] = None,
+        checkpoint_interval: int = 10000,
+        precision: str = "float32",
+        record_every: int = 1,
+        profile: bool = False,
+        profile_interval: int = 10000,
+        profile_trace: Optional[str] = None,
+        headless: bool = False,
+        eval_interval: Optional[int] = None,
+        eval_episodes: int = 10,
     ):
         """Initialize the CleanRLScenario.
 
@@ -50,6 +85,56 @@ class CleanRLScenario(Scenario):
             running_objective: The running objective function for reward calculation.
             total_timesteps: The total number of timesteps to run the scenario.
             device: The device (e.g., 'cpu' or 'cuda') to run computations on.
+            num_envs: The number of copies of the system simulated in parallel.
+                With more than one copy, the environment is a BatchedRgEnv and
+                the trajectory of the first copy is the one passed to callbacks.
+            num_workers: The number of worker processes the copies are split
+                among. With 0, all copies are simulated in the current process.
+                Otherwise, the environment is a SharedMemoryRgEnv.
+            num_actors: The number of actor processes of the decoupled mode (see
+                `run_decoupled`). With 0, `run` alternates environment steps and
+                gradient updates in the current process.
+            utd_ratio: The number of gradient updates per environment step after
+                `learning_starts`.
+            updates_every: The number of environment steps between two blocks of
+                gradient updates in `run`. Each block performs the updates due
+                by `utd_ratio` back to back on minibatches sampled at once.
+            actor_sync_interval: The number of gradient updates after which the
+                actor weights are sent to the actor processes.
+            max_actor_lead: The maximal number of environment steps the actor
+                processes may collect beyond the ones consumed by the learner.
+            checkpoint_dir: If given, the run is checkpointed to this directory
+                every `checkpoint_interval` environment steps and resumes from
+                the latest checkpoint found there.
+            checkpoint_interval: The number of environment steps between two
+                checkpoints.
+            precision: The precision of the forward and backward passes of the
+                gradient updates, `"float32"` or `"bfloat16"`. With `"bfloat16"`,
+                they run under `torch.autocast`, while the weights, optimizer
+                states and losses stay in float32.
+            record_every: The number of simulation steps between two calls of
+                `post_compute_action`, which triggers the per-step callbacks.
+                With more than 1, the steps are written to a
+                `TrajectoryRecorder` and each episode is handed over to the
+                callbacks at once by `dump_data_buffer` (see `recording.py`).
+            profile: Whether to time the stages of the loop (see `instrument`).
+                The p50, p95 and p99 of the stages are logged by `save_timings`
+                every `profile_interval` steps and at the end of the run.
+            profile_interval: The number of environment steps between two
+                logs of the timings.
+            profile_trace: If given with `profile`, the timed calls are written
+                to this file as a Chrome trace at the end of the run.
+            headless: Whether to skip the per-step and per-episode callbacks
+                (`post_compute_action`, `reload_scenario`, `reset_episode` and
+                `reset_iteration`), e.g. for hyperparameter sweeps. Only the
+                episodic returns, losses and timings are passed to the
+                callbacks, while `self.value` and the counters are updated as
+                usual. `record_every` is then ignored.
+            eval_interval: If given, the deterministic policy is evaluated
+                every `eval_interval` environment steps and at the end of the
+                run by an `EvaluationWorker` process, concurrently with
+                training, and the returns are logged by `save_evaluation`.
+            eval_episodes: The number of episodes of an evaluation.
         """
         self.total_timesteps = total_timesteps
         self.device = (
@@ -57,6 +142,11 @@ class CleanRLScenario(Scenario):
             if device.startswith("cuda") and not torch.cuda.is_available()
             else device
         )
+        if precision not in self.precisions:
+            raise ValueError(
+                f"precision must be one of {self.precisions}, got {precision}"
+            )
+        self.precision = precision
         self.simulator = simulator
         self.running_objective = running_objective
 
@@ -66,9 +156,27 @@ class CleanRLScenario(Scenario):
 
             return thunk
 
-        self.envs = gym.vector.SyncVectorEnv(
-            [make_env(RgEnv(simulator, running_objective))]
-        )
+        self.num_envs = num_envs
+        if num_actors > 0 and num_workers > 0:
+            raise ValueError("num_actors and num_workers cannot be used together")
+        self.num_actors = num_actors
+        if utd_ratio <= 0 or updates_every < 1:
+            raise ValueError("utd_ratio and updates_every must be positive")
+        self.utd_ratio = utd_ratio
+        self.updates_every = updates_every
+        self.num_updates = 0
+        self.actor_sync_interval = actor_sync_interval
+        self.max_actor_lead = max_actor_lead
+        if num_workers > 0:
+            self.envs = SharedMemoryRgEnv(
+                simulator, running_objective, num_envs, num_workers
+            )
+        elif num_envs == 1:
+            self.envs = gym.vector.SyncVectorEnv(
+                [make_env(RgEnv(simulator, running_objective))]
+            )
+        else:
+            self.envs = BatchedRgEnv(simulator, running_objective, num_envs)
 
         self.N_iterations = int(
             total_timesteps / simulator.time_final * simulator.max_step
@@ -77,6 +185,68 @@ class CleanRLScenario(Scenario):
         self.iteration_id = 1
         self.N_episodes = 1
         self.value = 0
+        # NumPy mirror of the actor for single observations, synchronized
+        # lazily after the actor is updated
+        self.numpy_actor = None
+        self.actor_updated = True
+        self.checkpointer = (
+            None
+            if checkpoint_dir is None
+            else Checkpointer(checkpoint_dir, checkpoint_interval)
+        )
+        if record_every < 1 or profile_interval < 1:
+            raise ValueError("record_every and profile_interval must be positive")
+        self.record_every = record_every
+        self.headless = headless
+        self.recorder = (
+            None
+            if record_every == 1 or headless
+            else TrajectoryRecorder(
+                math.ceil(simulator.time_final / simulator.max_step) + 1,
+                simulator.system.dim_state,
+                simulator.system.dim_observation,
+                simulator.system.dim_inputs,
+            )
+        )
+        self.profile_interval = profile_interval
+        self.profiler = Profiler(profile_trace) if profile else None
+        self.instrumented = False
+        if (eval_interval is not None and eval_interval < 1) or eval_episodes < 1:
+            raise ValueError("eval_interval and eval_episodes must be positive")
+        self.eval_interval = eval_interval
+        self.eval_episodes = eval_episodes
+        self.evaluator = None
+        self.last_evaluation_step = None
+
+    def single_observation_actor(self) -> NumpyActor:
+        """Return the NumPy mirror of `self.actor` with its current weights."""
+        if self.numpy_actor is None:
+            self.numpy_actor = NumpyActor(self.actor)
+        elif self.actor_updated:
+            self.numpy_actor.sync(self.actor)
+        self.actor_updated = False
+        return self.numpy_actor
+
+    def get_logged_state_and_time(self) -> tuple[np.ndarray, float]:
+        """Return the current state and time of the environment passed to callbacks.
+
+        Returns:
+            The state of the (first) environment as a row vector and its simulation time.
+
+        Note:
+            With a single environment, SAC and TD3 step it through
+            `gym.vector.SyncVectorEnv`, not through the buffers of
+            `RgEnv.step_into` as CALF does: they rely on its autoreset, its
+            `final_observation` for the replay buffer and the episode statistics
+            of `RecordEpisodeStatistics`, which `step_into` does not provide.
+            The state is read from the wrapped `RgEnv`, which replaces it by a
+            new array at every step, so it needs no copy.
+        """
+        if isinstance(self.envs, (BatchedRgEnv, SharedMemoryRgEnv)):
+            # A copy, as the state buffer is overwritten in place on every step
+            return self.envs.state[:1].copy(), self.envs.time[0]
+        env = self.envs.envs[0].env
+        return env.state.reshape(1, -1), env.simulator.time
 
     @apply_callbacks()
     def post_compute_action(
@@ -89,8 +259,8 @@ class CleanRLScenario(Scenario):
 
         This method is decorated with @apply_callbacks(), which triggers it
         within the scope of callbacks defined in presets/main.yaml. The output
-        is used by ScenarioStepLogger to print logs and HistoricalDataCallback
-        to save episodic trajectories in h5 and svg formats in the regelum_data folder.
+        is used by ScenarioStepLogger to print logs and TrajectoryStoreCallback
+        (or HistoricalDataCallback) to save the trajectories of the run in the regelum_data folder.
 
         Args:
             state: Current system state.
@@ -128,6 +298,98 @@ class CleanRLScenario(Scenario):
             "current_undiscounted_value": self.value,
         }
 
+    def record_step(self, state, obs, action, reward, time, global_step):
+        """Record a step for the callbacks, with the arguments of `post_compute_action`.
+
+        Without a recorder, this calls `post_compute_action`. Otherwise, the
+        step is written to the recorder and `post_compute_action` is only called
+        every `record_every` steps. In headless mode, only the value is updated.
+        """
+        if self.headless or (
+            self.recorder is not None and global_step % self.record_every != 0
+        ):
+            self.current_running_objective = reward
+            self.value += reward
+        else:
+            self.post_compute_action(state, obs, action, reward, time, global_step)
+        if self.recorder is not None:
+            self.recorder.record(
+                state, obs, action, reward, time, global_step, self.value
+            )
+
+    def flush_recorder(self):
+        """Hand the steps recorded since the last call over to the callbacks."""
+        if self.recorder is not None and len(self.recorder) > 0:
+            self.dump_data_buffer(
+                self.episode_id,
+                self.recorder.data_buffer(self.episode_id, self.iteration_id),
+            )
+            self.recorder.clear()
+
+    @apply_callbacks()
+    def dump_data_buffer(
+        self, episode_id: int, data_buffer: DataBuffer
+    ) -> tuple[int, DataBuffer]:
+        """Hand the recorded steps of an episode over to the callbacks.
+
+        This method is decorated with @apply_callbacks(), like the method of the
+        same name of regelum's RLScenario. TrajectoryStoreCallback appends the
+        data buffer, which has the keys of the outputs of `post_compute_action`,
+        to its store, and HistoricalDataCallback replaces the data of the
+        episode with it.
+
+        Args:
+            episode_id: The episode of the steps.
+            data_buffer: The recorded steps.
+
+        Returns:
+            The episode and the data buffer.
+        """
+        return episode_id, data_buffer
+
+    @apply_callbacks()
+    def save_timings(self, global_step, **timings):
+        """Save the timings of the stages and log them.
+
+        This method is decorated with @apply_callbacks(), which ensures it's triggered
+        within the scope of callbacks defined in presets/main.yaml. The output of this
+        method will be used by CleanRLCallback to log metrics.
+
+        Args:
+            global_step: The global step count.
+            **timings: The summary of `Profiler`, e.g. `policy/p99_us`.
+
+        Returns:
+            A dictionary containing the global step and the timings for logging.
+        """
+        return {"timings/" + name: timings[name] for name in timings} | {
+            "global_step": global_step
+        }
+
+    @apply_callbacks()
+    def save_evaluation(self, global_step: int, returns: np.ndarray):
+        """Save the returns of an evaluation of the deterministic policy and log them.
+
+        This method is decorated with @apply_callbacks(), which ensures it's triggered
+        within the scope of callbacks defined in presets/main.yaml. The output of this
+        method will be used by CleanRLCallback to log metrics.
+
+        Args:
+            global_step: The global step count at which the actor was evaluated.
+            returns: The returns of the evaluation episodes.
+
+        Returns:
+            A dictionary containing the global step and the statistics of the
+            returns for logging.
+        """
+        return {
+            "global_step": global_step,
+            "charts/evaluation_return": float(np.mean(returns)),
+            "charts/evaluation_return_std": float(np.std(returns)),
+            "charts/evaluation_return_min": float(np.min(returns)),
+            "charts/evaluation_return_max": float(np.max(returns)),
+        }
+
     @apply_callbacks()
     def save_episodic_return(self, episodic_return: float, global_step: int):
         """Save the episodic return and log it.
@@ -184,13 +446,370 @@ class CleanRLScenario(Scenario):
         This method triggers callbacks inside regelum, allowing the callbacks
         to be aware of the current state in the pipeline. This is a technical
         feature that facilitates proper callback execution and tracking.
+        The recorded steps of the episode are handed over to the callbacks first.
         """
+        self.flush_recorder()
         self.recent_undiscounted_value = self.value
         self.value = 0
 
+    def end_episode(self):
+        """End the episode of the environment passed to the callbacks.
+
+        This calls `reload_scenario`, `reset_episode` and `reset_iteration`,
+        which trigger the callbacks, or, in headless mode, only updates the
+        value and the iteration counter as they do.
+        """
+        if self.headless:
+            self.recent_undiscounted_value = self.value
+            self.value = 0
+            self.iteration_id += 1
+        else:
+            self.reload_scenario()
+            self.reset_episode()
+            self.reset_iteration()
+
     def run(self):
         raise NotImplementedError("Subclasses must implement the run method")
 
+    def run_decoupled(self):
+        """Train with actor processes stepping the environment concurrently.
+
+        The current process is the learner: it adds the transitions sent by the
+        `ActorPool` to the replay buffer `self.rb`, fires the callbacks for the
+        first environment of the first actor, and performs the gradient updates
+        due by `utd_ratio` (see `train_updates`) after each chunk of transitions
+        it receives. The actor processes
+        act with `self.policy_actions` and the actor weights published every
+        `actor_sync_interval` updates. The run ends after `total_timesteps`
+        environment steps of all actors together.
+        """
+        global_step, learning_starts = self.start_or_resume()
+        pool = ActorPool(self, self.num_actors, self.max_actor_lead)
+        # After forking the actor and evaluation processes, which need no timers
+        self.evaluate(global_step)
+        self.instrument()
+        published_updates = None
+        try:
+            while True:
+                self.train_updates(global_step, learning_starts)
+                if self.num_updates > 0 and (
+                    published_updates is None
+                    or self.num_updates - published_updates >= self.actor_sync_interval
+                ):
+                    pool.publish(self.actor)
+                    published_updates = self.num_updates
+                if global_step >= self.total_timesteps:
+                    break
+                chunk = pool.receive()
+                num_steps = min(chunk["num_steps"], self.total_timesteps - global_step)
+                num_rows = num_steps * self.num_envs
+                self.rb.add(
+                    chunk["observations"][:num_rows],
+                    chunk["next_observations"][:num_rows],
+                    chunk["actions"][:num_rows],
+                    chunk["rewards"][:num_rows],
+                    chunk["terminations"][:num_rows],
+                )
+                for episodic_returns, logged in zip(
+                    chunk["episodic_returns"][:num_steps], chunk["logged"][:num_steps]
+                ):
+                    if logged is not None:
+                        state, obs, action, reward, time, ended = logged
+                        self.record_step(state, obs, action, reward, time, global_step)
+                    for episodic_return in episodic_returns:
+                        self.save_episodic_return(
+                            global_step=global_step, episodic_return=episodic_return
+                        )
+                    # Episode bookkeeping follows the environment passed to callbacks
+                    if logged is not None and ended:
+                        self.end_episode()
+                    global_step += 1
+                pool.consume(chunk["num_steps"])
+                self.save_checkpoint(global_step, learning_starts=learning_starts)
+                self.evaluate(global_step)
+        finally:
+            pool.close()
+        self.save_checkpoint(global_step, final=True, learning_starts=learning_starts)
+        self.evaluate(global_step, final=True)
+        self.save_replay_buffer()
+        self.end_run()
+
+    def train_updates(self, global_step: int, learning_starts: int):
+        """Perform the gradient updates due at `global_step`.
+
+        `utd_ratio` updates are due per environment step after `learning_starts`.
+        They are performed in blocks of at most `self.rb.max_batches` updates,
+        whose minibatches are sampled with one gather by `sample_block`.
+        """
+        num_due = (
+            int(self.utd_ratio * (global_step - learning_starts)) - self.num_updates
+        )
+        while num_due > 0:
+            block = self.rb.sample_block(min(num_due, self.rb.max_batches))
+            for data in block:
+                self.num_updates += 1
+                self.train_step(self.num_updates, global_step, data)
+            num_due -= len(block)
+
+    def profiled_stages(self) -> list[tuple[str, Any, str]]:
+        """Return the stages timed when profiling, as (stage, object, method name).
+
+        Methods missing on their objects are skipped. Subclasses add the stages
+        specific to them.
+        """
+        stages = [
+            ("callbacks", self, name)
+            for name in [
+                "save_episodic_return",
+                "save_losses",
+                "dump_data_buffer",
+                "reload_scenario",
+                "reset_episode",
+                "reset_iteration",
+            ]
+        ]
+        stages += [
+            ("replay_sampling", getattr(self, "rb", None), "sample_block"),
+            ("gradient_update", self, "train_step"),
+        ]
+        # In the decoupled mode, the environments are stepped by the actor processes
+        if self.num_actors == 0:
+            stages.append(("policy", self, "policy_actions"))
+            stages.append(("env_step", self.envs, "step"))
+            if isinstance(self.envs, gym.vector.SyncVectorEnv):
+                stages.append(("ode_solver", self.simulator, "do_sim_step"))
+        return stages
+
+    def instrument(self):
+        """Replace the methods of the stages with timed ones if profiling is enabled.
+
+        Besides `profiled_stages`, the backpropagation and the steps of the
+        checkpointed optimizers are timed, and `record_step`, called at every
+        environment step, logs the timings every `profile_interval` steps.
+        The run methods call this once before their loop, so that the loops
+        run unchanged when profiling is disabled.
+        """
+        if self.profiler is None or self.instrumented:
+            return
+        self.instrumented = True
+        profiler = self.profiler
+        for stage, obj, name in self.profiled_stages():
+            profiler.instrument(obj, name, stage)
+        for name in self.checkpointed_attributes:
+            value = getattr(self, name, None)
+            if isinstance(value, torch.optim.Optimizer):
+                profiler.instrument_optimizer(value)
+
+        record_step, end_run = (
+            profiler.timed("callbacks", self.record_step),
+            self.end_run,
+        )
+        num_steps = logged_steps = 0
+
+        def profiled_record_step(*args):
+            nonlocal num_steps, logged_steps
+            record_step(*args)
+            # The last argument is the global step
+            num_steps = args[-1] + 1
+            if num_steps - logged_steps >= self.profile_interval:
+                self.save_timings(num_steps, **profiler.summary())
+                logged_steps = num_steps
+
+        def profiled_end_run():
+            self.save_timings(num_steps, **profiler.summary())
+            end_run()
+            profiler.write_trace()
+
+        self.record_step = profiled_record_step
+        self.end_run = profiled_end_run
+
+    # Attributes saved in checkpoints: modules and optimizers by their
+    # state_dict, tensors by their values. Missing attributes are skipped
+    checkpointed_attributes = ()
+
+    def checkpoint_state(self) -> dict:
+        """Return the state of the run saved in checkpoints."""
+        state = {
+            "counters": {
+                "episode_id": self.episode_id,
+                "iteration_id": self.iteration_id,
+                "num_updates": self.num_updates,
+            },
+            "rng": rng_state(),
+        }
+        for name in self.checkpointed_attributes:
+            value = getattr(self, name, None)
+            if value is not None:
+                state[name] = value if torch.is_tensor(value) else value.state_dict()
+        if hasattr(self, "rb"):
+            # The transitions are serialized by the writer thread without a
+            # copy. A memory-mapped buffer leaves them out, as they are in its files
+            state["replay_buffer"] = {
+                name: Deferred(value) if isinstance(value, np.ndarray) else value
+                for name, value in self.rb.state_dict().items()
+            }
+        return state
+
+    def load_checkpoint_state(self, state: dict):
+        """Restore the state of the run from a checkpoint."""
+        self.episode_id = state["counters"]["episode_id"]
+        self.iteration_id = state["counters"]["iteration_id"]
+        self.num_updates = state["counters"]["num_updates"]
+        set_rng_state(state["rng"])
+        for name in self.checkpointed_attributes:
+            value = getattr(self, name, None)
+            if value is None:
+                continue
+            if torch.is_tensor(value):
+                with torch.no_grad():
+                    value.copy_(state[name])
+            else:
+                value.load_state_dict(state[name])
+        if hasattr(self, "rb"):
+            self.rb.load_state_dict(state["replay_buffer"])
+        self.actor_updated = True
+
+    def resume(self) -> Optional[dict]:
+        """Restore the latest checkpoint, if any, and return its counters."""
+        if self.checkpointer is None:
+            return None
+        state = self.checkpointer.load_latest()
+        if state is None:
+            return None
+        self.load_checkpoint_state(state)
+        return state["counters"]
+
+    def save_checkpoint(self, global_step: int, final: bool = False, **counters):
+        """Checkpoint the run after `global_step` environment steps, if it is due.
+
+        Args:
+            global_step: The number of environment steps done, from which a
+                resumed run continues.
+            final: Whether the run ends. The last checkpoint is then written
+                even if it is not due, and the writer is stopped.
+            **counters: Further counters of the run loop to save.
+        """
+        if self.checkpointer is None:
+            return
+        if self.checkpointer.is_due(global_step) or (
+            final and global_step != self.checkpointer.last_step
+        ):
+            state = self.checkpoint_state()
+            state["counters"].update(global_step=global_step, **counters)
+            self.checkpointer.save(global_step, state)
+        if final:
+            self.checkpointer.close()
+
+    def evaluate(self, global_step: int, final: bool = False):
+        """Evaluate the actor after `global_step` environment steps, if it is due.
+
+        The first call forks the `EvaluationWorker`. An evaluation is due every
+        `eval_interval` steps, and started as soon as the previous one is
+        finished, so the loop never waits for the evaluation episodes. The
+        finished evaluations are passed to `save_evaluation`.
+
+        Args:
+            global_step: The number of environment steps done.
+            final: Whether the run ends. The final actor is then evaluated,
+                waiting for the evaluation, and the worker is stopped.
+        """
+        if self.eval_interval is None:
+            return
+        if self.evaluator is None:
+            self.evaluator = EvaluationWorker(self, self.eval_episodes)
+            self.last_evaluation_step = global_step - global_step % self.eval_interval
+        for step, returns in self.evaluator.poll(block=final):
+            self.save_evaluation(step, returns)
+        if final:
+            # Unless the actor was just evaluated
+            if global_step != self.last_evaluation_step and self.evaluator.submit(
+                self.actor, global_step
+            ):
+                for step, returns in self.evaluator.poll(block=True):
+                    self.save_evaluation(step, returns)
+            self.evaluator.close()
+            self.evaluator = None
+        elif global_step - self.last_evaluation_step >= self.eval_interval:
+            if self.evaluator.submit(self.actor, global_step):
+                self.last_evaluation_step = global_step
+
+    def start_or_resume(self) -> tuple[int, int]:
+        """Resume from the latest checkpoint or start a new run.
+
+        A new run loads the replay buffer from `replay_buffer_path`, whose
+        transitions count towards the ones collected before `learning_starts`.
+
+        Returns:
+            The environment step to start from and the effective `learning_starts`.
+        """
+        counters = self.resume()
+        if counters is not None:
+            return counters["global_step"], counters["learning_starts"]
+        self.load_replay_buffer()
+        return 0, max(self.learning_starts - len(self.rb) // self.num_envs, 0)
+
+    def autocast(self) -> torch.autocast:
+        """Return the autocast context of the forward passes of the updates."""
+        return torch.autocast(
+            device_type=torch.device(self.device).type,
+            dtype=torch.bfloat16,
+            enabled=self.precision == "bfloat16",
+        )
+
+    def critic_losses(
+        self,
+        qf_a_values: torch.Tensor,
+        next_q_value: torch.Tensor,
+        data: tuple,
+    ) -> torch.Tensor:
+        """Return the mean squared TD errors of the critics on a minibatch.
+
+        With prioritized replay, the squared errors are weighted by the
+        importance-sampling weights of the minibatch, and the priorities of its
+        transitions are updated from the absolute TD errors averaged over the
+        critics.
+
+        Args:
+            qf_a_values: The values of the critics, of shape `(num_critics, batch_size)`.
+            next_q_value: The target values, of shape `(batch_size,)`.
+            data: The minibatch sampled from `self.rb`.
+
+        Returns:
+            The losses of the critics, of shape `(num_critics,)`.
+        """
+        td_errors = qf_a_values.float() - next_q_value.float()
+        if isinstance(data, PrioritizedReplayBufferSamples):
+            self.rb.update_priorities(
+                data.indices, td_errors.detach().abs().mean(dim=0)
+            )
+            return (data.weights * td_errors.pow(2)).mean(dim=1)
+        return td_errors.pow(2).mean(dim=1)
+
+    def load_replay_buffer(self):
+        """Load the replay buffer `self.rb` from `self.replay_buffer_path`.
+
+        Nothing is loaded if no path is set or no buffer was saved there yet.
+        """
+        path = getattr(self, "replay_buffer_path", None)
+        if path is not None and Path(path, "state.json").exists():
+            self.rb.load(path)
+
+    def save_replay_buffer(self):
+        """Save the replay buffer `self.rb` to `self.replay_buffer_path`, if set."""
+        path = getattr(self, "replay_buffer_path", None)
+        if path is not None:
+            self.rb.save(path)
+
+    @apply_callbacks()
+    def end_run(self):
+        """End the run and close the environments.
+
+        This method triggers callbacks inside regelum, so that callbacks
+        buffering data, such as CleanRLCallback, write it before the run ends.
+        """
+        self.flush_recorder()
+        self.envs.close()
+
     @apply_callbacks()
     def reset_iteration(self):
         """Reset the iteration and trigger callbacks in Regelum.
@@ -213,18 +832,48 @@ class CleanRLCallback(Callback):
 
     The primary purpose of this callback is to log metrics using MLflow. It
     intercepts the output of specific methods in CleanRLScenario and logs
-    the metrics accordingly.
+    the metrics accordingly. The metrics are queued in memory and written by a
+    background thread with `MlflowClient.log_batch`, every `flush_interval`
+    seconds or as soon as `max_batch_size` metrics are queued, so that logging
+    does not slow down the training loop. The queue is flushed when the
+    scenario calls `end_run`.
 
     Note: This callback should be added to the main.yaml configuration to be
     triggered during the execution of CleanRLScenario methods.
     """
 
+    def __init__(
+        self, flush_interval: float = 1.0, max_batch_size: int = 1000, **kwargs
+    ):
+        """Initialize the callback.
+
+        Args:
+            flush_interval: The maximal time in seconds a metric waits in the
+                queue before it is written.
+            max_batch_size: The number of queued metrics that triggers a write.
+                MLflow accepts at most 1000 metrics per batch.
+            **kwargs: The arguments of regelum's Callback.
+        """
+        super().__init__(**kwargs)
+        if flush_interval <= 0 or not 1 <= max_batch_size <= 1000:
+            raise ValueError(
+                "flush_interval must be positive and max_batch_size between 1 and 1000"
+            )
+        self.flush_interval = flush_interval
+        self.max_batch_size = max_batch_size
+        self.queue = queue.Queue()
+        self.wake_up = threading.Event()
+        self.writer = None
+        self.run_id = None
+        self.error = None
+
     def log_metrics(self, metrics: dict[str, Any]):
         """Log metrics using MLflow.
 
-        This method takes a dictionary of metrics and logs them using MLflow.
-        It extracts the global step from the metrics dictionary and logs each
-        metric with its corresponding value and the global step.
+        This method takes a dictionary of metrics and queues them for the
+        background writer. It extracts the global step from the metrics
+        dictionary and queues each metric with its corresponding value and the
+        global step.
 
         Args:
             metrics: A dictionary containing metrics to be logged.
@@ -235,13 +884,70 @@ class CleanRLCallback(Callback):
             None
 
         Note:
-            This method assumes that MLflow has been properly initialized and
-            configured before calling.
+            The metrics are logged to the MLflow run active when the first
+            metrics are queued, which is started if there is none.
         """
-        global_step = metrics["global_step"]
+        self._raise_error()
+        if self.writer is None:
+            run = mlflow.active_run() or mlflow.start_run()
+            self.run_id = run.info.run_id
+            self.writer = threading.Thread(target=self._write_loop, daemon=True)
+            self.writer.start()
+        global_step = int(metrics["global_step"])
+        timestamp = int(time.time() * 1000)
         for metric, value in metrics.items():
             if metric != "global_step":
-                mlflow.log_metric(metric, value, global_step)
+                self.queue.put(
+                    Metric(metric, float(np.squeeze(value)), timestamp, global_step)
+                )
+        if self.queue.qsize() >= self.max_batch_size:
+            self.wake_up.set()
+
+    def flush(self):
+        """Wait until the background writer has written all queued metrics."""
+        if self.writer is not None:
+            self.wake_up.set()
+            self.queue.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Writing metrics to MLflow failed") from error
+
+    def _write_loop(self):
+        try:
+            client = MlflowClient()
+        except Exception as error:
+            # Without a client, the metrics are dropped, so that flush raises
+            # the error instead of waiting for them forever
+            while True:
+                self.error = error
+                self.queue.get()
+                self.queue.task_done()
+        while True:
+            self.wake_up.wait(self.flush_interval)
+            self.wake_up.clear()
+            while not self.queue.empty():
+                batch = []
+                while len(batch) < self.max_batch_size:
+                    try:
+                        batch.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    try:
+                        client.log_batch(self.run_id, metrics=batch)
+                    except Exception:
+                        # Retry once, e.g. after a transient network error,
+                        # before the batch is dropped
+                        time.sleep(1.0)
+                        client.log_batch(self.run_id, metrics=batch)
+                except Exception as error:
+                    self.error = error
+                finally:
+                    for _ in batch:
+                        self.queue.task_done()
 
     def is_target_event(self, obj, method, output, triggers):
         """Determines if the current event is a target event for logging.
@@ -262,13 +968,17 @@ class CleanRLCallback(Callback):
         return isinstance(obj, CleanRLScenario) and method in [
             "save_episodic_return",
             "save_losses",
+            "save_timings",
+            "save_evaluation",
+            "end_run",
         ]
 
     def on_function_call(self, obj, method, output):
         """Called when a target event is triggered.
 
         This method is invoked when is_target_event() returns True for a particular
-        function call. It logs the metrics output by the triggered method.
+        function call. It logs the metrics output by the triggered method, or
+        writes all queued metrics when the run ends.
 
         Args:
             obj: The object instance that triggered the event.
@@ -282,4 +992,11 @@ class CleanRLCallback(Callback):
             This method assumes that the output is a dictionary of metrics suitable
             for logging via the log_metrics method.
         """
-        self.log_metrics(metrics=output)
+        if method == "end_run":
+            self.flush()
+        else:
+            self.log_metrics(metrics=output)
+
+    def on_termination(self, res):
+        # Metrics of a run that did not reach `end_run`, e.g. after an error
+        self.flush()
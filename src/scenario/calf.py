@@ -3,7 +3,9 @@ from regelum.simulator import Simulator
 from regelum.objective import RunningObjective
 from .calf_agent.calfv import AgentCALFV
 from .calf_agent.calfq import AgentCALFQ
-from typing import Union
+from typing import Optional, Union
+import numpy as np
+from .checkpoint import plain_attributes
 
 
 # Note: The CleanRLScenario class is used for CALF due to its convenience.
@@ -17,6 +19,13 @@ class CALFScenario(CleanRLScenario):
         running_objective: RunningObjective,
         total_timesteps: int,
         agent_calf: Union[AgentCALFV, AgentCALFQ],
+        checkpoint_dir: Optional[str] = None,
+        checkpoint_interval: int = 10000,
+        record_every: int = 1,
+        profile: bool = False,
+        profile_interval: int = 10000,
+        profile_trace: Optional[str] = None,
+        headless: bool = False,
     ):
         """Initialize the CALFScenario.
 
@@ -29,35 +38,137 @@ class CALFScenario(CleanRLScenario):
             running_objective: The running objective function for reward calculation.
             total_timesteps: The total number of timesteps to run the scenario.
             agent_calf: The CALF agent used in the scenario, either AgentCALFV or AgentCALFQ.
+            checkpoint_dir: If given, the run is checkpointed to this directory
+                every `checkpoint_interval` steps and resumes from the latest
+                checkpoint found there.
+            checkpoint_interval: The number of steps between two checkpoints.
+            record_every: The number of steps between two calls of the per-step
+                callbacks, the others being recorded and handed over in bulk at
+                the end of each episode (1 to call them at every step).
+            profile: Whether to time the stages of the loop, e.g. the critic
+                optimization, and log their p50, p95 and p99 every
+                `profile_interval` steps.
+            profile_interval: The number of steps between two logs of the timings.
+            profile_trace: The path of the Chrome trace of the timed calls
+                written at the end of a profiled run (None for no trace).
+            headless: Whether to skip the per-step and per-episode callbacks,
+                passing only the episodic returns and timings to the callbacks.
         """
         super().__init__(
-            simulator, running_objective, total_timesteps=total_timesteps, device="cpu"
+            simulator,
+            running_objective,
+            total_timesteps=total_timesteps,
+            device="cpu",
+            checkpoint_dir=checkpoint_dir,
+            checkpoint_interval=checkpoint_interval,
+            record_every=record_every,
+            profile=profile,
+            profile_interval=profile_interval,
+            profile_trace=profile_trace,
+            headless=headless,
         )
         self.agent_calf = agent_calf
+        self.restored_agent_models = None
+
+    def agent_models(self) -> dict:
+        # AgentCALFV keeps its learned weights in the models of its critic and policy
+        return {
+            name: getattr(self.agent_calf, name).model
+            for name in ["critic", "policy"]
+            if hasattr(self.agent_calf, name)
+        }
+
+    def checkpoint_state(self) -> dict:
+        # The agents keep their weights and counters in NumPy arrays and numbers
+        return super().checkpoint_state() | {
+            "agent_calf": plain_attributes(self.agent_calf),
+            "agent_calf_models": {
+                name: {"weights": model.weights, "cached_weights": model.cache.weights}
+                for name, model in self.agent_models().items()
+            },
+        }
+
+    def load_checkpoint_state(self, state: dict):
+        super().load_checkpoint_state(state)
+        for name, value in state["agent_calf"].items():
+            setattr(self.agent_calf, name, value)
+        self.restored_agent_models = state["agent_calf_models"]
+        # Restored before the reset of the agent too, so that the cached critic
+        # weights it propagates are the restored ones
+        self.restore_agent_models()
+
+    def restore_agent_models(self):
+        """Set the critic and policy weights of the agent to the restored ones."""
+        for name, model in self.agent_models().items():
+            weights = self.restored_agent_models[name]
+            model.update_weights(np.copy(weights["weights"]))
+            model.cache_weights(np.copy(weights["cached_weights"]))
+
+    def profiled_stages(self) -> list:
+        agent = self.agent_calf
+        return super().profiled_stages() + [
+            ("env_step", self.envs.envs[0].env, "step_into"),
+            ("policy", agent, "get_action"),
+            # AgentCALFQ
+            ("critic_optimization", agent, "get_optimized_critic_weights"),
+            ("actor_optimization", agent, "get_optimized_action"),
+            # AgentCALFV
+            ("critic_optimization", getattr(agent, "critic", None), "optimize"),
+            ("actor_optimization", getattr(agent, "policy", None), "optimize"),
+        ]
 
     def run(self):
-        obs, _ = self.envs.reset()
-        self.agent_calf.reset(obs_init=obs, global_step=0)
+        # Drive the environment through its allocation-free fast path. Two sets
+        # of buffers are alternated: `current` holds the data before the step
+        # (state and time are logged from it), `upcoming` receives the data after it
+        env = self.envs.envs[0].env
+        current = env.allocate_step_buffers()
+        upcoming = env.allocate_step_buffers()
+        env.reset_into(current["observation"], current["state"], current["time"])
+        # The agent keeps references to observations, so it is given copies
+        obs = current["observation"].copy()
+        # A resumed run starts a new episode from the restored agent
+        counters = self.resume()
+        start_step = 0 if counters is None else counters["global_step"]
+        self.instrument()
+        self.agent_calf.reset(obs_init=obs, global_step=start_step)
+        if self.restored_agent_models is not None:
+            # The reset reinitialized the critic weights
+            self.restore_agent_models()
 
-        for global_step in range(self.total_timesteps):
+        for global_step in range(start_step, self.total_timesteps):
             action = self.agent_calf.get_action(obs)
 
-            self.state = self.envs.envs[0].env.state.reshape(1, -1)
-            self.time = self.envs.envs[0].env.simulator.time
-            obs, rewards, terminations, truncations, infos = self.envs.step(action)
-            self.post_compute_action(
+            # A copy, as the buffers of the state are reused two steps later
+            self.state = current["state"].copy()
+            self.time = current["time"][0]
+            truncated = env.step_into(
+                action,
+                upcoming["observation"],
+                upcoming["state"],
+                upcoming["reward"],
+                upcoming["time"],
+            )
+            if truncated:
+                env.reset_into(
+                    upcoming["observation"], upcoming["state"], upcoming["time"]
+                )
+            obs = upcoming["observation"].copy()
+            self.record_step(
                 self.state,
                 obs,
                 action,
-                float(rewards.reshape(-1)),
+                upcoming["reward"][0],
                 self.time,
                 global_step,
             )
-            if "final_info" in infos:
+            if truncated:
                 self.agent_calf.reset(obs_init=obs, global_step=global_step)
                 self.save_episodic_return(
                     global_step=global_step, episodic_return=self.value
                 )
-                self.reload_scenario()
-                self.reset_episode()
-                self.reset_iteration()
+                self.end_episode()
+            current, upcoming = upcoming, current
+            self.save_checkpoint(global_step + 1)
+        self.save_checkpoint(max(self.total_timesteps, start_step), final=True)
+        self.end_run()
@@ -0,0 +1,188 @@
+"""Periodic checkpoints of the scenarios, written in the background.
+
+A checkpoint is a dictionary with the state of a scenario (networks,
+optimizers, replay buffer, counters, random number generator states, ...)
+built by its `checkpoint_state` method. `Checkpointer.save` first copies the
+tensors and arrays of the state, which is a memory copy, and leaves the
+serialization and the writing to a background thread, so that training does
+not wait for the disk. Large values, such as the transitions of a replay
+buffer, are wrapped in `Deferred` and not copied at all: the writer thread
+serializes them directly. While a checkpoint waits for the writer, the next
+ones are postponed instead of blocking the loop.
+
+Checkpoints are files `checkpoint_<global_step>.pt` in the checkpoint
+directory. Each of them is written to a temporary file first and renamed when
+complete, so that a job preempted during a write resumes from the previous
+checkpoint. Only the `keep` most recent checkpoints are kept.
+"""
+
+import copy
+import os
+import queue
+import random
+import threading
+from pathlib import Path
+from typing import Any, Optional
+
+import numpy as np
+import torch
+
+
+class Deferred:
+    """A value of a checkpoint serialized by the writer thread without a copy.
+
+    The value keeps changing while it waits for the writer, so this is meant
+    for large arrays of which a slightly newer content is as good, such as
+    the transitions of a replay buffer: rows written meanwhile, which may even
+    be partially written, are saved as they are found.
+    """
+
+    def __init__(self, value: Any):
+        self.value = value
+
+
+def resolve(value: Any) -> Any:
+    """Return `value` with its `Deferred` values replaced by their contents."""
+    if isinstance(value, Deferred):
+        return value.value
+    if isinstance(value, dict):
+        return {key: resolve(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(resolve(item) for item in value)
+    return value
+
+
+def snapshot(value: Any) -> Any:
+    """Return a copy of `value` with its tensors on the CPU and its arrays copied.
+
+    Dictionaries, lists and tuples are copied recursively, so that a snapshot
+    of a `state_dict` is not changed by the training steps that follow.
+    `Deferred` values are not copied.
+    """
+    if isinstance(value, Deferred):
+        return value
+    if isinstance(value, torch.Tensor):
+        return value.detach().to("cpu", copy=True)
+    if isinstance(value, np.ndarray):
+        # Also turns views of memory-mapped files into arrays in memory
+        return np.array(value)
+    if isinstance(value, dict):
+        return {key: snapshot(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return type(value)(snapshot(item) for item in value)
+    return copy.deepcopy(value)
+
+
+def rng_state() -> dict:
+    """Return the states of the global random number generators."""
+    return {
+        "python": random.getstate(),
+        "numpy": np.random.get_state(),
+        "torch": torch.get_rng_state(),
+        "cuda": torch.cuda.get_rng_state_all() if torch.cuda.is_available() else [],
+    }
+
+
+def set_rng_state(state: dict) -> None:
+    """Restore the states of the global random number generators."""
+    random.setstate(state["python"])
+    np.random.set_state(state["numpy"])
+    torch.set_rng_state(state["torch"])
+    if state["cuda"] and torch.cuda.is_available():
+        torch.cuda.set_rng_state_all(state["cuda"])
+
+
+def plain_attributes(obj: Any) -> dict:
+    """Return the attributes of `obj` that are arrays, numbers or booleans.
+
+    These are the state of objects, such as the CALF agents, that keep their
+    learned quantities in NumPy arrays instead of torch modules.
+    """
+    return {
+        name: snapshot(value)
+        for name, value in vars(obj).items()
+        if isinstance(value, (np.ndarray, np.number, int, float, bool))
+    }
+
+
+class Checkpointer:
+    """Writer of the checkpoints of a scenario in a background thread."""
+
+    def __init__(self, directory: str, interval: int, keep: int = 2):
+        """Create the checkpoint directory and start the writer thread.
+
+        Args:
+            directory: The directory of the checkpoints.
+            interval: The number of environment steps between two checkpoints.
+            keep: The number of most recent checkpoints kept in the directory.
+        """
+        if interval < 1 or keep < 1:
+            raise ValueError("interval and keep must be positive")
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.interval = interval
+        self.keep = keep
+        self.last_step = 0
+        # At most one checkpoint waits for the writer, so that a slow disk
+        # delays the next checkpoint instead of piling up copies in memory
+        self.queue = queue.Queue(maxsize=1)
+        self.error = None
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def paths(self) -> list[Path]:
+        """Return the paths of the complete checkpoints, from oldest to newest."""
+        return sorted(
+            self.directory.glob("checkpoint_*.pt"),
+            key=lambda path: int(path.stem.split("_")[1]),
+        )
+
+    def load_latest(self) -> Optional[dict]:
+        """Return the most recent checkpoint, or None if there is none."""
+        paths = self.paths()
+        if not paths:
+            return None
+        state = torch.load(paths[-1], map_location="cpu", weights_only=False)
+        self.last_step = state["counters"]["global_step"]
+        return state
+
+    def is_due(self, global_step: int) -> bool:
+        """Return whether `interval` steps passed since the last checkpoint.
+
+        A due checkpoint is postponed while the previous one still waits for
+        the writer, so that `save` does not block.
+        """
+        return global_step - self.last_step >= self.interval and not self.queue.full()
+
+    def save(self, global_step: int, state: dict) -> None:
+        """Copy `state` and write it as the checkpoint of `global_step` in the background.
+
+        Blocks if a checkpoint still waits for the writer, which `is_due`
+        prevents but for the final checkpoint.
+        """
+        self._raise_error()
+        self.last_step = global_step
+        self.queue.put((global_step, snapshot(state)))
+
+    def close(self) -> None:
+        """Wait for the pending checkpoint to be written and stop the writer."""
+        self.queue.put(None)
+        self.thread.join()
+        self._raise_error()
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            raise RuntimeError("Writing a checkpoint failed") from self.error
+
+    def _write_loop(self) -> None:
+        while (item := self.queue.get()) is not None:
+            global_step, state = item
+            try:
+                path = self.directory / f"checkpoint_{global_step}.pt"
+                temporary = path.with_suffix(".pt.tmp")
+                torch.save(resolve(state), temporary)
+                os.replace(temporary, path)
+                for old_path in self.paths()[: -self.keep]:
+                    old_path.unlink()
+            except Exception as error:
+                self.error = error
@@ -0,0 +1,111 @@
+"""Critic ensemble of the SAC and TD3 scenarios.
+
+`QEnsemble` holds N Q-networks with the architecture of the CleanRL critics
+(two hidden layers of 256 units) as stacked weight tensors, so that all of
+them are evaluated on a batch with three batched matrix products instead of N
+separate forward passes. `soft_update` applies the Polyak update of target
+networks to all their parameters with one fused `torch._foreach_lerp_` call,
+or with `lerp_` per tensor on versions of torch without it.
+"""
+
+import math
+from typing import Iterable, Optional
+
+import torch
+from torch import nn
+import torch.nn.functional as F
+
+
+class QEnsemble(nn.Module):
+    """N Q-networks mapping an observation and an action to a value.
+
+    Each member is initialized like a stack of `nn.Linear` layers, so an
+    ensemble of two behaves as the two separate critics it replaces.
+    """
+
+    def __init__(
+        self,
+        dim_action: int,
+        dim_observation: int,
+        num_critics: int = 2,
+        hidden_size: int = 256,
+    ):
+        super().__init__()
+        if num_critics < 1:
+            raise ValueError(f"num_critics must be positive, got {num_critics}")
+        self.num_critics = num_critics
+        sizes = [dim_observation + dim_action, hidden_size, hidden_size, 1]
+        # Weights are stored as (num_critics, inputs, outputs) for batched matmuls
+        self.weights = nn.ParameterList(
+            nn.Parameter(torch.empty(num_critics, inputs, outputs))
+            for inputs, outputs in zip(sizes[:-1], sizes[1:])
+        )
+        self.biases = nn.ParameterList(
+            nn.Parameter(torch.empty(num_critics, 1, outputs)) for outputs in sizes[1:]
+        )
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        # The bounds of the default initialization of nn.Linear
+        for weight, bias in zip(self.weights, self.biases):
+            bound = 1 / math.sqrt(weight.shape[1])
+            nn.init.uniform_(weight, -bound, bound)
+            nn.init.uniform_(bias, -bound, bound)
+
+    def forward(self, x: torch.Tensor, a: torch.Tensor) -> torch.Tensor:
+        """Return the values of all members, of shape `(num_critics, batch_size, 1)`."""
+        x = torch.cat([x, a], 1)
+        # The first layer broadcasts the batch shared by all members
+        x = F.relu(torch.matmul(x, self.weights[0]) + self.biases[0])
+        x = F.relu(torch.baddbmm(self.biases[1], x, self.weights[1]))
+        return torch.baddbmm(self.biases[2], x, self.weights[2])
+
+    def member(self, index: int, x: torch.Tensor, a: torch.Tensor) -> torch.Tensor:
+        """Return the values of the member `index` alone, of shape `(batch_size, 1)`."""
+        x = torch.cat([x, a], 1)
+        for layer, (weight, bias) in enumerate(zip(self.weights, self.biases)):
+            x = torch.addmm(bias[index], x, weight[index])
+            if layer < len(self.weights) - 1:
+                x = F.relu(x)
+        return x
+
+    def min(
+        self,
+        x: torch.Tensor,
+        a: torch.Tensor,
+        num_min_critics: Optional[int] = None,
+    ) -> torch.Tensor:
+        """Return the minimum of the values over the members, of shape `(batch_size, 1)`.
+
+        Args:
+            x: The observations.
+            a: The actions.
+            num_min_critics: If given, the minimum is taken over this many members
+                drawn at random, as in REDQ, instead of over all of them.
+        """
+        if num_min_critics is not None and not 1 <= num_min_critics <= self.num_critics:
+            raise ValueError(
+                f"num_min_critics must be between 1 and {self.num_critics}, "
+                f"got {num_min_critics}"
+            )
+        values = self(x, a)
+        if num_min_critics is not None and num_min_critics < self.num_critics:
+            members = torch.randperm(self.num_critics, device=values.device)
+            values = values[members[:num_min_critics]]
+        return values.min(dim=0).values
+
+
+@torch.no_grad()
+def soft_update(
+    target_parameters: Iterable[torch.Tensor],
+    parameters: Iterable[torch.Tensor],
+    tau: float,
+) -> None:
+    """Set target parameters to `tau * parameters + (1 - tau) * target_parameters`."""
+    target_parameters, parameters = list(target_parameters), list(parameters)
+    # The fused update is a private API of torch, used when available
+    if hasattr(torch, "_foreach_lerp_"):
+        torch._foreach_lerp_(target_parameters, parameters, tau)
+        return
+    for target_parameter, parameter in zip(target_parameters, parameters):
+        target_parameter.lerp_(parameter, tau)
@@ -0,0 +1,129 @@
+"""Evaluation process of the deterministic policy of the SAC and TD3 scenarios.
+
+The returns of the training episodes are those of the exploring policy. To
+score the deterministic policy (the mean action of SAC, the action of TD3
+without noise) while training goes on, the `EvaluationWorker` process runs
+evaluation episodes on its own copy of the simulator, forked from the scenario.
+The learner submits a snapshot of the actor weights through shared memory and
+collects the returns when the episodes are done, without waiting for them.
+
+Every evaluation starts from the same random generator state, so, with random
+initial states, the snapshots are evaluated on the same initial states.
+"""
+
+import copy
+import multiprocessing as mp
+import queue
+import traceback
+
+import numpy as np
+import torch
+from torch.nn.utils import parameters_to_vector, vector_to_parameters
+
+from src.rgenv import RgEnv
+from .inference import NumpyActor
+
+
+def _evaluation_worker(
+    scenario, actor: torch.nn.Module, worker: "EvaluationWorker", seed: int
+) -> None:
+    """Evaluate the actor weights submitted by the learner until it closes the worker."""
+    try:
+        torch.set_num_threads(1)
+        simulator = scenario.simulator
+        env = RgEnv(simulator, scenario.running_objective)
+        state_init = getattr(simulator, "state_init_callable", None)
+        numpy_actor = NumpyActor(actor)
+        while (global_step := worker.requests.get()) is not None:
+            with torch.no_grad():
+                # A copy, as the parameters would be views of the shared vector
+                vector_to_parameters(worker.weights.clone(), actor.parameters())
+            numpy_actor.sync(actor)
+            np.random.seed(seed)
+            if state_init is not None:
+                # Also restarts the pool of initial states, if any
+                simulator.state_init_callable = copy.copy(state_init)
+            returns = np.zeros(worker.num_episodes)
+            for episode in range(worker.num_episodes):
+                obs, _ = env.reset()
+                truncated = False
+                while not truncated:
+                    action = numpy_actor.action(obs.reshape(1, -1))
+                    obs, reward, _, truncated, _ = env.step(action)
+                    returns[episode] += np.asarray(reward).item()
+            worker.results.put((global_step, returns))
+    except Exception:
+        worker.results.put(traceback.format_exc())
+
+
+class EvaluationWorker:
+    """Process evaluating snapshots of the actor of a scenario."""
+
+    def __init__(self, scenario, num_episodes: int):
+        """Start the process, forked from the current one.
+
+        Args:
+            scenario: The SAC or TD3 scenario, whose `simulator`,
+                `running_objective` and `actor` are copied by the process.
+            num_episodes: The number of episodes of an evaluation.
+        """
+        if num_episodes < 1:
+            raise ValueError("num_episodes must be positive")
+        self.num_episodes = num_episodes
+        context = mp.get_context("fork")
+        # The process acts on the CPU, as CUDA cannot be used after a fork
+        actor = copy.deepcopy(scenario.actor).cpu()
+        self.weights = parameters_to_vector(actor.parameters()).detach().share_memory_()
+        self.requests = context.Queue()
+        self.results = context.Queue()
+        # At most one evaluation is pending, so the weights are only written
+        # while the process does not read them
+        self.pending = False
+        self.process = context.Process(
+            target=_evaluation_worker,
+            args=(scenario, actor, self, int(np.random.randint(2**31 - 1))),
+            daemon=True,
+        )
+        self.process.start()
+
+    def submit(self, actor: torch.nn.Module, global_step: int) -> bool:
+        """Start the evaluation of `actor` unless one is pending.
+
+        Returns:
+            Whether the evaluation was started.
+        """
+        if self.pending:
+            return False
+        self.weights.copy_(parameters_to_vector(actor.parameters()).detach())
+        self.requests.put(global_step)
+        self.pending = True
+        return True
+
+    def poll(self, block: bool = False) -> list[tuple[int, np.ndarray]]:
+        """Return the finished evaluations as (global step, returns of the episodes).
+
+        Args:
+            block: Whether to wait for the pending evaluation to finish.
+        """
+        if not self.pending:
+            return []
+        while True:
+            try:
+                result = self.results.get(timeout=1.0 if block else None, block=block)
+            except queue.Empty:
+                if block and self.process.is_alive():
+                    continue
+                if block:
+                    raise RuntimeError("The evaluation process exited")
+                return []
+            if isinstance(result, str):
+                raise RuntimeError(f"The evaluation process failed:\n{result}")
+            self.pending = False
+            return [result]
+
+    def close(self) -> None:
+        """Stop the process after the pending evaluation, whose result is discarded."""
+        self.requests.put(None)
+        self.process.join()
+        self.requests.close()
+        self.results.close()
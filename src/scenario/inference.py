@@ -0,0 +1,88 @@
+"""Inference-only copy of the SAC and TD3 actors for single observations.
+
+For one observation, evaluating the 256x256 actor network with torch is
+dominated by the per-call overhead of tensors, modules and autograd rather
+than by the arithmetic. `NumpyActor` mirrors the weights of an actor as NumPy
+arrays and computes actions with three matrix-vector products, and, for SAC,
+samples an action without computing its log-probability, which is only needed
+for training. The mirror is refreshed with `sync` after the actor has been
+updated.
+
+A `NumpyActor` can also be used on its own to deploy a trained actor in a
+control loop:
+
+    actor = NumpyActor(scenario.actor)
+    action = actor.action(observation)
+"""
+
+import numpy as np
+import torch
+from torch import nn
+
+
+class NumpyActor:
+    """NumPy mirror of the `Actor` of `td3.py` or of `sac.py`."""
+
+    def __init__(self, actor: nn.Module):
+        self.stochastic = hasattr(actor, "fc_logstd")
+        self.sync(actor)
+
+    @torch.no_grad()
+    def sync(self, actor: nn.Module) -> None:
+        """Copy the current weights of `actor`."""
+        if self.stochastic:
+            # The mean and log std heads are evaluated as one layer
+            heads = (actor.fc_mean, actor.fc_logstd)
+            self.log_std_min, self.log_std_max = actor.log_std_min, actor.log_std_max
+        else:
+            heads = (actor.fc_mu,)
+        layers = [
+            (actor.fc1.weight, actor.fc1.bias),
+            (actor.fc2.weight, actor.fc2.bias),
+            (
+                torch.cat([head.weight for head in heads]),
+                torch.cat([head.bias for head in heads]),
+            ),
+        ]
+        # On the CPU, the arrays share the memory of the parameters instead of
+        # copying them. They are still re-read by `sync`, because the parameters
+        # may be replaced rather than updated in place
+        self.weights = [weight.detach().cpu().numpy() for weight, _ in layers]
+        self.biases = [bias.detach().cpu().numpy() for _, bias in layers]
+        self.action_scale = actor.action_scale.cpu().numpy()
+        self.action_bias = actor.action_bias.cpu().numpy()
+
+    def _output(self, observations: np.ndarray) -> np.ndarray:
+        x = np.asarray(observations, dtype=np.float32)
+        for weight, bias in zip(self.weights[:-1], self.biases[:-1]):
+            x = x @ weight.T
+            x += bias
+            np.maximum(x, 0, out=x)
+        x = x @ self.weights[-1].T
+        x += self.biases[-1]
+        return x
+
+    def _mean_and_log_std(self, observations: np.ndarray) -> tuple:
+        mean, log_std = np.split(self._output(observations), 2, axis=-1)
+        log_std = self.log_std_min + 0.5 * (self.log_std_max - self.log_std_min) * (
+            np.tanh(log_std) + 1
+        )
+        return mean, log_std
+
+    def action(self, observations: np.ndarray) -> np.ndarray:
+        """Return the deterministic actions, i.e. the mean action for SAC.
+
+        Args:
+            observations: The observations, of shape `(batch_size, dim_observation)`.
+        """
+        if self.stochastic:
+            mean, _ = self._mean_and_log_std(observations)
+        else:
+            mean = self._output(observations)
+        return np.tanh(mean) * self.action_scale + self.action_bias
+
+    def sample(self, observations: np.ndarray) -> np.ndarray:
+        """Return actions sampled from the squashed Gaussian policy of SAC."""
+        mean, log_std = self._mean_and_log_std(observations)
+        mean += np.exp(log_std) * np.random.standard_normal(mean.shape)
+        return np.tanh(mean) * self.action_scale + self.action_bias
@@ -0,0 +1,264 @@
+"""Prioritized replay buffer of the SAC and TD3 scenarios.
+
+`PrioritizedReplayBuffer` samples transitions with probabilities proportional
+to their priorities `(|TD error| + epsilon) ** alpha`, as in prioritized
+experience replay (Schaul et al., 2016), instead of uniformly. New transitions
+get the largest priority seen so far, and the priorities of sampled
+transitions are updated from the TD errors of the critic update with
+`update_priorities`. The bias of the non-uniform sampling is corrected by the
+importance-sampling weights returned with the batches, normalized by their
+maximum, with an exponent `beta` annealed to 1 over the training.
+
+The priorities are stored in `SumTree`, two flat arrays holding the sums and
+the minima of the priorities of all subtrees, so that sampling a batch and
+updating the priorities of a batch take O(log N) vectorized operations.
+"""
+
+import math
+from pathlib import Path
+from typing import NamedTuple
+
+import numpy as np
+import torch
+
+from .replay_buffer import ReplayBuffer
+
+
+class PrioritizedReplayBufferSamples(NamedTuple):
+    observations: torch.Tensor
+    actions: torch.Tensor
+    next_observations: torch.Tensor
+    dones: torch.Tensor
+    rewards: torch.Tensor
+    # The importance-sampling weights, of shape `(batch_size,)`
+    weights: torch.Tensor
+    # The positions of the transitions in the buffer, for `update_priorities`
+    indices: np.ndarray
+
+
+class SumTree:
+    """Binary tree of the sums and minima of `capacity` priorities.
+
+    The tree is stored in arrays of size `2 * size`, where `size` is the power
+    of two from `capacity`: node `i` has the children `2 * i` and `2 * i + 1`,
+    the root is node 1 and the priorities are the leaves `size + index`.
+    """
+
+    def __init__(self, capacity: int):
+        self.depth = max(math.ceil(math.log2(capacity)), 0)
+        self.size = 2**self.depth
+        self.sums = np.zeros(2 * self.size)
+        # Leaves without a priority do not count in the minimum
+        self.mins = np.full(2 * self.size, np.inf)
+
+    @property
+    def total(self) -> float:
+        return self.sums[1]
+
+    @property
+    def min(self) -> float:
+        return self.mins[1]
+
+    @property
+    def priorities(self) -> np.ndarray:
+        return self.sums[self.size :]
+
+    def update(self, indices: np.ndarray, priorities: np.ndarray) -> None:
+        """Set the priorities of the leaves `indices` and update their ancestors."""
+        nodes = np.asarray(indices) + self.size
+        self.sums[nodes] = priorities
+        self.mins[nodes] = priorities
+        if len(nodes) <= 4:
+            # For a few leaves, as when adding transitions, walking up with
+            # scalars is faster than the vectorized operations below
+            sums, mins = self.sums, self.mins
+            for node in nodes.tolist():
+                node //= 2
+                while node >= 1:
+                    left, right = 2 * node, 2 * node + 1
+                    sums[node] = sums[left] + sums[right]
+                    mins[node] = min(mins[left], mins[right])
+                    node //= 2
+            return
+        for _ in range(self.depth):
+            # Duplicated nodes are recomputed from the same children, so they
+            # need not be removed
+            nodes //= 2
+            children = 2 * nodes
+            self.sums[nodes] = self.sums[children] + self.sums[children + 1]
+            self.mins[nodes] = np.minimum(self.mins[children], self.mins[children + 1])
+
+    def rebuild(self, priorities: np.ndarray) -> None:
+        """Set the priorities of the first leaves, clear the others and rebuild the tree."""
+        self.sums[:] = 0
+        self.mins[:] = np.inf
+        self.sums[self.size : self.size + len(priorities)] = priorities
+        self.mins[self.size : self.size + len(priorities)] = priorities
+        for level in reversed(range(self.depth)):
+            nodes = slice(2**level, 2 ** (level + 1))
+            children = slice(2 ** (level + 1), 2 ** (level + 2))
+            self.sums[nodes] = self.sums[children].reshape(-1, 2).sum(axis=1)
+            self.mins[nodes] = self.mins[children].reshape(-1, 2).min(axis=1)
+
+    def find(self, values: np.ndarray) -> np.ndarray:
+        """Return the leaves at which the prefix sums of the priorities exceed `values`."""
+        nodes = np.ones(len(values), dtype=np.int64)
+        for _ in range(self.depth):
+            children = 2 * nodes
+            left_sums = self.sums[children]
+            is_right = values >= left_sums
+            values -= left_sums * is_right
+            nodes = children + is_right
+        return nodes - self.size
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """Replay buffer sampling transitions in proportion to their priorities.
+
+    The batches of `sample` and `sample_block` are
+    `PrioritizedReplayBufferSamples`, whose `weights` are overwritten by the
+    next call like the other tensors.
+    """
+
+    def __init__(
+        self,
+        buffer_size: int,
+        dim_observation: int,
+        dim_action: int,
+        batch_size: int,
+        alpha: float = 0.6,
+        beta: float = 0.4,
+        beta_steps: int = 1,
+        epsilon: float = 1e-6,
+        **kwargs,
+    ):
+        """Allocate the buffer.
+
+        Args:
+            buffer_size: See `ReplayBuffer`.
+            dim_observation: See `ReplayBuffer`.
+            dim_action: See `ReplayBuffer`.
+            batch_size: See `ReplayBuffer`.
+            alpha: The exponent of the priorities, 0 for uniform sampling.
+            beta: The initial exponent of the importance-sampling weights.
+            beta_steps: The number of sampled batches over which `beta` is
+                annealed linearly to 1.
+            epsilon: The constant added to the absolute TD errors, so that no
+                transition has a zero probability.
+            **kwargs: The other arguments of `ReplayBuffer`.
+        """
+        if alpha < 0 or not 0 <= beta <= 1 or beta_steps < 1 or epsilon <= 0:
+            raise ValueError(
+                "alpha must be non-negative, beta between 0 and 1, "
+                "beta_steps and epsilon positive"
+            )
+        super().__init__(buffer_size, dim_observation, dim_action, batch_size, **kwargs)
+        self.alpha = alpha
+        self.beta_init = beta
+        self.beta_steps = beta_steps
+        self.epsilon = epsilon
+        self.num_sampled_batches = 0
+        self.max_priority = 1.0
+        self.tree = SumTree(buffer_size)
+        # The offsets of the strata of the rows of the batches of a block
+        self._strata = np.tile(
+            np.arange(batch_size, dtype=np.float64), self.max_batches
+        )
+
+        num_rows = batch_size * self.max_batches
+        host_weights = torch.empty(num_rows, pin_memory=self._copied is not None)
+        self._weights = host_weights.numpy()
+        if self._copied is not None:
+            device_weights = torch.empty_like(host_weights, device=self.device)
+            self._transfers.append((host_weights, device_weights))
+        else:
+            device_weights = host_weights
+        self._batches = [
+            PrioritizedReplayBufferSamples(
+                *batch,
+                weights=device_weights[index * batch_size : (index + 1) * batch_size],
+                indices=self._indices[index * batch_size : (index + 1) * batch_size],
+            )
+            for index, batch in enumerate(self._batches)
+        ]
+
+    @property
+    def beta(self) -> float:
+        fraction = min(self.num_sampled_batches / self.beta_steps, 1.0)
+        return self.beta_init + (1.0 - self.beta_init) * fraction
+
+    def add(
+        self,
+        observations: np.ndarray,
+        next_observations: np.ndarray,
+        actions: np.ndarray,
+        rewards: np.ndarray,
+        dones: np.ndarray,
+    ) -> None:
+        positions = (self.pos + np.arange(len(observations))) % self.buffer_size
+        super().add(observations, next_observations, actions, rewards, dones)
+        self.tree.update(positions, self.max_priority)
+
+    def _sample_indices(self, num_rows: int) -> np.ndarray:
+        # Stratified sampling: each batch has one value in each of `batch_size`
+        # equal segments of the total priority
+        values = self._uniform[:num_rows]
+        self.rng.random(out=values)
+        values += self._strata[:num_rows]
+        values *= self.tree.total / self.batch_size
+        indices = self._indices[:num_rows]
+        # Rounding may lead past the last transition
+        np.minimum(self.tree.find(values), self.size - 1, out=indices)
+
+        # (N * P(i)) ** -beta normalized by its maximum, the one of the
+        # smallest priority
+        weights = self._weights[:num_rows]
+        np.divide(self.tree.priorities[indices], self.tree.min, out=weights)
+        weights **= -self.beta
+        self.num_sampled_batches += num_rows // self.batch_size
+        return indices
+
+    def update_priorities(
+        self, indices: np.ndarray, td_errors: "torch.Tensor | np.ndarray"
+    ) -> None:
+        """Set the priorities of the transitions `indices` from their TD errors.
+
+        Args:
+            indices: The `indices` of a sampled batch.
+            td_errors: The TD errors of the transitions, of shape `(batch_size,)`.
+        """
+        if torch.is_tensor(td_errors):
+            td_errors = td_errors.detach().cpu().numpy()
+        priorities = (np.abs(td_errors) + self.epsilon) ** self.alpha
+        self.tree.update(indices, priorities)
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+
+    def state_dict(self) -> dict:
+        return super().state_dict() | {
+            "priorities": self.tree.priorities[: self.size],
+            "max_priority": self.max_priority,
+            "num_sampled_batches": self.num_sampled_batches,
+        }
+
+    def load_state_dict(self, state: dict) -> None:
+        super().load_state_dict(state)
+        self.tree.rebuild(state["priorities"])
+        self.max_priority = state["max_priority"]
+        self.num_sampled_batches = state["num_sampled_batches"]
+
+    def save(self, path: str) -> None:
+        """Save the buffer as `ReplayBuffer.save` does, with the priorities."""
+        Path(path).mkdir(parents=True, exist_ok=True)
+        np.save(Path(path, "priorities.npy"), self.tree.priorities[: self.size])
+        super().save(path)
+
+    def load(self, path: str) -> None:
+        """Load a buffer saved by `save`. Without saved priorities, all are equal."""
+        super().load(path)
+        priorities_path = Path(path, "priorities.npy")
+        if priorities_path.exists():
+            priorities = np.load(priorities_path)[: self.size]
+        else:
+            priorities = np.full(self.size, self.max_priority)
+        self.tree.rebuild(priorities)
+        self.max_priority = max(self.max_priority, float(priorities.max(initial=0)))
@@ -0,0 +1,92 @@
+"""Buffered recording of the trajectories passed to the callbacks.
+
+By default, `CleanRLScenario.post_compute_action` triggers the callbacks at
+every simulation step, each of them (`ScenarioStepLogger`,
+`TrajectoryStoreCallback`, ...) processing one step at a time. With
+`record_every > 1`, the scenario instead writes the steps of the current
+episode to a `TrajectoryRecorder`, triggers the per-step callbacks only every
+`record_every` steps and hands the whole episode over to the callbacks at once
+with `dump_data_buffer`, as regelum's `RLScenario` does for episodes simulated
+in parallel.
+"""
+
+import numpy as np
+from regelum.data_buffers import DataBuffer
+
+
+class TrajectoryRecorder:
+    """Preallocated buffer of the steps of an episode.
+
+    The arrays are allocated once for `capacity` steps and reused by every
+    episode after `clear`. An episode longer than `capacity` steps doubles them.
+    """
+
+    def __init__(
+        self, capacity: int, dim_state: int, dim_observation: int, dim_action: int
+    ):
+        """Allocate the buffer.
+
+        Args:
+            capacity: The initial number of steps, e.g. the length of an episode.
+            dim_state: The dimension of the states.
+            dim_observation: The dimension of the observations.
+            dim_action: The dimension of the actions.
+        """
+        if capacity < 1:
+            raise ValueError("capacity must be positive")
+        self.num_steps = 0
+        self.columns = {
+            "estimated_state": np.empty((capacity, dim_state)),
+            "observation": np.empty((capacity, dim_observation)),
+            "action": np.empty((capacity, dim_action)),
+            "time": np.empty(capacity),
+            "running_objective": np.empty(capacity),
+            "current_undiscounted_value": np.empty(capacity),
+            "step_id": np.empty(capacity, dtype=np.int64),
+        }
+
+    def __len__(self) -> int:
+        return self.num_steps
+
+    def record(self, state, obs, action, reward, time, global_step, value) -> None:
+        """Write a step, whose state, observation and action are row vectors."""
+        if self.num_steps == len(self.columns["time"]):
+            for key, column in self.columns.items():
+                self.columns[key] = np.concatenate([column, np.empty_like(column)])
+        step = self.num_steps
+        columns = self.columns
+        columns["estimated_state"][step] = state
+        columns["observation"][step] = obs
+        columns["action"][step] = action
+        columns["time"][step] = time
+        columns["running_objective"][step] = reward
+        columns["current_undiscounted_value"][step] = value
+        columns["step_id"][step] = global_step
+        self.num_steps += 1
+
+    def data_buffer(self, episode_id: int, iteration_id: int) -> DataBuffer:
+        """Return the recorded steps as a regelum `DataBuffer`.
+
+        The data buffer has the keys of the outputs of `post_compute_action`
+        and holds copies of the recorded steps, so the recorder can be cleared.
+        """
+        num_steps = self.num_steps
+        data = {key: column[:num_steps].copy() for key, column in self.columns.items()}
+        # Vector-valued keys are lists of rows, as `DataBuffer.push_to_end` makes
+        for key in ["estimated_state", "observation", "action"]:
+            data[key] = list(data[key])
+        data_buffer = DataBuffer()
+        data_buffer.update(
+            data
+            | {
+                "episode_id": np.full(num_steps, episode_id),
+                "iteration_id": np.full(num_steps, iteration_id),
+                # The discounted value is not tracked
+                "current_value": np.full(num_steps, np.nan),
+            }
+        )
+        return data_buffer
+
+    def clear(self) -> None:
+        """Start recording a new episode."""
+        self.num_steps = 0
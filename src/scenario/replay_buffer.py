@@ -0,0 +1,407 @@
+"""Replay buffer of the SAC and TD3 scenarios.
+
+`ReplayBuffer` stores transitions in preallocated contiguous arrays used as a
+ring: adding transitions writes them in place, and sampling gathers the
+sampled rows into a batch allocated once, whose memory is shared by numpy
+arrays and torch tensors, so neither allocates per step. The samples have the
+same fields as the ones of the stable-baselines3 replay buffer the scenarios
+were written for.
+`sample_block` gathers several minibatches at once for blocks of updates.
+
+With `storage_dir`, the arrays are `np.memmap` files in that directory instead
+of RAM, so that large buffers of concurrent runs share the page cache instead
+of each holding its buffer in memory. The most recent transitions are kept in
+an in-RAM window and written to the files in contiguous blocks. Observations
+can also be stored as float16 to halve the size of the largest arrays.
+
+A buffer is saved with `save` and restored with `load`. The saved directory
+contains one `.npy` file per array and `state.json` with the write position,
+so it can be loaded by a buffer in RAM or used directly as the `storage_dir`
+of a memory-mapped one. `state_dict` and `load_state_dict` do the same in
+memory, for the checkpoints of the scenarios, which for a memory-mapped
+buffer only hold the write position, its transitions staying in the files.
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import NamedTuple, Optional
+
+import numpy as np
+import torch
+
+
+class ReplayBufferSamples(NamedTuple):
+    observations: torch.Tensor
+    actions: torch.Tensor
+    next_observations: torch.Tensor
+    dones: torch.Tensor
+    rewards: torch.Tensor
+
+
+class ReplayBuffer:
+    """Ring buffer of transitions with allocation-free adding and sampling.
+
+    The tensors returned by `sample` and `sample_block` are views of a block
+    of batches that is reused, i.e. they are overwritten by the next call to
+    either method. When `device` is a GPU, the block is gathered in pinned
+    memory and copied to tensors on the device, which are reused in the same way.
+    """
+
+    observation_dtypes = ("float32", "float16")
+
+    def __init__(
+        self,
+        buffer_size: int,
+        dim_observation: int,
+        dim_action: int,
+        batch_size: int,
+        device: str = "cpu",
+        seed: Optional[int] = None,
+        storage_dir: Optional[str] = None,
+        hot_window: int = 4096,
+        observation_dtype: str = "float32",
+        max_batches: int = 1,
+    ):
+        """Allocate the buffer.
+
+        Args:
+            buffer_size: The maximal number of stored transitions. When the buffer
+                is full, the oldest transitions are overwritten.
+            dim_observation: The dimension of the observations.
+            dim_action: The dimension of the actions.
+            batch_size: The number of transitions returned by `sample`.
+            device: The device of the sampled tensors.
+            seed: The seed of the generator of the sampled indices.
+            storage_dir: If given, the transitions are stored in memory-mapped
+                files in this directory. Files of a buffer saved there with the
+                same sizes are reused, but its content is only restored by `load`.
+            hot_window: With `storage_dir`, the number of most recent transitions
+                kept in RAM before they are written to the files, at most
+                `buffer_size`.
+            observation_dtype: The dtype in which observations are stored,
+                `"float32"` or `"float16"`. Sampled observations are float32.
+            max_batches: The maximal number of batches sampled at once by
+                `sample_block`.
+        """
+        if buffer_size < 1 or batch_size < 1 or max_batches < 1:
+            raise ValueError("buffer_size, batch_size and max_batches must be positive")
+        if hot_window < 0:
+            raise ValueError("hot_window must be non-negative")
+        if observation_dtype not in self.observation_dtypes:
+            raise ValueError(
+                f"observation_dtype must be one of {self.observation_dtypes}, "
+                f"got {observation_dtype}"
+            )
+        self.buffer_size = buffer_size
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.device = torch.device(device)
+        self.rng = np.random.default_rng(seed)
+        self.storage_dir = None if storage_dir is None else Path(storage_dir)
+        self.pos = 0
+        self.size = 0
+
+        layout = {
+            "observations": (dim_observation, observation_dtype),
+            "actions": (dim_action, "float32"),
+            "next_observations": (dim_observation, observation_dtype),
+            "dones": (1, "float32"),
+            "rewards": (1, "float32"),
+        }
+        if self.storage_dir is not None:
+            self.storage_dir.mkdir(parents=True, exist_ok=True)
+        for name, (dim, dtype) in layout.items():
+            setattr(self, name, self._allocate(name, (buffer_size, dim), dtype))
+        self._storage = tuple(getattr(self, name) for name in layout)
+
+        # Transitions not yet written to the memory-mapped files. They belong
+        # at the position `_hot_start` of the ring. The window holds at most
+        # `buffer_size` of them, so that a flush wraps around the ring at most once
+        self.hot_window = (
+            min(hot_window, buffer_size) if self.storage_dir is not None else 0
+        )
+        self._hot = tuple(
+            np.empty((self.hot_window, storage.shape[1]), dtype=storage.dtype)
+            for storage in self._storage
+        )
+        self._hot_start = 0
+        self._hot_size = 0
+
+        # The sampled indices are computed in these buffers without allocating
+        self._uniform = np.empty(batch_size * max_batches)
+        self._indices = np.empty(batch_size * max_batches, dtype=np.int64)
+
+        pin_memory = self.device.type == "cuda"
+        self._host_batch = ReplayBufferSamples(
+            *(
+                torch.empty(
+                    (batch_size * max_batches, storage.shape[1]),
+                    dtype=torch.float32,
+                    pin_memory=pin_memory,
+                )
+                for storage in self._storage
+            )
+        )
+        # numpy views of the host batch, the targets of the gathers. Rows of
+        # arrays stored in another dtype are first gathered in `_gathered`
+        self._host_arrays = tuple(tensor.numpy() for tensor in self._host_batch)
+        self._gathered = tuple(
+            batch if storage.dtype == batch.dtype else batch.astype(storage.dtype)
+            for storage, batch in zip(self._storage, self._host_arrays)
+        )
+        if pin_memory:
+            self._device_batch = ReplayBufferSamples(
+                *(
+                    torch.empty_like(tensor, device=self.device)
+                    for tensor in self._host_batch
+                )
+            )
+            self._copied = torch.cuda.Event()
+            # Pairs of pinned host tensors and device tensors copied per block
+            self._transfers = list(zip(self._host_batch, self._device_batch))
+        else:
+            self._device_batch = self._host_batch
+            self._copied = None
+        # The batches of a block, views of consecutive rows of the block
+        self._batches = [
+            ReplayBufferSamples(
+                *(
+                    tensor[index * batch_size : (index + 1) * batch_size]
+                    for tensor in self._device_batch
+                )
+            )
+            for index in range(max_batches)
+        ]
+
+    def _allocate(self, name: str, shape: tuple, dtype: str) -> np.ndarray:
+        if self.storage_dir is None:
+            return np.empty(shape, dtype=dtype)
+        path = self.storage_dir / f"{name}.npy"
+        if path.exists():
+            existing = np.load(path, mmap_mode="r+")
+            if existing.shape == shape and existing.dtype == dtype:
+                return existing
+            del existing
+        return np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def add(
+        self,
+        observations: np.ndarray,
+        next_observations: np.ndarray,
+        actions: np.ndarray,
+        rewards: np.ndarray,
+        dones: np.ndarray,
+    ) -> None:
+        """Add one transition per environment.
+
+        Args:
+            observations: The observations, of shape `(num_envs, dim_observation)`.
+            next_observations: The next observations, of the same shape.
+            actions: The actions, of shape `(num_envs, dim_action)`.
+            rewards: The rewards, of shape `(num_envs,)`.
+            dones: The termination flags, of shape `(num_envs,)`.
+        """
+        transitions = (
+            observations,
+            actions,
+            next_observations,
+            np.reshape(dones, (-1, 1)),
+            np.reshape(rewards, (-1, 1)),
+        )
+        num_envs = len(observations)
+        if num_envs > self.hot_window:
+            self.flush()
+            self._write(self._storage, self.pos, transitions)
+            self._hot_start = (self.pos + num_envs) % self.buffer_size
+        else:
+            if self._hot_size + num_envs > self.hot_window:
+                self.flush()
+            for hot, values in zip(self._hot, transitions):
+                hot[self._hot_size : self._hot_size + num_envs] = values
+            self._hot_size += num_envs
+        self.pos = (self.pos + num_envs) % self.buffer_size
+        self.size = min(self.size + num_envs, self.buffer_size)
+
+    def _write(self, storage: tuple, start: int, transitions: tuple) -> None:
+        end = start + len(transitions[0])
+        if end <= self.buffer_size:
+            for array, values in zip(storage, transitions):
+                array[start:end] = values
+        else:
+            # Wrap around the end of the ring
+            split = self.buffer_size - start
+            for array, values in zip(storage, transitions):
+                array[start:] = values[:split]
+                array[: end - self.buffer_size] = values[split:]
+
+    def flush(self) -> None:
+        """Write the transitions of the in-RAM window to the memory-mapped files."""
+        if self._hot_size > 0:
+            self._write(
+                self._storage,
+                self._hot_start,
+                tuple(hot[: self._hot_size] for hot in self._hot),
+            )
+        self._hot_start = self.pos
+        self._hot_size = 0
+
+    def sample(self, batch_size: Optional[int] = None) -> ReplayBufferSamples:
+        """Sample `batch_size` transitions uniformly with replacement.
+
+        Args:
+            batch_size: Must be the batch size the buffer was created with. The
+                argument only exists for compatibility with stable-baselines3.
+
+        Returns:
+            The sampled transitions. The tensors are overwritten by the next call.
+        """
+        if batch_size is not None and batch_size != self.batch_size:
+            raise ValueError(
+                f"The buffer samples batches of {self.batch_size} transitions, "
+                f"got batch_size={batch_size}"
+            )
+        return self.sample_block(1)[0]
+
+    def sample_block(self, num_batches: int) -> list[ReplayBufferSamples]:
+        """Sample `num_batches` batches of transitions with a single gather.
+
+        Args:
+            num_batches: The number of batches, at most `max_batches`.
+
+        Returns:
+            The batches. The tensors are overwritten by the next call.
+        """
+        if not 1 <= num_batches <= self.max_batches:
+            raise ValueError(
+                f"num_batches must be between 1 and {self.max_batches}, "
+                f"got {num_batches}"
+            )
+        if self.size == 0:
+            raise ValueError("Cannot sample from an empty replay buffer")
+        num_rows = num_batches * self.batch_size
+        if self._copied is not None:
+            # The previous block must have left the pinned memory before reusing it
+            self._copied.synchronize()
+        indices = self._sample_indices(num_rows)
+        for storage, gathered in zip(self._storage, self._gathered):
+            np.take(storage, indices, axis=0, out=gathered[:num_rows])
+        if self._hot_size > 0:
+            # Rows of the in-RAM window are not in the files yet
+            offsets = (indices - self._hot_start) % self.buffer_size
+            is_hot = offsets < self._hot_size
+            if is_hot.any():
+                for hot, gathered in zip(self._hot, self._gathered):
+                    gathered[:num_rows][is_hot] = hot[offsets[is_hot]]
+        for gathered, batch in zip(self._gathered, self._host_arrays):
+            if gathered is not batch:
+                np.copyto(batch[:num_rows], gathered[:num_rows])
+        if self._copied is not None:
+            for host, device in self._transfers:
+                device[:num_rows].copy_(host[:num_rows], non_blocking=True)
+            self._copied.record()
+        return self._batches[:num_batches]
+
+    def _sample_indices(self, num_rows: int) -> np.ndarray:
+        """Draw the indices of `num_rows` sampled transitions uniformly."""
+        uniform, indices = self._uniform[:num_rows], self._indices[:num_rows]
+        self.rng.random(out=uniform)
+        uniform *= self.size
+        np.copyto(indices, uniform, casting="unsafe")
+        return indices
+
+    def save(self, path: str) -> None:
+        """Save the transitions and the write position to the directory `path`.
+
+        If `path` is the `storage_dir` of the buffer, the files are only flushed.
+        """
+        path = Path(path)
+        path.mkdir(parents=True, exist_ok=True)
+        self.flush()
+        for name, storage in zip(ReplayBufferSamples._fields, self._storage):
+            if self._is_storage_dir(path):
+                storage.flush()
+            else:
+                np.save(path / f"{name}.npy", storage)
+        # The state is written last and atomically, so that it is only found
+        # next to complete arrays
+        with open(path / "state.json.tmp", "w") as file:
+            json.dump(
+                {"pos": self.pos, "size": self.size, "buffer_size": self.buffer_size},
+                file,
+            )
+        os.replace(path / "state.json.tmp", path / "state.json")
+
+    def load(self, path: str) -> None:
+        """Restore the transitions and the write position saved by `save` in `path`."""
+        path = Path(path)
+        with open(path / "state.json") as file:
+            state = json.load(file)
+        if state["buffer_size"] != self.buffer_size:
+            raise ValueError(
+                f"The buffer in {path} has buffer_size={state['buffer_size']}, "
+                f"expected {self.buffer_size}"
+            )
+        if not self._is_storage_dir(path):
+            for name, storage in zip(ReplayBufferSamples._fields, self._storage):
+                storage[:] = np.load(path / f"{name}.npy", mmap_mode="r")
+        self.pos, self.size = state["pos"], state["size"]
+        self._hot_start, self._hot_size = self.pos, 0
+
+    def state_dict(self) -> dict:
+        """Return the transitions, the write position and the state of the sampler.
+
+        The arrays are views of the storage, which must be copied before the
+        buffer changes to be kept. With `storage_dir`, the transitions are
+        instead written to the memory-mapped files and left out, so that the
+        state only holds the write position and the sampler. The files keep
+        changing afterwards, so restoring it restores the most recent
+        transitions, not the ones at the time of the call.
+        """
+        self.flush()
+        state = {
+            "pos": self.pos,
+            "size": self.size,
+            "buffer_size": self.buffer_size,
+            "rng": self.rng.bit_generator.state,
+        }
+        if self.storage_dir is not None:
+            for storage in self._storage:
+                storage.flush()
+            return state
+        return state | {
+            name: storage[: self.size]
+            for name, storage in zip(ReplayBufferSamples._fields, self._storage)
+        }
+
+    def load_state_dict(self, state: dict) -> None:
+        """Restore the buffer from a dictionary returned by `state_dict`.
+
+        A state without transitions, from a memory-mapped buffer, can only be
+        restored by a buffer using the same files as `storage_dir`.
+        """
+        if state["buffer_size"] != self.buffer_size:
+            raise ValueError(
+                f"The saved buffer has buffer_size={state['buffer_size']}, "
+                f"expected {self.buffer_size}"
+            )
+        if "observations" not in state and self.storage_dir is None:
+            raise ValueError(
+                "The saved buffer was memory-mapped and its transitions are only "
+                "in its files, pass them as storage_dir"
+            )
+        if "observations" in state:
+            for name, storage in zip(ReplayBufferSamples._fields, self._storage):
+                storage[: state["size"]] = state[name]
+        self.pos, self.size = state["pos"], state["size"]
+        self._hot_start, self._hot_size = self.pos, 0
+        self.rng.bit_generator.state = state["rng"]
+
+    def _is_storage_dir(self, path: Path) -> bool:
+        return (
+            self.storage_dir is not None
+            and path.resolve() == self.storage_dir.resolve()
+        )
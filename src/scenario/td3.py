@@ -6,7 +6,7 @@ the regelum framework.
 
 Key components:
 1. Actor network
-2. Critic networks (Q-functions)
+2. Critic networks (Q-functions), an ensemble evaluated in one pass (critic.py)
 3. TD3Scenario class, which inherits from CleanRLScenario
 
 The TD3 algorithm improves upon DDPG by using two critic networks to reduce overestimation bias,
@@ -14,24 +14,28 @@ delayed policy updates, and target policy smoothing.
 
 Main features:
 - Integration with regelum's Simulator and RunningObjective classes
-- Use of stable-baselines3 ReplayBuffer for efficient experience storage
+- Preallocated ring replay buffer (see replay_buffer.py) for efficient experience storage
+- NumPy inference of the actor for single observations (see inference.py)
 - Customizable hyperparameters for easy experimentation
 
 This implementation allows for seamless integration with regelum's ecosystem while maintaining
 the core TD3 algorithm structure.
 """
 
+import math
 from typing import Optional
 import numpy as np
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
-from stable_baselines3.common.buffers import ReplayBuffer
 import gymnasium as gym
 
 from regelum.simulator import Simulator
 from .base import CleanRLScenario
+from .critic import QEnsemble, soft_update
+from .prioritized_replay import PrioritizedReplayBuffer
+from .replay_buffer import ReplayBuffer, ReplayBufferSamples
 from regelum.objective import RunningObjective
 from src.rgenv import RgEnv
 
@@ -68,21 +72,16 @@ class Actor(nn.Module):
         return torch.tanh(self.fc_mu(x)) * self.action_scale + self.action_bias
 
 
-class QNetwork(nn.Module):
-    def __init__(self, dim_action: int, dim_observation: int):
-        super().__init__()
-        self.fc1 = nn.Linear(dim_observation + dim_action, 256)
-        self.fc2 = nn.Linear(256, 256)
-        self.fc3 = nn.Linear(256, 1)
-
-    def forward(self, x, a):
-        x = torch.cat([x, a], 1)
-        x = F.relu(self.fc1(x))
-        x = F.relu(self.fc2(x))
-        return self.fc3(x)
-
-
 class TD3Scenario(CleanRLScenario):
+    checkpointed_attributes = (
+        "actor",
+        "actor_target",
+        "qf",
+        "qf_target",
+        "actor_optimizer",
+        "q_optimizer",
+    )
+
     def __init__(
         self,
         simulator: Simulator,
@@ -99,6 +98,32 @@ class TD3Scenario(CleanRLScenario):
         exploration_noise: float = 0.1,
         learning_rate: float = 3e-4,
         policy_noise: float = 0.2,
+        num_envs: int = 1,
+        num_workers: int = 0,
+        replay_storage_dir: Optional[str] = None,
+        replay_hot_window: int = 4096,
+        replay_observation_dtype: str = "float32",
+        replay_buffer_path: Optional[str] = None,
+        prioritized_replay: bool = False,
+        priority_alpha: float = 0.6,
+        priority_beta: float = 0.4,
+        num_critics: int = 2,
+        num_min_critics: Optional[int] = None,
+        num_actors: int = 0,
+        utd_ratio: float = 1.0,
+        updates_every: int = 1,
+        actor_sync_interval: int = 1,
+        max_actor_lead: int = 1000,
+        checkpoint_dir: Optional[str] = None,
+        checkpoint_interval: int = 10000,
+        precision: str = "float32",
+        record_every: int = 1,
+        profile: bool = False,
+        profile_interval: int = 10000,
+        profile_trace: Optional[str] = None,
+        headless: bool = False,
+        eval_interval: Optional[int] = None,
+        eval_episodes: int = 10,
     ):
         """
         Initialize the TD3Scenario.
@@ -118,12 +143,76 @@ class TD3Scenario(CleanRLScenario):
             exploration_noise: Standard deviation of Gaussian exploration noise.
             learning_rate: Learning rate for the optimizer.
             policy_noise: Standard deviation of Gaussian noise added to policy.
+            num_envs: Number of copies of the system simulated in parallel.
+            num_workers: Number of worker processes simulating the copies (0 for none).
+            replay_storage_dir: Directory of memory-mapped files storing the replay
+                buffer instead of RAM (None to keep it in RAM).
+            replay_hot_window: Number of recent transitions kept in RAM before they
+                are written to the files of `replay_storage_dir`.
+            replay_observation_dtype: Dtype of the stored observations, "float32"
+                or "float16".
+            replay_buffer_path: Directory the replay buffer is loaded from, if it
+                was saved there, at the start of `run`, and saved to at its end.
+            prioritized_replay: Whether to sample transitions in proportion to
+                their TD errors instead of uniformly (see prioritized_replay.py).
+            priority_alpha: Exponent of the priorities of prioritized replay.
+            priority_beta: Initial exponent of the importance-sampling weights of
+                prioritized replay, annealed to 1 over the gradient updates.
+            num_critics: Number of Q-networks of the critic ensemble (at least 2).
+            num_min_critics: Number of Q-networks drawn at random for the minimum
+                in the target value, as in REDQ (None for all of them).
+            num_actors: Number of actor processes stepping the environment while
+                the main process trains (0 to alternate both in one process).
+            utd_ratio: Gradient updates per environment step.
+            updates_every: Environment steps between two blocks of gradient updates,
+                each performing the updates due by `utd_ratio` back to back.
+            actor_sync_interval: Gradient updates between two weight transfers to
+                the actor processes.
+            max_actor_lead: Maximal number of environment steps the actor processes
+                may collect ahead of the ones consumed by the learner.
+            checkpoint_dir: Directory of the periodic checkpoints, from the latest
+                of which the run resumes (None for no checkpoints).
+            checkpoint_interval: Environment steps between two checkpoints.
+            precision: Precision of the gradient updates, "float32" or "bfloat16"
+                (bfloat16 autocast with float32 weights, e.g. for CPUs with AMX).
+            record_every: Simulation steps between two calls of the per-step
+                callbacks, the others being recorded and handed over in bulk at
+                the end of each episode (1 to call them at every step).
+            profile: Whether to time the stages of the loop and log their p50,
+                p95 and p99 every `profile_interval` environment steps.
+            profile_interval: Environment steps between two logs of the timings.
+            profile_trace: Path of the Chrome trace of the timed calls written
+                at the end of a profiled run (None for no trace).
+            headless: Whether to skip the per-step and per-episode callbacks,
+                passing only the episodic returns, losses and timings to the
+                callbacks, e.g. for hyperparameter sweeps.
+            eval_interval: Environment steps between two evaluations of the
+                deterministic actor in a background process (None for no
+                evaluation).
+            eval_episodes: Number of episodes of an evaluation.
         """
         super().__init__(
             simulator=simulator,
             running_objective=running_objective,
             total_timesteps=total_timesteps,
             device=device,
+            num_envs=num_envs,
+            num_workers=num_workers,
+            num_actors=num_actors,
+            utd_ratio=utd_ratio,
+            updates_every=updates_every,
+            actor_sync_interval=actor_sync_interval,
+            max_actor_lead=max_actor_lead,
+            checkpoint_dir=checkpoint_dir,
+            checkpoint_interval=checkpoint_interval,
+            precision=precision,
+            record_every=record_every,
+            profile=profile,
+            profile_interval=profile_interval,
+            profile_trace=profile_trace,
+            headless=headless,
+            eval_interval=eval_interval,
+            eval_episodes=eval_episodes,
         )
         self.buffer_size = buffer_size
         self.gamma = gamma
@@ -135,6 +224,14 @@ class TD3Scenario(CleanRLScenario):
         self.exploration_noise = exploration_noise
         self.learning_rate = learning_rate
         self.policy_noise = policy_noise
+        if num_critics < 2:
+            raise ValueError(f"num_critics must be at least 2, got {num_critics}")
+        if num_min_critics is not None and not 1 <= num_min_critics <= num_critics:
+            raise ValueError(
+                f"num_min_critics must be between 1 and {num_critics}, "
+                f"got {num_min_critics}"
+            )
+        self.num_min_critics = num_min_critics
 
         dim_action, dim_observation, self.action_bounds = (
             simulator.system._dim_inputs,
@@ -149,167 +246,197 @@ class TD3Scenario(CleanRLScenario):
         self.actor_target.load_state_dict(self.actor.state_dict())
         self.actor_optimizer = optim.Adam(self.actor.parameters(), lr=learning_rate)
 
-        self.qf1 = QNetwork(dim_action, dim_observation).to(device)
-        self.qf2 = QNetwork(dim_action, dim_observation).to(device)
-        self.qf1_target = QNetwork(dim_action, dim_observation).to(device)
-        self.qf2_target = QNetwork(dim_action, dim_observation).to(device)
-        self.qf1_target.load_state_dict(self.qf1.state_dict())
-        self.qf2_target.load_state_dict(self.qf2.state_dict())
-        self.q_optimizer = optim.Adam(
-            list(self.qf1.parameters()) + list(self.qf2.parameters()), lr=learning_rate
-        )
-
-        self.rb = ReplayBuffer(
+        # All critics are evaluated in one batched forward pass
+        self.qf = QEnsemble(dim_action, dim_observation, num_critics).to(device)
+        self.qf_target = QEnsemble(dim_action, dim_observation, num_critics).to(device)
+        self.qf_target.load_state_dict(self.qf.state_dict())
+        self.q_optimizer = optim.Adam(self.qf.parameters(), lr=learning_rate)
+
+        replay_buffer_class, priority_kwargs = ReplayBuffer, {}
+        if prioritized_replay:
+            replay_buffer_class = PrioritizedReplayBuffer
+            priority_kwargs = dict(
+                alpha=priority_alpha,
+                beta=priority_beta,
+                beta_steps=max(
+                    math.ceil(utd_ratio * (total_timesteps - learning_starts)), 1
+                ),
+            )
+        self.rb = replay_buffer_class(
             buffer_size,
-            observation_space=gym.spaces.Box(-np.inf, np.inf, shape=(dim_observation,)),
-            action_space=gym.spaces.Box(
-                low=self.action_bounds[:, 0], high=self.action_bounds[:, 1]
-            ),
-            device=device,
-            handle_timeout_termination=False,
+            dim_observation=dim_observation,
+            dim_action=dim_action,
+            batch_size=batch_size,
+            device=self.device,
+            storage_dir=replay_storage_dir,
+            hot_window=replay_hot_window,
+            observation_dtype=replay_observation_dtype,
+            # A block of updates samples all its minibatches at once
+            max_batches=math.ceil(updates_every * utd_ratio),
+            **priority_kwargs,
         )
+        self.replay_buffer_path = replay_buffer_path
 
     def run(self):
+        if self.num_actors > 0:
+            return self.run_decoupled()
+        start_step, learning_starts = self.start_or_resume()
+        # Forks the evaluation process before the stages are timed
+        self.evaluate(start_step)
+        self.instrument()
         obs, _ = self.envs.reset()
-        for global_step in range(self.total_timesteps):
+        for global_step in range(start_step, self.total_timesteps):
             # ALGO LOGIC: put action logic here
-            if global_step < self.learning_starts:
-                actions = np.array(
-                    [
-                        np.random.uniform(
-                            low=self.action_bounds[:, 0],
-                            high=self.action_bounds[:, 1],
-                        )
-                    ]
+            if global_step < learning_starts:
+                actions = np.random.uniform(
+                    low=self.action_bounds[:, 0],
+                    high=self.action_bounds[:, 1],
+                    size=(self.num_envs, len(self.action_bounds)),
                 )
             else:
-                with torch.no_grad():
-                    actions = self.actor(torch.Tensor(obs).to(self.device))
-                    actions += torch.normal(
-                        0, self.actor.action_scale * self.exploration_noise
-                    )
-                    actions = (
-                        actions.cpu()
-                        .numpy()
-                        .clip(self.action_bounds[:, 0], self.action_bounds[:, 1])
-                    )
+                actions = self.policy_actions(obs)
 
-            self.state = self.envs.envs[0].env.state.reshape(1, -1)
-            self.time = self.envs.envs[0].env.simulator.time
+            self.state, self.time = self.get_logged_state_and_time()
             # TRY NOT TO MODIFY: execute the game and log data.
             next_obs, rewards, terminations, truncations, infos = self.envs.step(
                 actions
             )
-            # We need state and time for logging, so we extracted it 2 lines above
+            # We need state and time for logging, so we extracted them
             # before calling the step method
-            self.post_compute_action(
+            self.record_step(
                 self.state,
-                obs,
-                actions,
-                float(rewards.reshape(-1)),
+                obs[:1],
+                actions[:1],
+                float(rewards[0]),
                 self.time,
                 global_step,
             )
             # TRY NOT TO MODIFY: record rewards for plotting purposes
             if "final_info" in infos:
-                for info in infos["final_info"]:
+                for info in infos["final_info"][infos["_final_info"]]:
                     self.save_episodic_return(
                         global_step=global_step, episodic_return=info["episode"]["r"]
                     )
-                    self.reload_scenario()
-                    self.reset_episode()
-                    self.reset_iteration()
+                # Episode bookkeeping follows the environment passed to callbacks
+                if infos["_final_info"][0]:
+                    self.end_episode()
 
             # TRY NOT TO MODIFY: save data to reply buffer; handle `final_observation`
             real_next_obs = next_obs.copy()
             for idx, trunc in enumerate(truncations):
                 if trunc:
                     real_next_obs[idx] = infos["final_observation"][idx]
-            self.rb.add(obs, real_next_obs, actions, rewards, terminations, infos)
+            self.rb.add(obs, real_next_obs, actions, rewards, terminations)
 
             # TRY NOT TO MODIFY: CRUCIAL step easy to overlook
             obs = next_obs
 
-            # ALGO LOGIC: training.
-            if global_step > self.learning_starts:
-                data = self.rb.sample(self.batch_size)
-                with torch.no_grad():
-                    clipped_noise = (
-                        torch.randn_like(data.actions, device=self.device)
-                        * self.policy_noise
-                    ).clamp(
-                        -self.noise_clip, self.noise_clip
-                    ) * self.actor_target.action_scale
-
-                    next_state_actions = (
-                        self.actor_target(data.next_observations) + clipped_noise
-                    ).clamp(
-                        self.envs.single_action_space.low[0],
-                        self.envs.single_action_space.high[0],
-                    )
+            # ALGO LOGIC: training, in blocks of updates every `updates_every` steps
+            if (
+                global_step > learning_starts
+                and (global_step - learning_starts) % self.updates_every == 0
+            ):
+                self.train_updates(global_step, learning_starts)
+            self.save_checkpoint(global_step + 1, learning_starts=learning_starts)
+            self.evaluate(global_step + 1)
+        self.save_checkpoint(
+            max(self.total_timesteps, start_step),
+            final=True,
+            learning_starts=learning_starts,
+        )
+        self.evaluate(max(self.total_timesteps, start_step), final=True)
+        self.save_replay_buffer()
+        self.end_run()
+
+    def policy_actions(self, obs: np.ndarray) -> np.ndarray:
+        """Return the actions of the actor with Gaussian exploration noise."""
+        if len(obs) == 1:
+            actor = self.single_observation_actor()
+            actions = actor.action(obs)
+            actions += np.random.normal(0, actor.action_scale * self.exploration_noise)
+            return actions.clip(self.action_bounds[:, 0], self.action_bounds[:, 1])
+        with torch.no_grad():
+            actions = self.actor(torch.Tensor(obs).to(self.device))
+            actions += torch.normal(
+                0,
+                (self.actor.action_scale * self.exploration_noise).expand_as(actions),
+            )
+            return (
+                actions.cpu()
+                .numpy()
+                .clip(self.action_bounds[:, 0], self.action_bounds[:, 1])
+            )
 
-                    qf1_next_target = self.qf1_target(
-                        data.next_observations, next_state_actions
-                    )
-                    qf2_next_target = self.qf2_target(
-                        data.next_observations, next_state_actions
-                    )
-                    min_qf_next_target = torch.min(qf1_next_target, qf2_next_target)
-                    next_q_value = data.rewards.flatten() + (
-                        1 - data.dones.flatten()
-                    ) * self.gamma * (min_qf_next_target).view(-1)
-
-                qf1_a_values = self.qf1(data.observations, data.actions).view(-1)
-                qf2_a_values = self.qf2(data.observations, data.actions).view(-1)
-                qf1_loss = F.mse_loss(qf1_a_values, next_q_value)
-                qf2_loss = F.mse_loss(qf2_a_values, next_q_value)
-                qf_loss = qf1_loss + qf2_loss
-
-                # optimize the model
-                self.q_optimizer.zero_grad()
-                qf_loss.backward()
-                self.q_optimizer.step()
-
-                actor_loss = None
-                if global_step % self.policy_frequency == 0:
-                    actor_loss = -self.qf1(
-                        data.observations, self.actor(data.observations)
-                    ).mean()
-                    self.actor_optimizer.zero_grad()
-                    actor_loss.backward()
-                    self.actor_optimizer.step()
-
-                    # update the target network
-                    for param, target_param in zip(
-                        self.actor.parameters(), self.actor_target.parameters()
-                    ):
-                        target_param.data.copy_(
-                            self.tau * param.data + (1 - self.tau) * target_param.data
-                        )
-                    for param, target_param in zip(
-                        self.qf1.parameters(), self.qf1_target.parameters()
-                    ):
-                        target_param.data.copy_(
-                            self.tau * param.data + (1 - self.tau) * target_param.data
-                        )
-                    for param, target_param in zip(
-                        self.qf2.parameters(), self.qf2_target.parameters()
-                    ):
-                        target_param.data.copy_(
-                            self.tau * param.data + (1 - self.tau) * target_param.data
-                        )
-
-                if global_step % 100 and actor_loss is not None:
-                    # We use callbacks functionality to save losses and metrics
-                    # The save_losses method is implemented in the base class
-                    # and handles the logging through callbacks
-                    self.save_losses(
-                        global_step=global_step,
-                        actor_loss=actor_loss.item(),
-                        qf1_loss=qf1_loss.item(),
-                        qf2_loss=qf2_loss.item(),
-                        qf_loss=qf_loss.item() / 2.0,
-                        qf1_values=qf1_a_values.mean().item(),
-                        qf2_values=qf2_a_values.mean().item(),
-                    )
-        self.envs.close()
+    def train_step(self, update_step: int, global_step: int, data: ReplayBufferSamples):
+        """Perform one gradient update of the critics and, if due, of the actor.
+
+        Args:
+            update_step: The index of the update, which schedules the delayed
+                actor and target updates.
+            global_step: The environment step, used for logging.
+            data: The minibatch of transitions.
+        """
+        with torch.no_grad(), self.autocast():
+            clipped_noise = (
+                torch.randn_like(data.actions, device=self.device) * self.policy_noise
+            ).clamp(-self.noise_clip, self.noise_clip) * self.actor_target.action_scale
+
+            next_state_actions = (
+                self.actor_target(data.next_observations) + clipped_noise
+            ).clamp(
+                self.envs.single_action_space.low[0],
+                self.envs.single_action_space.high[0],
+            )
+
+            min_qf_next_target = self.qf_target.min(
+                data.next_observations, next_state_actions, self.num_min_critics
+            )
+            next_q_value = data.rewards.flatten() + (
+                1 - data.dones.flatten()
+            ) * self.gamma * (min_qf_next_target).view(-1)
+
+        with self.autocast():
+            qf_a_values = self.qf(data.observations, data.actions).squeeze(-1)
+        # The sum of the mean squared errors of all critics
+        qf_losses = self.critic_losses(qf_a_values, next_q_value, data)
+        qf_loss = qf_losses.sum()
+
+        # optimize the model
+        self.q_optimizer.zero_grad()
+        qf_loss.backward()
+        self.q_optimizer.step()
+
+        actor_loss = None
+        if update_step % self.policy_frequency == 0:
+            # As in TD3, the actor follows the first critic
+            with self.autocast():
+                actor_values = self.qf.member(
+                    0, data.observations, self.actor(data.observations)
+                )
+            actor_loss = -actor_values.float().mean()
+            self.actor_optimizer.zero_grad()
+            actor_loss.backward()
+            self.actor_optimizer.step()
+            self.actor_updated = True
+
+            # update the target networks
+            soft_update(
+                self.actor_target.parameters(),
+                self.actor.parameters(),
+                self.tau,
+            )
+            soft_update(self.qf_target.parameters(), self.qf.parameters(), self.tau)
+
+        if update_step % 100 and actor_loss is not None:
+            # We use callbacks functionality to save losses and metrics
+            # The save_losses method is implemented in the base class
+            # and handles the logging through callbacks
+            self.save_losses(
+                global_step=global_step,
+                actor_loss=actor_loss.item(),
+                qf1_loss=qf_losses[0].item(),
+                qf2_loss=qf_losses[1].item(),
+                qf_loss=qf_losses.mean().item(),
+                qf1_values=qf_a_values[0].mean().item(),
+                qf2_values=qf_a_values[1].mean().item(),
+            )
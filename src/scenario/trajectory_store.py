@@ -0,0 +1,272 @@
+"""Trajectory store appending all the episodes of a run to one columnar file.
+
+`HistoricalDataCallback` saves the trajectory of every episode to its own h5
+file, with an svg plot, which makes thousands of small files for long runs.
+`TrajectoryStoreCallback` instead appends the steps of all the episodes to a
+single Arrow IPC stream `.callbacks/TrajectoryStoreCallback/trajectories.arrows`
+in the directory of the run, in compressed chunks (record batches) of
+`chunk_size` steps:
+
+- the chunks are compressed and written by a background thread, so the
+  training loop only copies the steps of a chunk,
+- a stream is readable up to its last complete chunk, so a crash loses at most
+  the chunk being written and the steps not written yet,
+- `read_trajectories` reads a store back into NumPy arrays.
+
+The columns are the outputs of `post_compute_action`: `episode_id`,
+`iteration_id` and `step_id` are integers, the states, observations and actions
+are rows of fixed size and the other columns are floats (NaN for values that
+are not tracked, such as `current_value` in the CleanRL scenarios).
+"""
+
+import queue
+import threading
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+import pyarrow as pa
+from regelum.callback import Callback
+from regelum.scenario import Scenario
+
+INTEGER_KEYS = ("episode_id", "iteration_id", "step_id")
+FLOAT_KEYS = (
+    "time",
+    "running_objective",
+    "current_value",
+    "current_undiscounted_value",
+)
+VECTOR_KEYS = ("estimated_state", "observation", "action")
+
+
+class TrajectoryStore:
+    """Writer of trajectories to an Arrow IPC stream in a background thread."""
+
+    def __init__(self, path: str, chunk_size: int = 10000, compression: str = "zstd"):
+        """Prepare the store. The file is created with the first chunk.
+
+        Args:
+            path: The path of the stream.
+            chunk_size: The number of steps in a chunk.
+            compression: The compression of the chunks, `"zstd"`, `"lz4"` or
+                `None`.
+        """
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be positive")
+        self.path = Path(path)
+        self.chunk_size = chunk_size
+        self.options = pa.ipc.IpcWriteOptions(compression=compression)
+        self.columns = None
+        self.num_steps = 0
+        # A slow disk delays the loop by at most two chunks instead of
+        # piling them up in memory
+        self.queue = queue.Queue(maxsize=2)
+        self.error = None
+        self.thread = None
+
+    def _allocate(self, dims: dict[str, int]) -> None:
+        size = self.chunk_size
+        self.columns = (
+            {key: np.empty(size, dtype=np.int64) for key in INTEGER_KEYS}
+            | {key: np.empty(size) for key in FLOAT_KEYS}
+            | {key: np.empty((size, dims[key])) for key in VECTOR_KEYS}
+        )
+        self.thread = threading.Thread(target=self._write_loop, daemon=True)
+        self.thread.start()
+
+    def append(self, step: dict) -> None:
+        """Append a step, an output of `post_compute_action`."""
+        if self.columns is None:
+            self._allocate(
+                {key: np.size(step[key]) for key in VECTOR_KEYS},
+            )
+        index = self.num_steps
+        for key in INTEGER_KEYS + FLOAT_KEYS:
+            value = step[key]
+            self.columns[key][index] = np.nan if value is None else value
+        for key in VECTOR_KEYS:
+            self.columns[key][index] = np.reshape(step[key], -1)
+        self.num_steps += 1
+        if self.num_steps == self.chunk_size:
+            self.write_chunk()
+
+    def extend(self, steps: dict) -> None:
+        """Append the steps of a dictionary of columns, e.g. of a `DataBuffer`.
+
+        The vector-valued columns are arrays or lists of rows.
+        """
+        steps = {
+            key: np.asarray(steps[key], dtype=float).reshape(len(steps[key]), -1)
+            for key in VECTOR_KEYS
+        } | {
+            key: np.asarray(steps[key], dtype=float).reshape(-1)
+            for key in INTEGER_KEYS + FLOAT_KEYS
+        }
+        if self.columns is None:
+            self._allocate({key: steps[key].shape[1] for key in VECTOR_KEYS})
+        start, total = 0, len(steps["time"])
+        while start < total:
+            count = min(total - start, self.chunk_size - self.num_steps)
+            for key, column in self.columns.items():
+                column[self.num_steps : self.num_steps + count] = steps[key][
+                    start : start + count
+                ]
+            self.num_steps += count
+            start += count
+            if self.num_steps == self.chunk_size:
+                self.write_chunk()
+
+    def write_chunk(self) -> None:
+        """Hand the buffered steps over to the writer thread as a chunk."""
+        self._raise_error()
+        if self.num_steps == 0:
+            return
+        self.queue.put(
+            {
+                key: column[: self.num_steps].copy()
+                for key, column in self.columns.items()
+            }
+        )
+        self.num_steps = 0
+
+    def flush(self) -> None:
+        """Write the buffered steps and wait until all chunks are written."""
+        self.write_chunk()
+        if self.thread is not None:
+            self.queue.join()
+        self._raise_error()
+
+    def close(self) -> None:
+        """Write the buffered steps and stop the writer thread."""
+        self.write_chunk()
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+        self._raise_error()
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            raise RuntimeError("Writing trajectories failed") from self.error
+
+    def _write_loop(self) -> None:
+        writer = None
+        while (chunk := self.queue.get()) is not None:
+            try:
+                batch = to_record_batch(chunk)
+                if writer is None:
+                    self.path.parent.mkdir(parents=True, exist_ok=True)
+                    writer = pa.ipc.new_stream(
+                        str(self.path), batch.schema, options=self.options
+                    )
+                writer.write_batch(batch)
+            except Exception as error:
+                self.error = error
+            finally:
+                self.queue.task_done()
+        if writer is not None:
+            writer.close()
+
+
+def to_record_batch(columns: dict[str, np.ndarray]) -> pa.RecordBatch:
+    """Return the steps in `columns` as an Arrow record batch."""
+    arrays = {}
+    for key, column in columns.items():
+        if column.ndim == 2:
+            arrays[key] = pa.FixedSizeListArray.from_arrays(
+                pa.array(column.reshape(-1)), column.shape[1]
+            )
+        else:
+            arrays[key] = pa.array(column)
+    return pa.RecordBatch.from_pydict(arrays)
+
+
+def read_trajectories(path: str, episode_id: Optional[int] = None) -> dict:
+    """Read a trajectory store into NumPy arrays.
+
+    A chunk truncated by a crash, and the ones after it, are skipped.
+
+    Args:
+        path: The path of the stream.
+        episode_id: If given, only the steps of this episode are returned.
+
+    Returns:
+        A dictionary of columns. The states, observations and actions are
+        arrays of shape `(num_steps, dim)`.
+    """
+    batches = []
+    with pa.OSFile(str(path)) as source:
+        reader = pa.ipc.open_stream(source)
+        while True:
+            try:
+                batches.append(reader.read_next_batch())
+            except StopIteration:
+                break
+            except (pa.ArrowInvalid, OSError):
+                # Truncated chunk
+                break
+        table = pa.Table.from_batches(batches, schema=reader.schema)
+    columns = {}
+    for name in table.column_names:
+        column = table[name].combine_chunks()
+        if pa.types.is_fixed_size_list(column.type):
+            columns[name] = (
+                column.flatten().to_numpy().reshape(-1, column.type.list_size)
+            )
+        else:
+            columns[name] = column.to_numpy()
+    if episode_id is not None:
+        mask = columns["episode_id"] == episode_id
+        columns = {name: column[mask] for name, column in columns.items()}
+    return columns
+
+
+class TrajectoryStoreCallback(Callback):
+    """Callback appending the trajectories of a run to a `TrajectoryStore`.
+
+    It records the outputs of `post_compute_action` of regelum scenarios, and
+    the data buffers of `dump_data_buffer`, through which the CleanRL scenarios
+    with `record_every > 1` hand their episodes over at once. It is enabled
+    in presets/main.yaml instead of `HistoricalDataCallback`.
+    """
+
+    def __init__(self, chunk_size: int = 10000, compression: str = "zstd", **kwargs):
+        """Initialize the callback.
+
+        Args:
+            chunk_size: See `TrajectoryStore`.
+            compression: See `TrajectoryStore`.
+            **kwargs: The arguments of regelum's Callback.
+        """
+        super().__init__(**kwargs)
+        self.store = TrajectoryStore(
+            Path(f".callbacks/{self.__class__.__name__}/trajectories.arrows").resolve(),
+            chunk_size=chunk_size,
+            compression=compression,
+        )
+
+    def is_target_event(self, obj, method, output, triggers):
+        return isinstance(obj, Scenario) and method in [
+            "post_compute_action",
+            "dump_data_buffer",
+            "end_run",
+        ]
+
+    def on_function_call(self, obj, method, output):
+        if method == "post_compute_action":
+            # Scenarios with a recorder hand all the steps over in dump_data_buffer
+            if getattr(obj, "recorder", None) is None:
+                self.store.append(output)
+        elif method == "dump_data_buffer":
+            _, data_buffer = output
+            self.store.extend(
+                {
+                    key: data_buffer.data[key]
+                    for key in INTEGER_KEYS + FLOAT_KEYS + VECTOR_KEYS
+                }
+            )
+        else:
+            self.store.flush()
+
+    def on_termination(self, res):
+        self.store.close()
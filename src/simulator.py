@@ -1,21 +1,256 @@
 from regelum.simulator import CasADi
 from regelum.system import System, ComposedSystem
+from regelum.utils import rg
 from typing import Union, Optional, Callable
+from pathlib import Path
+import copy
+import hashlib
+import inspect
+import os
+import subprocess
+import tempfile
 import numpy as np
+import casadi
+
+
+# Compiled integrators shared by all `StateInitRandomSamplerSimulator` instances
+# of the process, see `StateInitRandomSamplerSimulator.integrator_cache_key`
+_integrator_cache = {}
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return tuple(sorted((key, _freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+def _scale_to_bounds(unit_samples: np.ndarray, bounds: np.ndarray) -> np.ndarray:
+    return bounds[:, 0] + unit_samples * (bounds[:, 1] - bounds[:, 0])
+
+
+def load_compiled_state_dynamics(
+    system: System, directory: Optional[str] = None
+) -> casadi.Function:
+    """Return the state dynamics of `system` as a natively compiled CasADi function.
+
+    On the first call for a given system class and parameters, the dynamics are
+    traced into a CasADi function `f(state, action)`, which is then exported to C
+    and compiled into a shared library with the compiler from the `CC`
+    environment variable (`gcc` by default). The library is cached on disk, so
+    later calls, also from other processes and runs, only load it.
+
+    The library is keyed by the class name, the system parameters, the state and
+    action dimensions, the source code of `_compute_state_dynamics` and the
+    CasADi version, so that editing the dynamics invalidates the cache.
+
+    Args:
+        system: The system whose `compute_state_dynamics` is compiled.
+        directory: The cache directory. Defaults to
+            `~/.cache/regelum-playground/dynamics`.
+
+    Returns:
+        The function loaded from the shared library.
+    """
+    if directory is None:
+        directory = Path.home() / ".cache" / "regelum-playground" / "dynamics"
+    directory = Path(directory)
+    system_class = type(system)
+    key = repr(
+        (
+            f"{system_class.__module__}.{system_class.__qualname__}",
+            _freeze(system.parameters),
+            system.dim_state,
+            system.dim_inputs,
+            inspect.getsource(system_class._compute_state_dynamics),
+            casadi.__version__,
+        )
+    )
+    name = f"{system_class.__name__}_{hashlib.sha1(key.encode()).hexdigest()[:16]}"
+    library = directory / f"{name}.so"
+
+    if not library.exists():
+        state_symbolic = rg.array_symb(system.dim_state, literal="x")
+        action_symbolic = rg.array_symb(system.dim_inputs, literal="u")
+        state_dynamics = casadi.Function(
+            name,
+            [state_symbolic, action_symbolic],
+            [
+                system.compute_state_dynamics(
+                    None, state_symbolic, action_symbolic, _native_dim=True
+                )
+            ],
+        ).expand()
+        directory.mkdir(parents=True, exist_ok=True)
+        with tempfile.TemporaryDirectory(dir=directory) as build_directory:
+            code_generator = casadi.CodeGenerator(f"{name}.c", {"with_header": False})
+            code_generator.add(state_dynamics)
+            source = code_generator.generate(build_directory + os.sep)
+            built_library = Path(build_directory) / library.name
+            subprocess.run(
+                [
+                    os.environ.get("CC", "gcc"),
+                    "-O3",
+                    "-fPIC",
+                    "-shared",
+                    source,
+                    "-o",
+                    str(built_library),
+                ],
+                check=True,
+            )
+            # Atomic, so that concurrent runs never load a partially written file
+            os.replace(built_library, library)
+
+    return casadi.external(name, str(library))
 
 
 class UniformStateInitGenerator:
-    def __init__(self, bounds: list[list[float]]):
+    """Sampler of initial states distributed uniformly within box bounds.
+
+    By default, every call draws a fresh sample from the global NumPy random
+    generator. If `pool_size` is set, a pool of `pool_size` initial states is
+    generated up front with a dedicated generator seeded by `seed`, and calls
+    serve the states of the pool one after another, starting over once the pool
+    is exhausted. The pool is filled according to `sampling`:
+
+    - `"uniform"`: independent uniform samples,
+    - `"sobol"`: a scrambled Sobol sequence,
+    - `"latin_hypercube"`: Latin hypercube sampling.
+
+    The last two are low-discrepancy designs that cover the box more evenly than
+    independent samples of the same size.
+
+    If `pool_path` is set, the pool is loaded from this `.npy` file if it exists
+    and saved to it otherwise, so that several runs can use exactly the same
+    initial states.
+    """
+
+    samplings = ("uniform", "sobol", "latin_hypercube")
+
+    def __init__(
+        self,
+        bounds: list[list[float]],
+        pool_size: Optional[int] = None,
+        sampling: str = "uniform",
+        seed: Optional[int] = None,
+        pool_path: Optional[str] = None,
+    ):
         self.bounds = np.array(bounds)
+        if sampling not in self.samplings:
+            raise ValueError(
+                f"Unknown sampling {sampling}. Use one of {self.samplings}."
+            )
+        self.sampling = sampling
+        self.seed = seed
+        self.pool = None
+        self.pool_position = 0
+        if pool_path is not None and Path(pool_path).exists():
+            self.pool = np.load(pool_path)
+            if self.pool.ndim != 2 or self.pool.shape[1] != len(self.bounds):
+                raise ValueError(
+                    f"The pool in {pool_path} has shape {self.pool.shape}, "
+                    f"expected (pool_size, {len(self.bounds)})."
+                )
+        elif pool_size is not None:
+            self.pool = self.generate_pool(pool_size)
+            if pool_path is not None:
+                self.save_pool(pool_path)
+        elif pool_path is not None:
+            raise ValueError(f"{pool_path} does not exist and pool_size is not set.")
 
     def __call__(self) -> np.ndarray:
+        if self.pool is not None:
+            state_init = self.pool[self.pool_position].reshape(1, -1).copy()
+            self.pool_position = (self.pool_position + 1) % len(self.pool)
+            return state_init
         state_init = np.random.uniform(
             low=self.bounds[:, 0], high=self.bounds[:, 1]
         ).reshape(1, -1)
         return state_init
 
+    def generate_pool(self, pool_size: int) -> np.ndarray:
+        """Generate `pool_size` initial states according to `self.sampling`.
+
+        Returns:
+            An array of shape `(pool_size, dim_state)`.
+        """
+        if self.sampling == "uniform":
+            unit_samples = np.random.default_rng(self.seed).uniform(
+                size=(pool_size, len(self.bounds))
+            )
+        else:
+            from scipy.stats import qmc
+
+            if self.sampling == "sobol":
+                sampler = qmc.Sobol(d=len(self.bounds), seed=self.seed)
+            else:
+                sampler = qmc.LatinHypercube(d=len(self.bounds), seed=self.seed)
+            unit_samples = sampler.random(pool_size)
+        return _scale_to_bounds(unit_samples, self.bounds)
+
+    def save_pool(self, path: str) -> None:
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        np.save(path, self.pool)
+
+    def shard(self, index: int, num_shards: int) -> "UniformStateInitGenerator":
+        """Return a generator that serves every `num_shards`-th state of the pool.
+
+        The shards for `index = 0, ..., num_shards - 1` partition the pool, so
+        parallel workers that each take one of them never use the same initial
+        state (as long as none of them exhausts its shard). Without a pool,
+        this generator itself is returned.
+        """
+        if self.pool is None:
+            return self
+        if not 0 <= index < num_shards <= len(self.pool):
+            raise ValueError(
+                f"Cannot take shard {index} of {num_shards} from a pool of "
+                f"{len(self.pool)} states."
+            )
+        shard = copy.copy(self)
+        shard.pool = self.pool[index::num_shards]
+        shard.pool_position = 0
+        return shard
+
+
 
 class StateInitRandomSamplerSimulator(CasADi):
+    """CasADi simulator that samples a new initial state on every reset.
+
+    By default, the system is integrated with the CasADi integrator of
+    `regelum.simulator.CasADi`. Alternatively, `fixed_step_method` selects an
+    explicit scheme that takes exactly one step of length `max_step` per
+    simulation step:
+
+    - `"euler"`: explicit Euler,
+    - `"rk4"`: classical fourth-order Runge-Kutta,
+    - `"semi_implicit_euler"`: semi-implicit (symplectic) Euler, which updates
+      the state components from the last one to the first one, each using the
+      already updated later components. For states ordered as positions followed
+      by velocities (as in the pendulum systems of the playground) this is the
+      usual "velocity first, then position" scheme. For systems whose state
+      does not have this ordering, it would reduce to explicit Euler and is
+      rejected with a ValueError.
+
+    The fixed-step schemes are unsuitable for the lunar lander, whose dynamics
+    switch discontinuously on touchdown, and `euler` and `semi_implicit_euler`
+    for the cart-pole and the pendulum with motor at their preset sampling
+    times, see notes/fixed_step_integrators.md.
+
+    Either way, the compiled integrator is cached per process and shared by all
+    instances with the same system class, system parameters, step sizes,
+    tolerances and `fixed_step_method`, so a reset only swaps the initial state.
+
+    With `compile_dynamics=True`, the right-hand side of the system is evaluated
+    by native code generated from it instead of by CasADi's virtual machine,
+    see `load_compiled_state_dynamics`. The generated shared libraries are
+    cached in `compiled_dynamics_dir`.
+    """
+
+    fixed_step_methods = ("euler", "rk4", "semi_implicit_euler")
+
     def __init__(
         self,
         system: Union[System, ComposedSystem],
@@ -26,7 +261,21 @@ class StateInitRandomSamplerSimulator(CasADi):
         first_step: Optional[float] = 1e-6,
         atol: Optional[float] = 1e-5,
         rtol: Optional[float] = 1e-3,
+        fixed_step_method: Optional[str] = None,
+        compile_dynamics: bool = False,
+        compiled_dynamics_dir: Optional[str] = None,
     ):
+        if (
+            fixed_step_method is not None
+            and fixed_step_method not in self.fixed_step_methods
+        ):
+            raise ValueError(
+                f"Unknown fixed_step_method {fixed_step_method}. "
+                f"Use one of {self.fixed_step_methods} or None."
+            )
+        self.fixed_step_method = fixed_step_method
+        self.compile_dynamics = compile_dynamics
+        self.compiled_dynamics_dir = compiled_dynamics_dir
         self.state_init_callable = state_init
         self.state_init = self.state_init_callable()
         super().__init__(
@@ -54,3 +303,126 @@ class StateInitRandomSamplerSimulator(CasADi):
             self.observation = self.get_observation(
                 time=self.time, state=self.state_init, inputs=self.system.inputs
             )
+
+    def integrator_cache_key(self, max_step) -> Optional[tuple]:
+        """Return the key of the compiled integrator in the process-wide cache.
+
+        Returns None if the integrator should not be cached. This is the case for
+        composed systems, whose dynamics are not determined by their class and
+        parameters alone, and for systems with unhashable parameters.
+        """
+        if isinstance(self.system, ComposedSystem):
+            return None
+        key = (
+            type(self.system),
+            _freeze(self.system.parameters),
+            max_step,
+            self.first_step,
+            self.atol,
+            self.rtol,
+            self.fixed_step_method,
+            self.compile_dynamics,
+            self.compiled_dynamics_dir,
+        )
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def create_CasADi_integrator(self, max_step):
+        key = self.integrator_cache_key(max_step)
+        if key is None:
+            return self.compile_integrator(max_step)
+        if key not in _integrator_cache:
+            _integrator_cache[key] = self.compile_integrator(max_step)
+        return _integrator_cache[key]
+
+    def check_semi_implicit_euler_ordering(self, state_symbolic, action_symbolic):
+        """Raise a ValueError if semi-implicit Euler would be plain Euler for the system.
+
+        Updating the components from the last one to the first one only
+        changes the scheme if the derivative of some component depends on a
+        later one, as the positions depend on the velocities in states ordered
+        as positions followed by velocities. Otherwise, the scheme silently
+        reduces to explicit Euler.
+        """
+        jacobian = casadi.jacobian(
+            self.system.compute_state_dynamics(
+                None, state_symbolic, action_symbolic, _native_dim=True
+            ),
+            state_symbolic,
+        )
+        dependencies = np.array(casadi.DM(jacobian.sparsity(), 1))
+        if not np.triu(dependencies, k=1).any():
+            raise ValueError(
+                f"semi_implicit_euler is explicit Euler for {type(self.system).__name__}, "
+                "as no component of its state depends on a later one. It needs "
+                "states ordered as positions followed by velocities; use euler "
+                "or rk4 instead."
+            )
+
+    def compile_integrator(self, max_step):
+        if self.fixed_step_method is None and not self.compile_dynamics:
+            return super().create_CasADi_integrator(max_step)
+
+        state_symbolic = rg.array_symb(self.system.dim_state, literal="x")
+        action_symbolic = rg.array_symb(self.system.dim_inputs, literal="u")
+
+        if self.compile_dynamics:
+            compiled_state_dynamics = load_compiled_state_dynamics(
+                self.system, self.compiled_dynamics_dir
+            )
+
+            def state_dynamics(state):
+                return compiled_state_dynamics(state, action_symbolic)
+
+        else:
+
+            def state_dynamics(state):
+                return self.system.compute_state_dynamics(
+                    None, state, action_symbolic, _native_dim=True
+                )
+
+        if self.fixed_step_method is None:
+            # Same integrator as `CasADi.create_CasADi_integrator`
+            DAE = {
+                "x": state_symbolic,
+                "p": action_symbolic,
+                "ode": state_dynamics(state_symbolic),
+            }
+            return casadi.integrator("intg", "rk", DAE, 0, max_step)
+
+        if self.fixed_step_method == "euler":
+            state_next = state_symbolic + max_step * state_dynamics(state_symbolic)
+        elif self.fixed_step_method == "rk4":
+            k1 = state_dynamics(state_symbolic)
+            k2 = state_dynamics(state_symbolic + max_step / 2 * k1)
+            k3 = state_dynamics(state_symbolic + max_step / 2 * k2)
+            k4 = state_dynamics(state_symbolic + max_step * k3)
+            state_next = state_symbolic + max_step / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+        elif self.fixed_step_method == "semi_implicit_euler":
+            self.check_semi_implicit_euler_ordering(state_symbolic, action_symbolic)
+            updated_components = []
+            for i in reversed(range(self.system.dim_state)):
+                partially_updated_state = casadi.vertcat(
+                    state_symbolic[: i + 1], *updated_components
+                )
+                updated_components.insert(
+                    0,
+                    state_symbolic[i]
+                    + max_step * state_dynamics(partially_updated_state)[i],
+                )
+            state_next = casadi.vertcat(*updated_components)
+
+        # Same calling convention as a CasADi integrator, so that
+        # `CasADi.CasADiSolver` can step it
+        integrator = casadi.Function(
+            "intg",
+            [state_symbolic, action_symbolic],
+            [state_next],
+            ["x0", "p"],
+            ["xf"],
+        )
+        # Calls to a compiled library cannot be expanded into scalar operations
+        return integrator if self.compile_dynamics else integrator.expand()
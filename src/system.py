@@ -12,6 +12,7 @@ from .animation import (
 )
 from regelum.callback import detach
 import numpy as np
+from typing import Optional
 
 # In the following two classes we want to alter their respective animation callbacks, so we:
 # - detach the default animations
@@ -73,6 +74,50 @@ class Pendulum(Pendulum):
 
         return Dstate
 
+    def compute_state_dynamics_batch(
+        self, states: np.ndarray, inputs: np.ndarray
+    ) -> np.ndarray:
+        """Compute the state dynamics for a batch of states and inputs at once.
+
+        This is a vectorized NumPy counterpart of `compute_state_dynamics`.
+
+        Args:
+            states: The states, an array of shape `(N, dim_state)`.
+            inputs: The inputs, an array of shape `(N, dim_inputs)`.
+
+        Returns:
+            The derivatives of the states, an array of shape `(N, dim_state)`.
+        """
+        mass, grav_const, length = (
+            self._parameters["mass"],
+            self._parameters["grav_const"],
+            self._parameters["length"],
+        )
+        Dstates = np.empty(np.shape(states))
+        Dstates[:, 0] = states[:, 1]
+        Dstates[:, 1] = (
+            grav_const * mass * length * np.sin(states[:, 0]) / 2 + inputs[:, 0]
+        ) / self.pendulum_moment_inertia()
+
+        return Dstates
+
+    def get_observation_batch(
+        self, states: np.ndarray, inputs: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Compute the observations for a batch of states at once.
+
+        This is a vectorized NumPy counterpart of `get_observation`.
+
+        Args:
+            states: The states, an array of shape `(N, dim_state)`.
+            inputs: The inputs, an array of shape `(N, dim_inputs)`. Not used by
+                the systems of the playground.
+
+        Returns:
+            The observations, an array of shape `(N, dim_observation)`.
+        """
+        return np.array(states, dtype=float)
+
 
 class PendulumLooseBounds(Pendulum):
     """The parameters of this system resemble those of a Quanser Rotary Pendulum, but with action bounds large enough to stabilize the system using a PD controller."""
@@ -92,6 +137,13 @@ class PendulumWithGymObservation(Pendulum):
         observation[2] = state[1]
         return observation
 
+    def get_observation_batch(
+        self, states: np.ndarray, inputs: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        return np.stack(
+            (np.cos(states[:, 0]), np.sin(states[:, 0]), states[:, 1]), axis=1
+        )
+
 
 class PendulumWithFriction(Pendulum):
     """The parameters of this system roughly resemble those of a Quanser Rotary Pendulum."""
@@ -125,6 +177,26 @@ class PendulumWithFriction(Pendulum):
 
         return Dstate
 
+    def compute_state_dynamics_batch(
+        self, states: np.ndarray, inputs: np.ndarray
+    ) -> np.ndarray:
+        mass, grav_const, length, friction_coeff = (
+            self._parameters["mass"],
+            self._parameters["grav_const"],
+            self._parameters["length"],
+            self._parameters["friction_coeff"],
+        )
+
+        Dstates = np.empty(np.shape(states))
+        Dstates[:, 0] = states[:, 1]
+        Dstates[:, 1] = (
+            grav_const * mass * length * np.sin(states[:, 0]) / 2 + inputs[:, 0]
+        ) / self.pendulum_moment_inertia() - friction_coeff * states[
+            :, 1
+        ] ** 2 * np.sign(states[:, 1])
+
+        return Dstates
+
 
 class PendulumWithMotor(Pendulum):
     """The parameters of this system roughly resemble those of a Quanser Rotary Pendulum."""
@@ -175,6 +247,25 @@ class PendulumWithMotor(Pendulum):
 
         return Dstate
 
+    def compute_state_dynamics_batch(
+        self, states: np.ndarray, inputs: np.ndarray
+    ) -> np.ndarray:
+        mass, grav_const, length, motor_time_const = (
+            self._parameters["mass"],
+            self._parameters["grav_const"],
+            self._parameters["length"],
+            self._parameters["motor_time_const"],
+        )
+
+        Dstates = np.empty(np.shape(states))
+        Dstates[:, 0] = states[:, 1]
+        Dstates[:, 1] = (
+            mass * grav_const * length * np.sin(states[:, 0]) / 2 + states[:, 2]
+        ) / (self.pendulum_moment_inertia() + self.motor_moment())
+        Dstates[:, 2] = (inputs[:, 0] - states[:, 2]) / motor_time_const
+
+        return Dstates
+
 
 class LunarLanderWithOffset(LunarLander):
     def _get_observation(self, time, state, inputs):
@@ -183,3 +274,105 @@ class LunarLanderWithOffset(LunarLander):
             prototype=state,
             _force_numeric=True,
         )
+
+    def get_observation_batch(
+        self, states: np.ndarray, inputs: Optional[np.ndarray] = None
+    ) -> np.ndarray:
+        """Compute the observations for a batch of states at once.
+
+        Args:
+            states: The states, an array of shape `(N, dim_state)`.
+            inputs: Not used.
+
+        Returns:
+            The observations, an array of shape `(N, dim_observation)`.
+        """
+        return states - np.array([0.0, 1.0, 0.0, 0.0, 0.0, 0.0])
+
+    def compute_state_dynamics_batch(
+        self, states: np.ndarray, inputs: np.ndarray
+    ) -> np.ndarray:
+        """Compute the state dynamics for a batch of states and inputs at once.
+
+        This is a vectorized NumPy counterpart of `compute_state_dynamics`, which
+        follows `LunarLander._compute_state_dynamics` case by case. Unlike the
+        latter, it does not update the `is_landed` and similar attributes.
+
+        Args:
+            states: The states, an array of shape `(N, dim_state)`.
+            inputs: The inputs, an array of shape `(N, dim_inputs)`.
+
+        Returns:
+            The derivatives of the states, an array of shape `(N, dim_state)`.
+        """
+        m, J, g, a, r = (
+            self.parameters["m"],
+            self.parameters["J"],
+            self.parameters["g"],
+            self.parameters["a"],
+            self.parameters["r"],
+        )
+        y, theta = states[:, 1], states[:, 2]
+        x_dot, y_dot, theta_dot = states[:, 3], states[:, 4], states[:, 5]
+
+        # Heights of the supports, see `LunarLander._compute_supports_geometry`
+        left_support_y = y - a * np.sin(theta) - r * np.cos(theta)
+        right_support_y = y + a * np.sin(theta) - r * np.cos(theta)
+        is_landed_left = (left_support_y <= 0).astype(float)
+        is_landed_right = (right_support_y <= 0).astype(float)
+        is_landed_vertex = (y <= 0).astype(float)
+        is_support_landed = (is_landed_left + is_landed_right > 0).astype(float)
+        is_freezed = (is_landed_left * is_landed_right + is_landed_vertex > 0).astype(
+            float
+        )
+        is_landed = (is_landed_left + is_landed_right + is_landed_vertex > 0).astype(
+            float
+        )
+
+        F_l = inputs[:, 0] * (1 - is_support_landed)
+        F_t = inputs[:, 1] * (1 - is_support_landed)
+        Dstates_before_landing = np.stack(
+            (
+                x_dot,
+                y_dot,
+                theta_dot,
+                1 / m * (F_l * np.cos(theta) - F_t * np.sin(theta)),
+                1 / m * (F_l * np.sin(theta) + F_t * np.cos(theta)) - g,
+                (4 * F_l) / J,
+            ),
+            axis=1,
+        )
+        Dstates_landed_right = self._compute_pendulum_dynamics_batch(
+            -theta - self.alpha, theta_dot
+        )
+        Dstates_landed_left = self._compute_pendulum_dynamics_batch(
+            self.alpha - theta, theta_dot
+        )
+
+        return (1 - is_freezed)[:, None] * (
+            (1 - is_landed)[:, None] * Dstates_before_landing
+            + is_landed[:, None]
+            * (
+                is_landed_right[:, None] * Dstates_landed_right
+                + is_landed_left[:, None] * Dstates_landed_left
+            )
+        )
+
+    def _compute_pendulum_dynamics_batch(
+        self, angle: np.ndarray, angle_dot: np.ndarray
+    ) -> np.ndarray:
+        g = self.parameters["g"]
+        x = self.l * np.sin(angle)
+        y = self.l * np.cos(angle)
+        angular_acceleration = g / self.l**2 * x
+        return np.stack(
+            (
+                angle_dot * y,
+                -angle_dot * x,
+                -angle_dot,
+                y * angular_acceleration - angle_dot**2 * x,
+                -x * angular_acceleration - angle_dot**2 * y,
+                angular_acceleration,
+            ),
+            axis=1,
+        )
@@ -0,0 +1,93 @@
+import random
+
+import numpy as np
+import torch
+
+from src.scenario.checkpoint import (
+    Checkpointer,
+    Deferred,
+    plain_attributes,
+    rng_state,
+    set_rng_state,
+    snapshot,
+)
+
+
+def test_checkpoint_round_trip(tmp_path):
+    checkpointer = Checkpointer(tmp_path, interval=10)
+    weights, array = torch.arange(3.0), np.arange(3.0)
+    assert checkpointer.is_due(10) and not checkpointer.is_due(5)
+    checkpointer.save(10, {"counters": {"global_step": 10}, "w": weights, "a": array})
+    # The state is copied when saved
+    weights += 1
+    array += 1
+    checkpointer.close()
+
+    state = Checkpointer(tmp_path, interval=10).load_latest()
+    assert state["counters"]["global_step"] == 10
+    torch.testing.assert_close(state["w"], torch.arange(3.0))
+    np.testing.assert_array_equal(state["a"], np.arange(3.0))
+
+
+def test_only_most_recent_checkpoints_are_kept(tmp_path):
+    checkpointer = Checkpointer(tmp_path, interval=1, keep=2)
+    for global_step in [1, 2, 3]:
+        checkpointer.save(global_step, {"counters": {"global_step": global_step}})
+    checkpointer.close()
+
+    resumed = Checkpointer(tmp_path, interval=1, keep=2)
+    assert [path.name for path in resumed.paths()] == [
+        "checkpoint_2.pt",
+        "checkpoint_3.pt",
+    ]
+    assert resumed.load_latest()["counters"]["global_step"] == 3
+    assert resumed.last_step == 3
+
+
+def test_rng_state_round_trip():
+    state = rng_state()
+    expected = (random.random(), np.random.rand(), torch.rand(1))
+    set_rng_state(state)
+    assert random.random() == expected[0]
+    assert np.random.rand() == expected[1]
+    assert torch.equal(torch.rand(1), expected[2])
+
+
+def test_plain_attributes_keeps_arrays_and_numbers():
+    class Agent:
+        pass
+
+    agent = Agent()
+    agent.weights = np.ones(2)
+    agent.counter = 3
+    agent.probability = 0.5
+    agent.history = [1, 2]
+    agent.model = torch.nn.Linear(1, 1)
+
+    attributes = plain_attributes(agent)
+    assert set(attributes) == {"weights", "counter", "probability"}
+    agent.weights += 1
+    np.testing.assert_array_equal(attributes["weights"], np.ones(2))
+
+
+def test_deferred_values_are_written_without_a_copy(tmp_path):
+    checkpointer = Checkpointer(tmp_path, interval=1)
+    array = np.arange(3.0)
+    state = {"counters": {"global_step": 1}, "array": Deferred(array)}
+    assert snapshot(state)["array"] is state["array"]
+    checkpointer.save(1, state)
+    checkpointer.close()
+
+    loaded = Checkpointer(tmp_path, interval=1).load_latest()
+    assert isinstance(loaded["array"], np.ndarray)
+    assert len(loaded["array"]) == 3
+
+
+def test_due_checkpoint_is_postponed_while_writer_is_busy(tmp_path):
+    checkpointer = Checkpointer(tmp_path, interval=1)
+    # With the writer stopped, a queued checkpoint keeps waiting
+    checkpointer.close()
+    checkpointer.queue.put((1, {}))
+    assert not checkpointer.is_due(5)
+    checkpointer.queue.get_nowait()
+    assert checkpointer.is_due(5)
@@ -0,0 +1,45 @@
+import pytest
+import torch
+
+from src.scenario.critic import QEnsemble, soft_update
+
+
+@pytest.fixture
+def ensemble():
+    torch.manual_seed(0)
+    return QEnsemble(dim_action=1, dim_observation=3, num_critics=3, hidden_size=16)
+
+
+def test_members_match_ensemble_evaluation(ensemble):
+    x, a = torch.randn(8, 3), torch.randn(8, 1)
+    values = ensemble(x, a)
+    assert values.shape == (3, 8, 1)
+    for index in range(3):
+        torch.testing.assert_close(values[index], ensemble.member(index, x, a))
+    torch.testing.assert_close(ensemble.min(x, a), values.min(dim=0).values)
+
+
+def test_min_over_random_members(ensemble):
+    x, a = torch.randn(8, 3), torch.randn(8, 1)
+    values = ensemble(x, a)
+    minimum = ensemble.min(x, a, num_min_critics=1)
+    assert any(torch.equal(minimum, member) for member in values)
+
+
+@pytest.mark.parametrize("num_min_critics", [0, -1, 4])
+def test_invalid_num_min_critics(ensemble, num_min_critics):
+    with pytest.raises(ValueError):
+        ensemble.min(torch.randn(2, 3), torch.randn(2, 1), num_min_critics)
+
+
+def test_soft_update(ensemble):
+    target = QEnsemble(dim_action=1, dim_observation=3, num_critics=3, hidden_size=16)
+    expected = [
+        0.25 * parameter + 0.75 * target_parameter
+        for target_parameter, parameter in zip(
+            target.parameters(), ensemble.parameters()
+        )
+    ]
+    soft_update(target.parameters(), ensemble.parameters(), 0.25)
+    for parameter, expected_parameter in zip(target.parameters(), expected):
+        torch.testing.assert_close(parameter, expected_parameter)
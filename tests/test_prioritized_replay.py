@@ -0,0 +1,80 @@
+import numpy as np
+import pytest
+
+from src.scenario.prioritized_replay import PrioritizedReplayBuffer, SumTree
+
+
+def add_transitions(buffer: PrioritizedReplayBuffer, num_transitions: int):
+    for step in range(num_transitions):
+        observation = np.full((1, 2), step, dtype=np.float32)
+        buffer.add(observation, observation, np.zeros((1, 1)), np.zeros(1), np.zeros(1))
+
+
+def test_sum_tree_sums_minima_and_prefix_search():
+    tree = SumTree(5)
+    tree.update(np.arange(5), np.array([1.0, 2.0, 3.0, 4.0, 5.0]))
+    assert tree.total == 15
+    assert tree.min == 1
+    np.testing.assert_array_equal(
+        tree.find(np.array([0.5, 1.5, 3.5, 14.9])), [0, 1, 2, 4]
+    )
+
+    tree.update(np.array([2]), np.array([10.0]))
+    assert tree.total == 22
+    assert tree.priorities[2] == 10
+
+    tree.rebuild(np.array([0.5, 2.0]))
+    assert tree.total == 2.5
+    assert tree.min == 0.5
+    np.testing.assert_array_equal(tree.priorities[2:], 0)
+
+
+def test_sampling_follows_updated_priorities():
+    buffer = PrioritizedReplayBuffer(
+        4, dim_observation=2, dim_action=1, batch_size=64, alpha=1.0, seed=0
+    )
+    add_transitions(buffer, 4)
+    np.testing.assert_array_equal(buffer.tree.priorities[:4], 1.0)
+
+    buffer.update_priorities(np.arange(4), np.array([0.0, 0.0, 0.0, 100.0]))
+    assert buffer.max_priority == pytest.approx(100.0)
+    batch = buffer.sample()
+    np.testing.assert_array_equal(batch.indices, 3)
+    np.testing.assert_array_equal(batch.observations[:, 0].numpy(), 3)
+    # Normalized by the weight of the smallest priority
+    expected_weight = ((100.0 + 1e-6) / 1e-6) ** -0.4
+    np.testing.assert_allclose(batch.weights.numpy(), expected_weight, rtol=1e-5)
+    assert batch.weights.max() <= 1
+
+
+def test_new_transitions_get_max_priority():
+    buffer = PrioritizedReplayBuffer(4, dim_observation=2, dim_action=1, batch_size=2)
+    add_transitions(buffer, 2)
+    buffer.update_priorities(np.array([0]), np.array([3.0]))
+    add_transitions(buffer, 1)
+    assert buffer.tree.priorities[2] == buffer.max_priority
+
+
+def test_beta_is_annealed_to_one():
+    buffer = PrioritizedReplayBuffer(
+        4, dim_observation=2, dim_action=1, batch_size=2, beta=0.4, beta_steps=10
+    )
+    add_transitions(buffer, 4)
+    for _ in range(5):
+        buffer.sample()
+    assert buffer.beta == pytest.approx(0.7)
+    for _ in range(10):
+        buffer.sample()
+    assert buffer.beta == pytest.approx(1.0)
+
+
+def test_state_dict_round_trip_restores_priorities():
+    buffer = PrioritizedReplayBuffer(4, dim_observation=2, dim_action=1, batch_size=2)
+    add_transitions(buffer, 3)
+    buffer.update_priorities(np.arange(3), np.array([1.0, 2.0, 3.0]))
+
+    restored = PrioritizedReplayBuffer(4, dim_observation=2, dim_action=1, batch_size=2)
+    restored.load_state_dict(buffer.state_dict())
+    np.testing.assert_array_equal(restored.tree.priorities, buffer.tree.priorities)
+    assert restored.tree.total == pytest.approx(buffer.tree.total)
+    assert restored.max_priority == buffer.max_priority
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+import torch
+
+from src.scenario.replay_buffer import ReplayBuffer
+
+
+def transitions(start: int, num_envs: int):
+    """Transitions whose observations are `start, start + 1, ...`."""
+    values = np.arange(start, start + num_envs, dtype=np.float32)
+    observations = np.repeat(values[:, None], 2, axis=1)
+    return (
+        observations,
+        observations + 1,
+        2 * values[:, None],
+        -values,
+        np.zeros(num_envs),
+    )
+
+
+def fill(buffer: ReplayBuffer, num_transitions: int, num_envs: int = 1):
+    for start in range(0, num_transitions, num_envs):
+        buffer.add(*transitions(start, num_envs))
+
+
+def test_ring_overwrites_oldest_transitions():
+    buffer = ReplayBuffer(5, dim_observation=2, dim_action=1, batch_size=4)
+    fill(buffer, 7)
+    assert len(buffer) == 5
+    assert buffer.pos == 2
+    np.testing.assert_array_equal(buffer.observations[:, 0], [5, 6, 2, 3, 4])
+    np.testing.assert_array_equal(buffer.actions[:, 0], [10, 12, 4, 6, 8])
+
+
+def test_memmap_buffer_matches_buffer_in_ram(tmp_path):
+    in_ram = ReplayBuffer(5, dim_observation=2, dim_action=1, batch_size=4)
+    memmap = ReplayBuffer(
+        5, 2, 1, batch_size=4, storage_dir=tmp_path, hot_window=3
+    )
+    for buffer in [in_ram, memmap]:
+        fill(buffer, 12, num_envs=2)
+    memmap.flush()
+    for name in ["observations", "actions", "next_observations", "rewards"]:
+        np.testing.assert_array_equal(getattr(memmap, name), getattr(in_ram, name))
+    assert (memmap.pos, len(memmap)) == (in_ram.pos, len(in_ram))
+
+
+def test_hot_window_is_clamped_to_buffer_size(tmp_path):
+    in_ram = ReplayBuffer(5, dim_observation=2, dim_action=1, batch_size=4)
+    memmap = ReplayBuffer(
+        5, 2, 1, batch_size=4, storage_dir=tmp_path, hot_window=100
+    )
+    assert memmap.hot_window == 5
+    for buffer in [in_ram, memmap]:
+        fill(buffer, 13)
+    memmap.flush()
+    np.testing.assert_array_equal(memmap.observations, in_ram.observations)
+
+
+def test_samples_include_transitions_of_hot_window(tmp_path):
+    buffer = ReplayBuffer(
+        8, 2, 1, batch_size=64, storage_dir=tmp_path, hot_window=4, seed=0
+    )
+    fill(buffer, 3)
+    assert buffer._hot_size == 3
+    batch = buffer.sample()
+    observations = batch.observations[:, 0]
+    assert set(observations.tolist()) <= {0.0, 1.0, 2.0}
+    torch.testing.assert_close(batch.actions[:, 0], 2 * observations)
+    torch.testing.assert_close(batch.next_observations, batch.observations + 1)
+
+
+def test_save_and_load_restore_buffer(tmp_path):
+    buffer = ReplayBuffer(5, dim_observation=2, dim_action=1, batch_size=4)
+    fill(buffer, 7)
+    buffer.save(tmp_path / "saved")
+
+    loaded = ReplayBuffer(5, dim_observation=2, dim_action=1, batch_size=4)
+    loaded.load(tmp_path / "saved")
+    assert (loaded.pos, len(loaded)) == (buffer.pos, len(buffer))
+    for name in ["observations", "actions", "next_observations", "dones", "rewards"]:
+        np.testing.assert_array_equal(getattr(loaded, name), getattr(buffer, name))
+
+
+def test_memmap_buffer_reloads_its_storage_dir(tmp_path):
+    buffer = ReplayBuffer(5, 2, 1, batch_size=4, storage_dir=tmp_path, hot_window=2)
+    fill(buffer, 4)
+    buffer.save(tmp_path)
+    observations = np.array(buffer.observations)
+    del buffer
+
+    reopened = ReplayBuffer(5, 2, 1, batch_size=4, storage_dir=tmp_path, hot_window=2)
+    reopened.load(tmp_path)
+    assert (reopened.pos, len(reopened)) == (4, 4)
+    np.testing.assert_array_equal(reopened.observations[:4], observations[:4])
+
+
+def test_state_dict_round_trip_samples_same_batches():
+    buffer = ReplayBuffer(5, dim_observation=2, dim_action=1, batch_size=4, seed=0)
+    fill(buffer, 7)
+    restored = ReplayBuffer(5, dim_observation=2, dim_action=1, batch_size=4)
+    restored.load_state_dict(buffer.state_dict())
+
+    expected = [tensor.clone() for tensor in buffer.sample()]
+    for tensor, expected_tensor in zip(restored.sample(), expected):
+        torch.testing.assert_close(tensor, expected_tensor)
+
+
+def test_memmap_state_dict_leaves_transitions_in_files(tmp_path):
+    buffer = ReplayBuffer(5, 2, 1, batch_size=4, storage_dir=tmp_path, hot_window=4)
+    fill(buffer, 3)
+    state = buffer.state_dict()
+    assert "observations" not in state
+    assert buffer._hot_size == 0
+    np.testing.assert_array_equal(
+        np.load(tmp_path / "observations.npy")[:3, 0], [0, 1, 2]
+    )
+
+    reopened = ReplayBuffer(5, 2, 1, batch_size=4, storage_dir=tmp_path, hot_window=4)
+    reopened.load_state_dict(state)
+    assert (reopened.pos, len(reopened)) == (3, 3)
+    with pytest.raises(ValueError):
+        ReplayBuffer(5, 2, 1, batch_size=4).load_state_dict(state)
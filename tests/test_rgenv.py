@@ -0,0 +1,62 @@
+import gymnasium as gym
+import numpy as np
+import pytest
+
+from benchmarks.presets import make_system
+from src.objective import GymPendulumRunningObjective
+from src.rgenv import BatchedRgEnv, RgEnv
+from src.simulator import StateInitRandomSamplerSimulator
+
+
+def make_simulator():
+    # 0.1 is not a multiple of 0.01 in floating point, so the simulator takes
+    # 11 integration steps per episode
+    return StateInitRandomSamplerSimulator(
+        system=make_system("pendulum_with_gym_observation"),
+        state_init=lambda: np.array([[2.0, 0.5]]),
+        time_final=0.1,
+        max_step=0.01,
+    )
+
+
+def rollout(envs, actions):
+    observations, _ = envs.reset(seed=0)
+    steps = []
+    for action in actions:
+        next_observations, rewards, _, truncations, infos = envs.step(action)
+        episode = None
+        if "final_info" in infos:
+            episode = infos["final_info"][0]["episode"]
+        steps.append((observations, rewards, truncations, episode))
+        observations = next_observations
+    return steps
+
+
+def test_batched_env_with_one_copy_matches_rg_env():
+    objective = GymPendulumRunningObjective()
+    actions = np.random.default_rng(0).uniform(-0.1, 0.1, size=(30, 1, 1))
+    expected = rollout(
+        gym.vector.SyncVectorEnv(
+            [lambda: gym.wrappers.RecordEpisodeStatistics(RgEnv(make_simulator(), objective))]
+        ),
+        actions,
+    )
+    steps = rollout(BatchedRgEnv(make_simulator(), objective, num_envs=1), actions)
+
+    assert BatchedRgEnv(make_simulator(), objective, 1).episode_length == 11
+    num_episodes = 0
+    for (observations, rewards, truncations, episode), expected_step in zip(
+        steps, expected
+    ):
+        expected_observations, expected_rewards, expected_truncations, expected_episode = (
+            expected_step
+        )
+        np.testing.assert_allclose(observations, expected_observations, atol=1e-10)
+        np.testing.assert_allclose(rewards, expected_rewards, atol=1e-10)
+        np.testing.assert_array_equal(truncations, expected_truncations)
+        assert (episode is None) == (expected_episode is None)
+        if episode is not None:
+            num_episodes += 1
+            assert episode["l"] == expected_episode["l"] == 12
+            assert episode["r"] == pytest.approx(float(expected_episode["r"]))
+    assert num_episodes == 2
@@ -0,0 +1,82 @@
+import numpy as np
+import pytest
+
+from benchmarks.presets import list_system_presets, make_system
+
+BATCHED_PRESETS = [
+    name
+    for name in list_system_presets()
+    if hasattr(make_system(name), "compute_state_dynamics_batch")
+]
+
+
+def random_states_and_inputs(system, num_states: int = 64, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    states = rng.uniform(-3.0, 3.0, size=(num_states, system.dim_state))
+    if system.dim_state == 6:
+        # The lunar lander: half of the states airborne, half of them around
+        # the ground, where one or both supports or the vertex touch it
+        states[: num_states // 2, 1] = rng.uniform(2.0, 5.0, num_states // 2)
+        states[num_states // 2 :, 1] = rng.uniform(-0.3, 0.3, num_states // 2)
+    action_bounds = np.array(system.action_bounds)
+    inputs = rng.uniform(
+        action_bounds[:, 0], action_bounds[:, 1], size=(num_states, len(action_bounds))
+    )
+    return states, inputs
+
+
+def test_batched_presets_include_lunar_lander():
+    assert "lunar_lander" in BATCHED_PRESETS
+
+
+@pytest.mark.parametrize("name", BATCHED_PRESETS)
+def test_batch_dynamics_match_per_row_dynamics(name):
+    system = make_system(name)
+    states, inputs = random_states_and_inputs(system)
+    expected = np.vstack(
+        [
+            np.reshape(
+                system.compute_state_dynamics(
+                    None, state.reshape(1, -1), action.reshape(1, -1)
+                ),
+                -1,
+            )
+            for state, action in zip(states, inputs)
+        ]
+    )
+    np.testing.assert_allclose(
+        system.compute_state_dynamics_batch(states, inputs), expected, atol=1e-12
+    )
+
+
+@pytest.mark.parametrize("name", BATCHED_PRESETS)
+def test_batch_observations_match_per_row_observations(name):
+    system = make_system(name)
+    states, inputs = random_states_and_inputs(system)
+    expected = np.vstack(
+        [
+            np.reshape(
+                system.get_observation(
+                    None, state.reshape(1, -1), action.reshape(1, -1)
+                ),
+                -1,
+            )
+            for state, action in zip(states, inputs)
+        ]
+    )
+    np.testing.assert_allclose(
+        system.get_observation_batch(states, inputs), expected, atol=1e-12
+    )
+
+
+def test_lunar_lander_states_cover_landed_and_airborne_cases():
+    system = make_system("lunar_lander")
+    states, _ = random_states_and_inputs(system)
+    a, r = system.parameters["a"], system.parameters["r"]
+    y, theta = states[:, 1], states[:, 2]
+    is_landed_left = y - a * np.sin(theta) - r * np.cos(theta) <= 0
+    is_landed_right = y + a * np.sin(theta) - r * np.cos(theta) <= 0
+    is_landed = is_landed_left | is_landed_right | (y <= 0)
+    assert is_landed.any() and (~is_landed).any()
+    # Landed on a single support, where the pendulum dynamics apply
+    assert (is_landed_left ^ is_landed_right).any()
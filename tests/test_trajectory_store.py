@@ -0,0 +1,34 @@
+import numpy as np
+
+from src.scenario.recording import TrajectoryRecorder
+from src.scenario.trajectory_store import TrajectoryStoreCallback, read_trajectories
+
+
+def test_callback_stores_dumped_data_buffer(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    callback = TrajectoryStoreCallback(chunk_size=3)
+    recorder = TrajectoryRecorder(2, dim_state=2, dim_observation=3, dim_action=1)
+    for step in range(5):
+        recorder.record(
+            state=np.full(2, step),
+            obs=np.full(3, step),
+            action=np.full(1, -step),
+            reward=0.5 * step,
+            time=0.1 * step,
+            global_step=step,
+            value=step,
+        )
+
+    callback.on_function_call(None, "dump_data_buffer", (1, recorder.data_buffer(1, 1)))
+    callback.on_function_call(None, "end_run", None)
+    callback.on_termination(None)
+
+    trajectories = read_trajectories(
+        tmp_path / ".callbacks/TrajectoryStoreCallback/trajectories.arrows"
+    )
+    np.testing.assert_array_equal(trajectories["step_id"], np.arange(5))
+    np.testing.assert_array_equal(trajectories["episode_id"], np.ones(5))
+    np.testing.assert_allclose(trajectories["time"], 0.1 * np.arange(5))
+    assert trajectories["observation"].shape == (5, 3)
+    np.testing.assert_array_equal(trajectories["action"][:, 0], -np.arange(5))
+    assert np.isnan(trajectories["current_value"]).all()